@@ -0,0 +1,64 @@
+"""
+Benchmark building and logging request.proc with many tests.
+
+Compares ProctorGroups and LazyProctorGroups with the previous approach of
+setting one instance attribute per test, and building the group string of a
+new ProctorGroups with the previous approach of formatting every test.
+
+    DJANGO_SETTINGS_MODULE=proctor.tests.settings python -m benchmarks.bench_groups
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import numbers
+import timeit
+
+import six
+
+from proctor import api, groups, lazy
+
+TEST_COUNTS = (10, 100, 500)
+NUMBER = 10000
+
+
+class AttributeProctorGroups(object):
+    """
+    ProctorGroups as it was: a hasattr() and setattr() per test.
+    """
+
+    def __init__(self, group_dict):
+        self._group_dict = group_dict
+        for test_name, assignment in six.iteritems(group_dict):
+            if not hasattr(self, test_name):
+                setattr(self, test_name, assignment)
+
+    def __str__(self):
+        return ','.join(
+            test_name + str(assignment.value)
+            for test_name, assignment in six.iteritems(self._group_dict)
+            if (assignment is not groups._UNASSIGNED_GROUP and
+                isinstance(assignment.value, numbers.Number) and
+                assignment.value >= 0))
+
+
+def main():
+    for test_count in TEST_COUNTS:
+        defined_tests = ['test{0}'.format(i) for i in range(test_count)]
+        group_dict = {test_name: groups.intern_assignment('1', 'active', i % 3 - 1, None)
+                      for i, test_name in enumerate(defined_tests)}
+        params = api.ProctorParameters(
+            api_root='http://proctor.example.com', defined_tests=defined_tests,
+            context_dict={}, identifier_dict={'account': 1}, force_groups=None)
+
+        for name, build in [
+                ('setattr per test', lambda: AttributeProctorGroups(group_dict)),
+                ('ProctorGroups', lambda: groups.ProctorGroups(group_dict)),
+                ('LazyProctorGroups', lambda: lazy.LazyProctorGroups(params)),
+                ('str, format per test', lambda: str(AttributeProctorGroups(group_dict))),
+                ('str, memoized', lambda: str(groups.ProctorGroups(group_dict)))]:
+            seconds = min(timeit.repeat(build, number=NUMBER, repeat=3))
+            print('{0:>4} tests  {1:<22} {2:8.2f} us'.format(
+                test_count, name, seconds / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import django
+
+if django.VERSION < (3, 2):
+    # Found automatically since Django 3.2.
+    default_app_config = 'proctor.apps.ProctorConfig'
@@ -0,0 +1,318 @@
+"""
+Provide asyncio counterparts of the Proctor API client and group loading.
+
+Under ASGI, a blocking Proctor API call made from the synchronous middleware
+ties up a worker thread for every request waiting on Proctor. The coroutines
+here await the API call on the event loop instead, so one worker can serve
+many requests that are waiting on Proctor.
+
+Async HTTP calls use httpx, which must be installed separately:
+
+    $ pip install django-proctor[async]
+
+This module requires Python 3. Everything else in django-proctor reaches it
+through methods like Cacher.aget() and LazyProctorGroups.aload(), which return
+awaitables.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import logging
+import socket
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.urls import Resolver404, resolve
+
+from . import api
+from . import breaker as circuit_breaker
+from . import constants
+from . import groups
+from . import identify
+from . import lazy as lazy_groups
+from . import session
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger('application.proctor.aio')
+
+if httpx is not None:
+    _TIMEOUT_ERRORS = (asyncio.TimeoutError, socket.timeout, httpx.TimeoutException,
+                       api.DeadlineExceeded)
+    _CONNECTION_ERRORS = (httpx.TransportError, OSError)
+    _REQUEST_ERRORS = (httpx.HTTPError,)
+else:
+    _TIMEOUT_ERRORS = (asyncio.TimeoutError, socket.timeout, api.DeadlineExceeded)
+    _CONNECTION_ERRORS = (OSError,)
+    _REQUEST_ERRORS = ()
+
+# httpx clients are bound to the event loop that first used them.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_client():
+    """
+    Return the pooled httpx.AsyncClient for the running event loop.
+
+    Its pool size and keep-alive expiry follow the process-wide
+    session.SessionManager settings.
+    """
+    if httpx is None:
+        raise ImportError("httpx is required for asyncio Proctor API calls. "
+                          "Install django-proctor[async].")
+
+    # get_running_loop() is new in Python 3.7. In a coroutine,
+    # get_event_loop() returns the running loop too.
+    loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+    client = _clients.get(loop)
+    if client is None:
+        manager = session.get_default_manager()
+        limits = httpx.Limits(max_connections=manager.pool_size,
+                              max_keepalive_connections=manager.pool_size,
+                              keepalive_expiry=manager.idle_timeout_seconds)
+        client = _clients[loop] = httpx.AsyncClient(limits=limits)
+    return client
+
+
+async def _get_with_retries(http, api_url, http_params, timeout, deadline):
+    attempt = 0
+    while True:
+        attempt += 1
+        attempt_timeout = api.get_attempt_timeout(timeout, deadline)
+        try:
+            return await http.get(api_url, params=http_params, timeout=attempt_timeout)
+        except Exception:
+            backoff = api.get_backoff_seconds(attempt)
+            if not api.should_retry(attempt, backoff, deadline):
+                raise
+        await asyncio.sleep(backoff)
+
+
+async def call_proctor_identify(params, timeout=constants.MAX_HTTP_TIMEOUT_SECONDS, http=None,
+                                deadline_seconds=constants.MAX_HTTP_DEADLINE_SECONDS):
+    return await call_proctor(params, constants.API_METHOD_GROUPS_IDENTIFY, timeout, http,
+                              deadline_seconds)
+
+
+async def call_proctor_matrix(params, timeout=constants.MAX_HTTP_TIMEOUT_SECONDS, http=None,
+                              deadline_seconds=constants.MAX_HTTP_DEADLINE_SECONDS):
+    return await call_proctor(params, constants.API_METHOD_PROCTOR_MATRIX, timeout, http,
+                              deadline_seconds)
+
+
+async def call_proctor(params, api_method=constants.API_METHOD_GROUPS_IDENTIFY,
+                       timeout=constants.MAX_HTTP_TIMEOUT_SECONDS, http=None,
+                       deadline_seconds=constants.MAX_HTTP_DEADLINE_SECONDS):
+    """
+    Async counterpart of api.call_proctor().
+
+    Return the JSON API response or None if there was an error.
+
+    http: Instance of httpx.AsyncClient (or equivalent with an awaitable get).
+        If None, the pooled client from get_client() is used.
+
+    Shares the circuit breaker and deadline budget of api.call_proctor().
+    """
+    http = http or get_client()
+
+    api_url = api.get_api_url(params, api_method)
+    http_params = api.get_http_params(params)
+
+    if api.is_negative_cached(params, api_method):
+        logger.debug("Proctor API call to %s failed recently. Skipping request.", api_url)
+        api.record_call(api_method, 'negative_cached')
+        return None
+
+    breaker = circuit_breaker.get_breaker(params.api_root)
+    if not breaker.allow_request():
+        logger.debug("Proctor API circuit to %s is open. Skipping request.", api_url)
+        api.record_call(api_method, 'circuit_open')
+        return None
+
+    started_at = time.time()
+
+    try:
+        logger.debug("Calling Proctor API: %s with %s", api_url, http_params)
+        response = await _get_with_retries(http, api_url, http_params, timeout,
+                                           api.get_deadline(deadline_seconds))
+    except _TIMEOUT_ERRORS:
+        breaker.record_failure()
+        logger.exception("Proctor API request to %s timed out.", api_url)
+        api.record_call(api_method, 'timeout', started_at)
+        api.remember_failure(params, api_method, root_wide=True)
+        return None
+    except _CONNECTION_ERRORS:
+        breaker.record_failure()
+        logger.exception("Proctor API request to %s had a connection error.", api_url)
+        api.record_call(api_method, 'connection_error', started_at)
+        api.remember_failure(params, api_method, root_wide=True)
+        return None
+    except _REQUEST_ERRORS:
+        breaker.record_failure()
+        logger.exception("Proctor API request to %s threw an exception.", api_url)
+        api.record_call(api_method, 'error', started_at)
+        api.remember_failure(params, api_method, root_wide=True)
+        return None
+    except Exception:
+        breaker.record_failure()
+        api.record_call(api_method, 'error', started_at)
+        raise
+
+    api.record_response(breaker, response)
+    api_response = api.parse_response(api_url, api_method, response)
+    api.record_call(api_method, api.get_outcome(response, api_response), started_at)
+    if api_response is None:
+        api.remember_failure(params, api_method,
+                             root_wide=response.status_code in api._SERVER_ERROR_CODES)
+    return api_response
+
+
+async def cacher_get(cacher, request, params, allow_expired=False):
+    """
+    Async counterpart of cacher.get().
+
+    Cache backends are synchronous, so the lookup runs in a thread. Cachers
+    that use the request (like the session) stay on the request's thread.
+    """
+    get = sync_to_async(cacher.get, thread_sensitive=cacher.request_scoped)
+    return await get(request, params, allow_expired=allow_expired)
+
+
+async def cacher_lookup(cacher, request, params):
+    """
+    Async counterpart of cacher.lookup().
+    """
+    lookup = sync_to_async(cacher.lookup, thread_sensitive=cacher.request_scoped)
+    return await lookup(request, params)
+
+
+async def cacher_set(cacher, request, params, group_dict, api_response):
+    """
+    Async counterpart of cacher.set().
+    """
+    set_ = sync_to_async(cacher.set, thread_sensitive=cacher.request_scoped)
+    await set_(request, params, group_dict, api_response)
+
+
+async def identify_groups(params, cacher=None, request=None, lazy=False, http=None,
+                          evaluator=None):
+    """
+    Async counterpart of identify.identify_groups().
+
+    If lazy is True, nothing is loaded yet. The returned LazyProctorGroups can
+    be loaded with "await proc.aload()" or synchronously on first access.
+    """
+    unassigned_groups = identify.get_unassigned_groups(params, evaluator)
+    if unassigned_groups is not None:
+        return unassigned_groups
+    if lazy:
+        return lazy_groups.LazyProctorGroups(params, cacher, request, None, evaluator)
+    else:
+        return groups.ProctorGroups(
+            await load_group_dict(params, cacher, request, http, evaluator))
+
+
+async def load_group_dict(params, cacher=None, request=None, http=None, evaluator=None):
+    """
+    Async counterpart of identify.load_group_dict().
+    """
+    group_dict = None
+    cached = None
+    if cacher is not None:
+        cached = await cacher_lookup(cacher, request, params)
+        if cached.stale:
+            # The refresh runs in a worker thread, so it can't use the async client.
+            identify.revalidate(params, cacher, None, evaluator, cached)
+        if cached.stale or not cached.changed_tests:
+            group_dict = cached.group_dict
+    if group_dict is None:
+        # Cache miss, partially invalid entry, or caching disabled.
+        identify_params = identify.get_identify_params(params, cached)
+        api_response = await _identify(identify_params, http, evaluator)
+        if api_response:
+            group_dict = identify.merge_groups(identify_params, api_response, cached)
+        else:
+            # If api request failed, attempt to force load from cache
+            if cacher:
+                group_dict = await cacher_get(cacher, request, params, allow_expired=True)
+                identify.record_fallback(group_dict)
+
+            if not group_dict:
+                group_dict = groups.extract_groups(None, params.defined_tests)
+
+        # Must cache the api response, but not if api had an error.
+        if cacher is not None and api_response is not None:
+            await cacher_set(cacher, request, params, group_dict, api_response)
+
+    return group_dict
+
+
+async def _identify(params, http=None, evaluator=None):
+    if evaluator is not None:
+        if evaluator.needs_download():
+            # Only the first download blocks, so only it goes to a thread.
+            api_response = await sync_to_async(evaluator.identify, thread_sensitive=False)(params)
+        else:
+            api_response = evaluator.identify(params)
+        if api_response is not None:
+            return api_response
+    return await call_proctor_identify(params, http=http)
+
+
+async def load_lazy_groups(proc):
+    """
+    Async counterpart of LazyProctorGroups.load().
+    """
+    if proc.loaded:
+        return proc
+    if proc._prefetch is not None:
+        # Wait for the prefetch without blocking the event loop.
+        await sync_to_async(proc.load, thread_sensitive=False)()
+        return proc
+    proc.set_group_dict(await load_group_dict(
+        proc._params, proc._cacher, proc._request, None, proc._evaluator))
+    return proc
+
+
+def resolve_view(request):
+    """
+    Return the view function Django will call for the request, or None if no
+    URL pattern matches.
+    """
+    try:
+        return resolve(request.path_info, getattr(request, 'urlconf', None)).func
+    except Resolver404:
+        return None
+
+
+async def middleware_call(middleware, request):
+    """
+    Run BaseProctorMiddleware for an async request.
+
+    The overridable hooks like get_identifiers() may touch the database (like
+    request.user), so they run in a thread. The Proctor API call is
+    awaited on the event loop.
+    """
+    if middleware.watcher is not None:
+        middleware.watcher.ensure_running()
+
+    params = await sync_to_async(middleware.get_params)(request)
+    # Groups are identified before get_response() is awaited, so
+    # process_view() is too late to scope them to the view's tests.
+    view_func = resolve_view(request)
+    if view_func is not None:
+        params = middleware.get_view_params(params, view_func)
+
+    if params is None:
+        request.proc = groups.ProctorGroups({})
+    else:
+        request.proc = await identify_groups(
+            params, cacher=middleware.cacher, request=request, lazy=middleware.is_lazy(),
+            http=middleware.get_async_http(), evaluator=middleware.evaluator)
+
+    response = await middleware.get_response(request)
+    return await sync_to_async(middleware.process_response)(request, response)
@@ -1,15 +1,34 @@
 from __future__ import absolute_import, unicode_literals
 
+import hashlib
+import json
 import logging
+import random
 import socket
+import time
 
 import requests
 import six
-from tenacity import retry, stop_after_attempt
+from . import breaker as circuit_breaker
 from . import constants
+from . import metrics
+from . import negative
+from . import session
 
 logger = logging.getLogger('application.proctor.api')
 
+_SERVER_ERROR_CODES = range(500, 600)
+
+# No attempt is started with less time than this left before the deadline.
+_MIN_ATTEMPT_SECONDS = 0.001
+
+
+class DeadlineExceeded(Exception):
+    """
+    The deadline of an API call passed before another attempt could start.
+    Handled like a timeout.
+    """
+
 
 class ProctorParameters(object):
     """
@@ -24,7 +43,13 @@ class ProctorParameters(object):
     context_dict: Context variable source keys and their values.
     identifier_dict: Identifier source keys and their values.
     force_groups: prforceGroups string (from query param or cookie).
+
+    Don't modify context_dict or identifier_dict in place after creating the
+    parameters. The fingerprint is only recomputed when an attribute is set.
     """
+    _FIELDS = frozenset(
+        ['api_root', 'defined_tests', 'context_dict', 'identifier_dict', 'force_groups'])
+
     def __init__(self, api_root, defined_tests, context_dict, identifier_dict, force_groups):
         self.api_root = api_root
         # Sometimes defined_tests is a tuple, which messes up equality testing.
@@ -33,6 +58,35 @@ class ProctorParameters(object):
         self.identifier_dict = identifier_dict
         self.force_groups = force_groups
 
+    def __setattr__(self, name, value):
+        if name in self._FIELDS:
+            self.__dict__['_fingerprint'] = None
+        super(ProctorParameters, self).__setattr__(name, value)
+
+    @property
+    def fingerprint(self):
+        """
+        Return a short stable digest of all the parameters.
+
+        Parameters with equal values always have the same fingerprint, so it
+        identifies them in cache keys and validates cache entries without
+        comparing the parameters themselves. Computed once and memoized.
+        """
+        if self._fingerprint is None:
+            canonical = json.dumps(
+                [self.api_root, self.defined_tests, self.context_dict,
+                 self.identifier_dict, self.force_groups],
+                sort_keys=True, separators=(',', ':'), default=six.text_type)
+            self._fingerprint = hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:20]
+        return self._fingerprint
+
+    def with_tests(self, defined_tests):
+        """
+        Return a copy of the parameters with different defined tests.
+        """
+        return ProctorParameters(self.api_root, defined_tests, self.context_dict,
+                                 self.identifier_dict, self.force_groups)
+
     def as_dict(self):
         return {'api_root': self.api_root,
                 'defined_tests': self.defined_tests,
@@ -51,94 +105,269 @@ class ProctorParameters(object):
         return not (self == other)
 
 
-@retry(stop=stop_after_attempt(constants.MAX_HTTP_RETRIES), reraise=True)
-def _get_with_retries(http, api_url, http_params, timeout):
-    return http.get(api_url, params=http_params, timeout=timeout)
+def _get_with_retries(http, api_url, http_params, timeout, deadline):
+    """
+    Make the HTTP request, retrying with jittered backoff until the deadline.
+
+    All attempts share the deadline (an absolute time.time(), or None), so a
+    hanging API costs at most the deadline and not MAX_HTTP_RETRIES timeouts.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        attempt_timeout = get_attempt_timeout(timeout, deadline)
+        try:
+            return http.get(api_url, params=http_params, timeout=attempt_timeout)
+        except Exception:
+            backoff = get_backoff_seconds(attempt)
+            if not should_retry(attempt, backoff, deadline):
+                raise
+        time.sleep(backoff)
+
+
+def get_attempt_timeout(timeout, deadline):
+    """
+    Return the timeout of one attempt, which must end before the deadline.
+
+    Raise DeadlineExceeded if the deadline has (almost) passed, like when the
+    backoff before a retry overslept. HTTP clients reject a timeout of 0.
+    """
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.time()
+    if remaining < _MIN_ATTEMPT_SECONDS:
+        raise DeadlineExceeded()
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def get_backoff_seconds(attempt):
+    """
+    Return a random backoff before the next attempt ("full jitter").
+    """
+    ceiling = min(constants.HTTP_BACKOFF_MAX_SECONDS,
+                  constants.HTTP_BACKOFF_BASE_SECONDS * (2 ** (attempt - 1)))
+    return random.uniform(0, ceiling)
+
+
+def should_retry(attempt, backoff, deadline):
+    """
+    Return whether another attempt may start after backoff seconds.
+    """
+    if attempt >= constants.MAX_HTTP_RETRIES:
+        return False
+    return deadline is None or time.time() + backoff < deadline
+
+
+def get_deadline(deadline_seconds):
+    return None if deadline_seconds is None else time.time() + deadline_seconds
 
 
-def call_proctor_identify(params, timeout=constants.MAX_HTTP_TIMEOUT_SECONDS, http=None):
-    return call_proctor(params, constants.API_METHOD_GROUPS_IDENTIFY, timeout, http)
+def call_proctor_identify(params, timeout=constants.MAX_HTTP_TIMEOUT_SECONDS, http=None,
+                          deadline_seconds=constants.MAX_HTTP_DEADLINE_SECONDS):
+    return call_proctor(params, constants.API_METHOD_GROUPS_IDENTIFY, timeout, http,
+                        deadline_seconds)
 
 
-def call_proctor_matrix(params, timeout=constants.MAX_HTTP_TIMEOUT_SECONDS, http=None):
-    return call_proctor(params, constants.API_METHOD_PROCTOR_MATRIX, timeout, http)
+def call_proctor_matrix(params, timeout=constants.MAX_HTTP_TIMEOUT_SECONDS, http=None,
+                        deadline_seconds=constants.MAX_HTTP_DEADLINE_SECONDS):
+    return call_proctor(params, constants.API_METHOD_PROCTOR_MATRIX, timeout, http,
+                        deadline_seconds)
 
 
 def call_proctor(params, api_method=constants.API_METHOD_GROUPS_IDENTIFY,
-                 timeout=constants.MAX_HTTP_TIMEOUT_SECONDS, http=None):
+                 timeout=constants.MAX_HTTP_TIMEOUT_SECONDS, http=None,
+                 deadline_seconds=constants.MAX_HTTP_DEADLINE_SECONDS):
     """
     Make an HTTP request to the Proctor REST API /groups/identify endpoint.
 
     Return the JSON API response or None if there was an error.
 
     params: Instance of ProctorParameters.
-    timeout: Timeout of the HTTP request in seconds. (default: 0.25 seconds)
-        If None, requests will attempt the request forever.
+    timeout: Timeout of each HTTP attempt in seconds. (default: 0.25 seconds)
+        If None, requests will attempt the request until the deadline.
         For network unreachable errors, requests inexplicably takes ~20x this
         value before returning.
-    http: Instance of requests.Session (or equivalent).
+    http: Instance of requests.Session (or equivalent). If None, the
+        process-wide pooled session from session.get_session() is used.
+    deadline_seconds: Total time budget for all attempts, including backoff
+        between retries. (default: 0.5 seconds) If None, only the number of
+        attempts is limited.
 
     A timeout is important to ensure your web backend does not block on
     Proctor API calls forever if the API's performance severely degrades or
     starts hanging on all HTTP requests for some reason.
+
+    Calls go through a per-API-root circuit breaker (see breaker.py). While
+    the circuit is open, None is returned immediately without a request, so
+    callers go straight to their fallback.
     """
-    http = http or requests
+    http = http or session.get_session()
 
-    api_url = "{root}/{method}".format(root=params.api_root, method=api_method)
+    api_url = get_api_url(params, api_method)
+    http_params = get_http_params(params)
 
-    http_params = {}
-    # Context variables and identifiers need prefixes.
-    http_params.update(('ctx.' + key, value)
-                       for key, value in six.iteritems(params.context_dict))
-    http_params.update(('id.' + key, value)
-                       for key, value in six.iteritems(params.identifier_dict))
+    if is_negative_cached(params, api_method):
+        logger.debug("Proctor API call to %s failed recently. Skipping request.", api_url)
+        record_call(api_method, 'negative_cached')
+        return None
 
-    # test is a comma-separated list of test names.
-    # Always provide test. If not provided, Pipet returns all matrix tests.
-    http_params['test'] = ','.join(params.defined_tests)
+    breaker = circuit_breaker.get_breaker(params.api_root)
+    if not breaker.allow_request():
+        logger.debug("Proctor API circuit to %s is open. Skipping request.", api_url)
+        record_call(api_method, 'circuit_open')
+        return None
 
-    if params.force_groups:
-        http_params[constants.PROP_NAME_FORCE_GROUPS] = params.force_groups
+    started_at = time.time()
 
     try:
         logger.debug("Calling Proctor API: %s with %s", api_url, http_params)
-        response = _get_with_retries(http, api_url, http_params, timeout)
+        response = _get_with_retries(http, api_url, http_params, timeout,
+                                     get_deadline(deadline_seconds))
 
     # Handle all possible errors.
     # This may be running in production, and Proctor is not critical,
     # so we can log the error and fall back to default behavior.
 
     # socket.timeout is occasionally thrown instead of request's Timeout.
-    except (requests.exceptions.Timeout, socket.timeout):
+    except (requests.exceptions.Timeout, socket.timeout, DeadlineExceeded):
+        breaker.record_failure()
         logger.exception("Proctor API request to %s timed out.", api_url)
+        record_call(api_method, 'timeout', started_at)
+        remember_failure(params, api_method, root_wide=True)
         return None
     except requests.exceptions.ConnectionError:
+        breaker.record_failure()
         logger.exception("Proctor API request to %s had a connection error.", api_url)
+        record_call(api_method, 'connection_error', started_at)
+        remember_failure(params, api_method, root_wide=True)
         return None
     # All other Requests exceptions
     except requests.exceptions.RequestException:
+        breaker.record_failure()
         logger.exception("Proctor API request to %s threw an exception.", api_url)
+        record_call(api_method, 'error', started_at)
+        remember_failure(params, api_method, root_wide=True)
         return None
+    except Exception:
+        breaker.record_failure()
+        record_call(api_method, 'error', started_at)
+        raise
+
+    record_response(breaker, response)
+    api_response = parse_response(api_url, api_method, response)
+    record_call(api_method, get_outcome(response, api_response), started_at)
+    if api_response is None:
+        remember_failure(params, api_method,
+                         root_wide=response.status_code in _SERVER_ERROR_CODES)
+    return api_response
+
+
+def record_response(breaker, response):
+    """
+    Report an HTTP response to the circuit breaker.
 
+    Only server errors count as failures. Client errors mean the API is up.
+    """
+    if response.status_code in _SERVER_ERROR_CODES:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+def record_call(api_method, outcome, started_at=None):
+    """
+    Report a Proctor API call to the metrics sinks (see metrics.py).
+    """
+    metrics.increment('proctor_api_calls_total', {'method': api_method, 'outcome': outcome})
+    if started_at is not None:
+        metrics.observe('proctor_api_seconds', {'method': api_method}, time.time() - started_at)
+
+
+def is_negative_cached(params, api_method):
+    """
+    Return whether the call failed recently and should be skipped (see
+    negative.py).
+    """
+    negative_cache = negative.get_negative_cache()
+    return negative_cache is not None and negative_cache.is_failing(params, api_method) is not None
+
+
+def remember_failure(params, api_method, root_wide):
+    """
+    Remember a failed call in the negative cache, if it's enabled.
+    """
+    negative_cache = negative.get_negative_cache()
+    if negative_cache is not None:
+        negative_cache.record_failure(params, api_method, root_wide)
+
+
+def get_outcome(response, api_response):
+    """
+    Return the outcome of an API call that got an HTTP response.
+    """
+    if api_response is not None:
+        return 'success'
+    elif response.status_code != requests.codes.ok:
+        return 'http_error'
+    else:
+        return 'invalid_response'
+
+
+def get_api_url(params, api_method):
+    """
+    Return the URL of a Proctor REST API method.
+    """
+    return "{root}/{method}".format(root=params.api_root, method=api_method)
+
+
+def get_http_params(params):
+    """
+    Return the HTTP query parameters for a Proctor API call as a dict.
+    """
+    http_params = {}
+    # Context variables and identifiers need prefixes.
+    http_params.update(('ctx.' + key, value)
+                       for key, value in six.iteritems(params.context_dict))
+    http_params.update(('id.' + key, value)
+                       for key, value in six.iteritems(params.identifier_dict))
+
+    # test is a comma-separated list of test names.
+    # Always provide test. If not provided, Pipet returns all matrix tests.
+    http_params['test'] = ','.join(params.defined_tests)
+
+    if params.force_groups:
+        http_params[constants.PROP_NAME_FORCE_GROUPS] = params.force_groups
+
+    return http_params
+
+
+def parse_response(api_url, api_method, response):
+    """
+    Return the JSON API response from an HTTP response or None if there was
+    an error.
+
+    response: A requests.Response (or equivalent, like an httpx.Response).
+    """
     if response.status_code != requests.codes.ok:
+        reason = _get_reason(response)
         # API errors may have additional JSON metadata.
         try:
             error_message = response.json()['meta']['error']
             logger.error("Proctor API at %s returned HTTP error (%d: %s) "
                          "with API error message: %s",
-                         api_url, response.status_code, response.reason, error_message)
+                         api_url, response.status_code, reason, error_message)
             return None
         # Response has no valid JSON. Maybe the HTTP server gave this error.
         except ValueError:
             logger.error("Proctor API at %s returned HTTP error (%d: %s)",
-                         api_url, response.status_code, response.reason)
+                         api_url, response.status_code, reason)
             return None
         # Response had JSON, but it didn't use the envelope format.
         # The Proctor REST API should never cause this.
         except KeyError:
             logger.error("Proctor API at %s returned HTTP error (%d: %s) "
                          "and JSON with missing error message.",
-                         api_url, response.status_code, response.reason)
+                         api_url, response.status_code, reason)
             return None
 
     try:
@@ -164,3 +393,11 @@ def call_proctor(params, api_method=constants.API_METHOD_GROUPS_IDENTIFY,
 
     # No error conditions detected.
     return api_response
+
+
+def _get_reason(response):
+    # httpx calls the HTTP reason phrase reason_phrase.
+    reason = getattr(response, 'reason', None)
+    if reason is None:
+        reason = getattr(response, 'reason_phrase', '')
+    return reason
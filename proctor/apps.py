@@ -0,0 +1,30 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+
+from django.apps import AppConfig
+from django.conf import settings
+
+from . import watcher
+
+
+class ProctorConfig(AppConfig):
+    name = 'proctor'
+    verbose_name = "Proctor"
+
+    def ready(self):
+        """
+        Start the matrix watcher if PROCTOR_WATCH_MATRIX_ON_STARTUP is True,
+        for processes that use Proctor without the middleware, like task
+        workers. Otherwise it's started by its first user, so that management
+        commands and preloading masters don't run it for nothing.
+        """
+        if not getattr(settings, 'PROCTOR_WATCH_MATRIX_ON_STARTUP', False):
+            return
+        matrix_watcher = watcher.get_default_watcher()
+        if matrix_watcher is None:
+            return
+        matrix_watcher.ensure_running()
+        if hasattr(os, 'register_at_fork'):
+            # Threads don't survive a fork, like into prefork workers.
+            os.register_at_fork(after_in_child=matrix_watcher.ensure_running)
@@ -0,0 +1,144 @@
+"""
+Provide a per-process circuit breaker for Proctor API calls.
+
+When Pipet is down, every request would otherwise wait for all of its retries
+to time out before falling back to cached or unassigned groups. After enough
+consecutive failures, the circuit opens and API calls fail immediately for a
+while. Then a single probe call is let through (half-open). If it succeeds
+the circuit closes again, otherwise it stays open for another period. A probe
+whose outcome is never reported (like one interrupted by a worker timeout)
+is given up on after another period, and the next caller probes instead.
+
+There is one CircuitBreaker per Proctor API root.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+import time
+
+from . import constants
+
+logger = logging.getLogger('application.proctor.breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker(object):
+    """
+    Thread-safe circuit breaker with closed, open and half-open states.
+
+    failure_threshold: Number of consecutive failed calls that open the
+        circuit. Default: 5
+    reset_timeout_seconds: How long the circuit stays open before a probe call
+        is allowed. Default: 30 seconds
+    """
+
+    def __init__(self, failure_threshold=None, reset_timeout_seconds=None):
+        self.failure_threshold = (failure_threshold
+                                  if failure_threshold is not None
+                                  else constants.CIRCUIT_FAILURE_THRESHOLD)
+        self.reset_timeout_seconds = (reset_timeout_seconds
+                                      if reset_timeout_seconds is not None
+                                      else constants.CIRCUIT_RESET_TIMEOUT_SECONDS)
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_time = 0
+        self._probe_in_flight = False
+        self._probe_started_time = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self._reset_timeout_elapsed():
+                return HALF_OPEN
+            return self._state
+
+    def allow_request(self):
+        """
+        Return whether a call may be made now.
+
+        When the circuit is half-open, only one caller is allowed through as
+        a probe. Callers that are allowed MUST report the outcome with
+        record_success() or record_failure().
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+
+            if self._state == OPEN:
+                if not self._reset_timeout_elapsed():
+                    return False
+                self._state = HALF_OPEN
+                self._probe_in_flight = False
+
+            if self._probe_in_flight and not self._probe_expired():
+                return False
+            self._probe_in_flight = True
+            self._probe_started_time = time.time()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                logger.info("Proctor API circuit closed.")
+            self._state = CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != OPEN:
+                    logger.warning("Proctor API circuit opened after %d failures.",
+                                   self._failures)
+                self._state = OPEN
+                self._opened_time = time.time()
+            self._probe_in_flight = False
+
+    def _reset_timeout_elapsed(self):
+        return time.time() >= self._opened_time + self.reset_timeout_seconds
+
+    def _probe_expired(self):
+        return time.time() >= self._probe_started_time + self.reset_timeout_seconds
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_breaker_kwargs = {}
+
+
+def get_breaker(api_root):
+    """
+    Return the CircuitBreaker for a Proctor API root.
+    """
+    breaker = _breakers.get(api_root)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(api_root)
+            if breaker is None:
+                breaker = _breakers[api_root] = CircuitBreaker(**_breaker_kwargs)
+    return breaker
+
+
+def configure(failure_threshold=None, reset_timeout_seconds=None):
+    """
+    Set the options of circuit breakers created from now on.
+    """
+    with _breakers_lock:
+        _breaker_kwargs.update(failure_threshold=failure_threshold,
+                               reset_timeout_seconds=reset_timeout_seconds)
+        _breakers.clear()
+
+
+def reset():
+    """
+    Forget the state of all circuit breakers.
+    """
+    with _breakers_lock:
+        _breakers.clear()
@@ -5,72 +5,199 @@ Used by ProctorMiddleware to easily take advantage of caching.
 """
 from __future__ import absolute_import, unicode_literals
 
+import collections
 import logging
-import string
+import math
+import random
+import threading
 import time
 
-import django.core.cache
 import six
+import django.core.cache
+from django.conf import settings
 
-from . import api
-from . import groups
+from . import constants
+from . import encoding
+from . import metrics
 
 logger = logging.getLogger('application.proctor.cache')
 
+# Result of Cacher.lookup(). See its docstring.
+CacheResult = collections.namedtuple('CacheResult', 'group_dict stale changed_tests')
+
+_MISS = CacheResult(None, False, ())
+
+# Browsers reject cookies over 4096 bytes, including the name and attributes.
+_MAX_COOKIE_LENGTH = 3800
+
 
 class Cacher(object):
     """
     Interface for caching implementations for Proctor assigned groups.
 
     Implementations must override several methods that manipulate cache_dict.
-    cache_dict is an arbitrary dictionary that contains group assignments as
-    well as information that Cacher needs to detect invalidation conditions.
+    cache_dict is an opaque compact entry (see encoding.py) that contains group
+    assignments as well as information that Cacher needs to detect
+    invalidation conditions. Its format version should be part of the cache
+    key, so that entries of different versions never collide.
+
+    request_scoped is True for implementations that store entries on the
+    request (like in its session), so they can't be shared between requests.
     """
-    def __init__(self, version_timeout_seconds=None):
+    request_scoped = False
+
+    def __init__(self, version_timeout_seconds=None, stale_seconds=None,
+                 rollover_seconds=None, max_refreshes=None):
         """
         version_timeout_seconds: The Pipet API will be queried to check for a
             new matrix version at least this often. Default: 5 minutes
+        stale_seconds: After the matrix version changes or expires, entries
+            of the previous version may still be served for this long while
+            they are refreshed in the background (see lookup()). Not
+            supported by request-scoped cachers. Default: 0 (disabled)
+        rollover_seconds: After the matrix version changes, entries of the
+            previous version are refreshed gradually over this window instead
+            of all at once (see RolloverSmoother). Default: 0 (disabled)
+        max_refreshes: Maximum number of rollover refreshes this process runs
+            at once. Default: 10
         """
         self.version_timeout_seconds = (version_timeout_seconds
                                         if version_timeout_seconds is not None
                                         else (5 * 60))
+        self.stale_seconds = stale_seconds or 0
+        self.rollover = (RolloverSmoother(rollover_seconds, max_refreshes)
+                         if rollover_seconds else None)
+
+        # The version this process last observed, and the one before it,
+        # which changed at changed_at. PER-PROCESS.
+        self._observed_version = None
+        self._previous_version = None
+        self._changed_at = 0
+        # (matrix version, test digests) from the last published matrix.
+        self._test_digests = (None, None)
 
     def get(self, request, params, allow_expired=False):
         """
         Return the cached group_dict for the given ProctorParameters.
 
         Return None if there was nothing in the cache or if the cached dict
-        is now invalid.
+        is now invalid. Stale entries (see lookup()) are only returned if
+        allow_expired is True.
+        """
+        result = self.lookup(request, params)
+        if (result.stale or result.changed_tests) and not allow_expired:
+            return None
+        return result.group_dict
+
+    def lookup(self, request, params):
+        """
+        Return a CacheResult(group_dict, stale, changed_tests) for the given
+        ProctorParameters.
+
+        group_dict is None if there was nothing in the cache or if the cached
+        dict is now invalid.
+
+        stale is True if the entry was written for the previous matrix version
+        and should be refreshed in the background, either because the version
+        changed or expired less than stale_seconds ago, or because the
+        rollover smoother picked it for refreshing.
+
+        changed_tests is a tuple of the tests whose definitions changed since
+        the entry was written, when the matrix was published to this cacher
+        (see publish_matrix()). Only those tests need to be identified again
+        and merged into group_dict. If stale is False, they must be identified
+        before group_dict can be used.
+        """
+        labels = {'cacher': type(self).__name__, 'operation': 'get'}
+        with metrics.timer('proctor_cache_seconds', labels):
+            result, outcome = self._lookup(request, params)
+        metrics.increment('proctor_cache_lookups_total',
+                          {'cacher': labels['cacher'], 'result': outcome})
+        return result
+
+    def _lookup(self, request, params):
+        """
+        Return (CacheResult, outcome), where outcome is the result label of
+        the proctor_cache_lookups_total metric.
         """
         latest_seen_version = self._get_latest_version()
-        if latest_seen_version is None:
+        if self._is_version_expired(latest_seen_version):
+            return _MISS, 'expired'
+        return self._check_entry(request, params, latest_seen_version,
+                                 self._get_cache_dict(request, params))
+
+    def _is_version_expired(self, latest_seen_version):
+        """
+        Return True if entries can't be used because no matrix version has
+        been seen yet, or it expired.
+        """
+        if self.stale_seconds or self.rollover is not None:
+            self._observe_version(latest_seen_version)
+        elif latest_seen_version is None:
             # App hasn't seen any matrix versions yet or it expired.
             logger.debug("Proctor cache MISS (version expired)")
-            return None
+            return True
+        return False
 
-        cache_dict = self._get_cache_dict(request, params)
+    def _check_entry(self, request, params, latest_seen_version, cache_dict):
+        """
+        Return (CacheResult, outcome) for the cache_dict stored for params.
+        """
         if cache_dict is None:
             logger.debug("Proctor cache MISS (absent)")
-            return None
+            return _MISS, 'miss'
 
-        group_dict = cache_dict['group_dict']
-        cache_params = api.ProctorParameters(**cache_dict['params'])
-        cache_matrix_version = cache_dict['matrix_version']
+        entry = encoding.decode_entry(cache_dict, params)
 
         # Make sure cache is invalidated if something changes.
         # If the test matrix changed, then assignments may have changed.
         # Parameters like forcegroups might change assignments too.
-        valid = (cache_matrix_version == latest_seen_version and params == cache_params)
-        if valid:
-            # ProctorGroups is a namedtuple serialized into a dict for JSON.
-            # Need to convert it back before returning.
+        # (The entry is None if it was written for different parameters.)
+        if entry is not None and entry.matrix_version == latest_seen_version:
             logger.debug("Proctor cache HIT")
-            return {key: groups.GroupAssignment(*val)
-                    for key, val in six.iteritems(group_dict)}
-        else:
-            logger.debug("Proctor cache MISS (invalidated)")
-            self._del_cache_dict(request, params)
-            return None
+            return CacheResult(entry.group_dict, False, ()), 'hit'
+
+        changed_tests = None
+        if entry is not None:
+            changed_tests = encoding.get_changed_tests(
+                params, entry, self._get_test_digests(latest_seen_version))
+            if changed_tests == ():
+                logger.debug("Proctor cache HIT (tests unchanged)")
+                return CacheResult(entry.group_dict, False, ()), 'hit'
+
+        if entry is not None and entry.matrix_version == self._previous_version:
+            age = time.time() - self._changed_at
+            if self.rollover is not None and latest_seen_version is not None:
+                adoption = self.rollover.adopt(params.fingerprint, age)
+                if adoption == RolloverSmoother.KEEP:
+                    logger.debug("Proctor cache HIT (rollover pending)")
+                    return CacheResult(entry.group_dict, False, ()), 'rollover_keep'
+                elif adoption == RolloverSmoother.REFRESH:
+                    logger.debug("Proctor cache MISS (rollover refresh)")
+                    if self.request_scoped:
+                        # Can't refresh in the background. The caller will.
+                        return CacheResult(entry.group_dict if changed_tests else None,
+                                           False, changed_tests or ()), 'rollover_refresh'
+                    return (CacheResult(entry.group_dict, True, changed_tests or ()),
+                            'rollover_refresh')
+            if age < self.stale_seconds:
+                logger.debug("Proctor cache STALE")
+                return CacheResult(entry.group_dict, True, changed_tests or ()), 'stale'
+
+        if changed_tests:
+            logger.debug("Proctor cache PARTIAL (%d tests changed)", len(changed_tests))
+            return CacheResult(entry.group_dict, False, changed_tests), 'partial'
+
+        logger.debug("Proctor cache MISS (invalidated)")
+        self._del_cache_dict(request, params)
+        return _MISS, 'invalidated'
+
+    def aget(self, request, params, allow_expired=False):
+        """
+        Async counterpart of get(). Return an awaitable.
+        """
+        from . import aio
+        return aio.cacher_get(self, request, params, allow_expired)
 
     def set(self, request, params, group_dict, api_response):
         """
@@ -80,13 +207,85 @@ class Cacher(object):
         """
         latest_seen_version = self.update_matrix_version(api_response)
 
-        cache_dict = {}
-        cache_dict['group_dict'] = group_dict
-        cache_dict['params'] = params.as_dict()
-        cache_dict['matrix_version'] = latest_seen_version
+        cache_dict = encoding.encode_entry(params, group_dict, latest_seen_version,
+                                           self._get_test_digests(latest_seen_version))
 
-        self._set_cache_dict(request, params, cache_dict)
+        with metrics.timer('proctor_cache_seconds',
+                           {'cacher': type(self).__name__, 'operation': 'set'}):
+            self._set_cache_dict(request, params, cache_dict)
         logger.debug("Proctor cache SET")
+        if self.rollover is not None:
+            self.rollover.finish(params.fingerprint)
+
+    def get_many(self, request, params_list):
+        """
+        Return a list with the cached group_dict (or None) of each
+        ProctorParameters in params_list, like get().
+        """
+        return [None if result.stale or result.changed_tests else result.group_dict
+                for result in self.lookup_many(request, params_list)]
+
+    def lookup_many(self, request, params_list):
+        """
+        Return a list with the CacheResult of each ProctorParameters in
+        params_list, like lookup().
+
+        The entries and the matrix version are fetched together, in a single
+        round trip for cachers that support it.
+        """
+        labels = {'cacher': type(self).__name__, 'operation': 'get_many'}
+        with metrics.timer('proctor_cache_seconds', labels):
+            latest_seen_version, cache_dicts = self._get_cache_dicts(request, params_list)
+            if self._is_version_expired(latest_seen_version):
+                lookups = [(_MISS, 'expired')] * len(params_list)
+            else:
+                lookups = [self._check_entry(request, params, latest_seen_version, cache_dict)
+                           for params, cache_dict in zip(params_list, cache_dicts)]
+        for _, outcome in lookups:
+            metrics.increment('proctor_cache_lookups_total',
+                              {'cacher': labels['cacher'], 'result': outcome})
+        return [result for result, _ in lookups]
+
+    def set_many(self, request, items):
+        """
+        Cache several group_dicts, like set(), in a single round trip for
+        cachers that support it.
+
+        items: A list of (params, group_dict, api_response) tuples.
+        """
+        versions = {}
+        for _, _, api_response in items:
+            version = api_response['data']['audit']['version']
+            if version not in versions:
+                versions[version] = self._record_version(version)
+
+        cache_dicts = []
+        for params, group_dict, api_response in items:
+            latest_seen_version = versions[api_response['data']['audit']['version']]
+            cache_dicts.append((params, encoding.encode_entry(
+                params, group_dict, latest_seen_version,
+                self._get_test_digests(latest_seen_version))))
+
+        with metrics.timer('proctor_cache_seconds',
+                           {'cacher': type(self).__name__, 'operation': 'set_many'}):
+            self._set_cache_dicts(request, cache_dicts)
+        logger.debug("Proctor cache SET (%d entries)", len(cache_dicts))
+        if self.rollover is not None:
+            for params, _ in cache_dicts:
+                self.rollover.finish(params.fingerprint)
+
+    def aset(self, request, params, group_dict, api_response):
+        """
+        Async counterpart of set(). Return an awaitable.
+        """
+        from . import aio
+        return aio.cacher_set(self, request, params, group_dict, api_response)
+
+    def update_response(self, request, response):
+        """
+        Store what this request cached on the response, if the cacher keeps
+        its entries on the client. Called by the middleware for every response.
+        """
 
     def update_matrix_version(self, api_response):
         """
@@ -100,8 +299,26 @@ class Cacher(object):
         This causes the cache to be invalidated if the test matrix version
         changes.
         """
-        new_version = api_response['data']['audit']['version']
+        return self._record_version(api_response['data']['audit']['version'])
+
+    def publish_matrix(self, matrix_response):
+        """
+        Update the last seen matrix version from a /proctor/matrix response.
+
+        Called by watcher.MatrixWatcher after every poll, which keeps the
+        version from expiring as long as the watcher is running. The test
+        definitions are digested, so that entries of older versions whose
+        tests didn't change stay valid (see lookup()).
+        """
+        version = matrix_response['audit']['version']
+        if self._test_digests[0] != version:
+            self._test_digests = (version, encoding.get_test_digests(matrix_response))
+        self._record_version(version)
+
+    def _record_version(self, new_version):
         latest_seen_version = self._get_latest_version()
+        if self.stale_seconds or self.rollover is not None:
+            self._observe_version(new_version)
 
         # Set cache unconditionally.
         # This resets our timeout for re-checking the Proctor API.
@@ -113,6 +330,26 @@ class Cacher(object):
 
         return latest_seen_version
 
+    def _get_test_digests(self, version):
+        """
+        Return the test digests of the matrix version, or None if unknown.
+        """
+        digest_version, test_digests = self._test_digests
+        if version is None or digest_version != version:
+            return None
+        return test_digests
+
+    def _observe_version(self, version):
+        """
+        Remember when the version changed or expired (version is None).
+        """
+        if version == self._observed_version:
+            return
+        if self._observed_version is not None:
+            self._previous_version = self._observed_version
+            self._changed_at = time.time()
+        self._observed_version = version
+
     def _get_cache_dict(self, request, params):
         """
         Return the cache_dict that corresponds to ProctorParameters.
@@ -131,6 +368,25 @@ class Cacher(object):
         """
         raise NotImplementedError("_del_cache_dict() must be overridden.")
 
+    def _get_cache_dicts(self, request, params_list):
+        """
+        Return (latest seen matrix version, list of the cache_dicts that
+        correspond to each ProctorParameters in params_list).
+
+        Override to fetch them together.
+        """
+        return (self._get_latest_version(),
+                [self._get_cache_dict(request, params) for params in params_list])
+
+    def _set_cache_dicts(self, request, cache_dicts):
+        """
+        Set each cache_dict of a list of (params, cache_dict) tuples.
+
+        Override to store them together.
+        """
+        for params, cache_dict in cache_dicts:
+            self._set_cache_dict(request, params, cache_dict)
+
     def _get_latest_version(self):
         """
         Return the most recently seen matrix version.
@@ -151,8 +407,12 @@ class SessionCacher(Cacher):
     """
     Cache Proctor assigned groups in the Django session.
     """
-    def __init__(self, version_timeout_seconds=None):
-        super(SessionCacher, self).__init__(version_timeout_seconds)
+    request_scoped = True
+
+    def __init__(self, version_timeout_seconds=None, rollover_seconds=None, max_refreshes=None):
+        super(SessionCacher, self).__init__(version_timeout_seconds,
+                                            rollover_seconds=rollover_seconds,
+                                            max_refreshes=max_refreshes)
 
         # Store last seen here since sessions have no all-process storage.
         # This variable is PER-PROCESS!
@@ -169,6 +429,8 @@ class SessionCacher(Cacher):
 
     def _set_cache_dict(self, request, params, cache_dict):
         request.session[self._get_session_dict_key()] = cache_dict
+        # Drop the entry written before compact encoding.
+        request.session.pop('proctorcache', None)
 
     def _del_cache_dict(self, request, params):
         del request.session[self._get_session_dict_key()]
@@ -186,34 +448,98 @@ class SessionCacher(Cacher):
 
     def _get_session_dict_key(self):
         """Return the key used for the request.session dict."""
-        return 'proctorcache'
+        return 'proctorcache:v{0}'.format(encoding.FORMAT_VERSION)
+
+
+class CookieCacher(SessionCacher):
+    """
+    Cache Proctor assigned groups in a signed cookie in the visitor's browser.
+
+    The entry is compact (see encoding.py), signed with SECRET_KEY so it
+    can't be forged, and optionally compressed. Returning visitors need no
+    server-side storage to get their groups. The cookie is only sent again
+    when the entry changed.
+
+    Like SessionCacher, the last seen matrix version is kept per process.
+    """
+
+    def __init__(self, cookie_name=None, max_age_seconds=None, compress=True,
+                 version_timeout_seconds=None, rollover_seconds=None, max_refreshes=None,
+                 secure=False, samesite=None):
+        """
+        cookie_name: Default: 'prcache'
+        max_age_seconds: Lifetime of the cookie. Default: 30 days
+        compress: Whether to compress entries before signing them.
+        secure: Whether the cookie is only sent over HTTPS.
+        samesite: The SameSite attribute of the cookie, like 'Lax', or None
+            to leave it out. Needs Django 2.1 or later.
+        """
+        super(CookieCacher, self).__init__(version_timeout_seconds, rollover_seconds,
+                                           max_refreshes)
+        self.cookie_name = cookie_name or 'prcache'
+        self.max_age_seconds = (max_age_seconds if max_age_seconds is not None
+                                else (30 * 24 * 60 * 60))
+        self.compress = compress
+        self.secure = secure
+        self.samesite = samesite
+
+    def update_response(self, request, response):
+        value = getattr(request, '_proctor_cookie', None)
+        if value is None:
+            # Unchanged.
+            return
+        if value:
+            kwargs = {}
+            if self.samesite:
+                kwargs['samesite'] = self.samesite
+            response.set_cookie(self.cookie_name, value, max_age=self.max_age_seconds,
+                                secure=self.secure, httponly=True, **kwargs)
+        else:
+            response.delete_cookie(self.cookie_name)
+
+    def _get_cache_dict(self, request, params):
+        value = request.COOKIES.get(self.cookie_name)
+        if not value:
+            return None
+        cache_dict = encoding.unsign_entry(value, self._get_salt())
+        if cache_dict is None:
+            logger.debug("Proctor cache cookie has a bad signature.")
+        return cache_dict
+
+    def _set_cache_dict(self, request, params, cache_dict):
+        value = encoding.sign_entry(cache_dict, self._get_salt(), self.compress)
+        if len(value) > _MAX_COOKIE_LENGTH:
+            logger.warning("Proctor cache cookie would be too large (%d bytes).", len(value))
+            self._del_cache_dict(request, params)
+        elif value != request.COOKIES.get(self.cookie_name):
+            request._proctor_cookie = value
+
+    def _del_cache_dict(self, request, params):
+        if self.cookie_name in request.COOKIES:
+            request._proctor_cookie = ''
+
+    def _get_salt(self):
+        return 'proctor.cache.v{0}'.format(encoding.FORMAT_VERSION)
 
 
 class CacheCacher(Cacher):
     """
     Cache Proctor assigned groups using Django's cache framework.
 
-    To determine the cache key, the cacher combines all the identifiers
-    together. This is likely to stay the same across requests.
-
-    If you run into CacheKeyWarnings due to length, you may need to subclass
-    this and use a different cache key strategy, like using only one identifier
-    or using a hash().
+    The cache key is the fingerprint of the ProctorParameters, a fixed-length
+    digest of the identifiers, context variables, force groups and tests. So
+    keys are always valid memcached keys, and a request whose parameters
+    changed (like after logging in) simply uses a different entry.
 
     CacheCacher uses the timeout from your Django settings (5 min by default).
     But Cacher handles cache invalidation well, so you can increase this to
     as long as forever if you want.
     """
 
-    # Memcached disallows spaces, newlines, etc. It treats colons specially
-    # for stats, and we use pipes to separate identifiers.
-    _VALID_KEY_CHARS = (
-        frozenset(string.ascii_letters + string.digits + string.punctuation) -
-        frozenset(':|')
-    )
-
-    def __init__(self, cache_name=None, version_timeout_seconds=None):
-        super(CacheCacher, self).__init__(version_timeout_seconds)
+    def __init__(self, cache_name=None, version_timeout_seconds=None, stale_seconds=None,
+                 rollover_seconds=None, max_refreshes=None):
+        super(CacheCacher, self).__init__(version_timeout_seconds, stale_seconds,
+                                          rollover_seconds, max_refreshes)
         cache_name = cache_name or 'default'
         self.cache = django.core.cache.caches[cache_name]
 
@@ -233,21 +559,286 @@ class CacheCacher(Cacher):
         self.cache.set(self._get_cache_version_key(), version,
                        timeout=self.version_timeout_seconds)
 
+    def _get_cache_dicts(self, request, params_list):
+        version_key = self._get_cache_version_key()
+        keys = [self._get_cache_key(params) for params in params_list]
+        values = self.cache.get_many(keys + [version_key])
+        return values.get(version_key), [values.get(key) for key in keys]
+
+    def _set_cache_dicts(self, request, cache_dicts):
+        self.cache.set_many({self._get_cache_key(params): cache_dict
+                             for params, cache_dict in cache_dicts})
+
     def _get_cache_key(self, params):
-        prefix = self._get_cache_prefix()
-        ident_dict = params.identifier_dict
-
-        # Sort values by identifier name (must be consistent).
-        idents = (str(value) for key, value in sorted(ident_dict.items()))
-        # Get rid of bad control characters like spaces.
-        # And concatenate ids with pipes (for sanity when debugging caching).
-        filtered_id_string = '|'.join(
-            ''.join(char for char in ident if char in self._VALID_KEY_CHARS)
-            for ident in idents)
-        return ':'.join([prefix, filtered_id_string])
+        return ':'.join([self._get_cache_prefix(), 'v{0}'.format(encoding.FORMAT_VERSION),
+                         params.fingerprint])
 
     def _get_cache_prefix(self):
         return 'proc'
 
     def _get_cache_version_key(self):
         return self._get_cache_prefix() + 'version'
+
+
+class TieredCacher(CacheCacher):
+    """
+    Cache Proctor assigned groups in process memory in front of CacheCacher.
+
+    The first tier is a bounded in-process LRU cache whose entries expire
+    after local_timeout_seconds. The second tier is Django's cache framework,
+    exactly like CacheCacher. Hot identifiers are served from memory without
+    a cache server round trip.
+
+    The matrix version is cached in memory too, for at most
+    local_timeout_seconds. So a new matrix version seen by any process
+    invalidates both tiers of every process within that time. Invalid entries
+    are only evicted from memory, since they may be newer than the version
+    this process holds.
+    """
+
+    def __init__(self, cache_name=None, version_timeout_seconds=None,
+                 local_max_entries=None, local_timeout_seconds=None, stale_seconds=None,
+                 rollover_seconds=None, max_refreshes=None):
+        """
+        local_max_entries: Maximum number of entries kept in memory. The least
+            recently used entries are evicted first. Default: 1000
+        local_timeout_seconds: Entries are kept in memory at most this long.
+            Default: 10 seconds
+        """
+        super(TieredCacher, self).__init__(cache_name, version_timeout_seconds, stale_seconds,
+                                           rollover_seconds, max_refreshes)
+        self.local_cache = LocalCache(
+            local_max_entries if local_max_entries is not None else 1000,
+            local_timeout_seconds if local_timeout_seconds is not None else 10)
+
+    def _get_cache_dict(self, request, params):
+        key = self._get_cache_key(params)
+        cache_dict = self.local_cache.get(key)
+        if cache_dict is None:
+            cache_dict = super(TieredCacher, self)._get_cache_dict(request, params)
+            if cache_dict is not None:
+                self.local_cache.set(key, cache_dict)
+        return cache_dict
+
+    def _set_cache_dict(self, request, params, cache_dict):
+        super(TieredCacher, self)._set_cache_dict(request, params, cache_dict)
+        self.local_cache.set(self._get_cache_key(params), cache_dict)
+
+    def _check_entry(self, request, params, latest_seen_version, cache_dict):
+        result, outcome = super(TieredCacher, self)._check_entry(
+            request, params, latest_seen_version, cache_dict)
+        if outcome == 'invalidated':
+            # The version held in memory may be behind the shared one, and the
+            # entry written by a process that already saw the new version.
+            shared_version = super(TieredCacher, self)._get_latest_version()
+            if shared_version is not None and shared_version != latest_seen_version:
+                self.local_cache.set(self._get_cache_version_key(), shared_version)
+                return super(TieredCacher, self)._check_entry(
+                    request, params, shared_version, cache_dict)
+        return result, outcome
+
+    def _del_cache_dict(self, request, params):
+        # Only evict the memory tier. This process's version may be up to
+        # local_timeout_seconds old, so an entry it thinks is invalid may have
+        # just been written for a newer version. Outdated shared entries are
+        # overwritten when they are identified again.
+        self.local_cache.delete(self._get_cache_key(params))
+
+    def _get_latest_version(self):
+        key = self._get_cache_version_key()
+        version = self.local_cache.get(key)
+        if version is None:
+            version = super(TieredCacher, self)._get_latest_version()
+            if version is not None:
+                self.local_cache.set(key, version)
+        return version
+
+    def _set_latest_version(self, version):
+        super(TieredCacher, self)._set_latest_version(version)
+        self.local_cache.set(self._get_cache_version_key(), version)
+
+    def _get_cache_dicts(self, request, params_list):
+        version_key = self._get_cache_version_key()
+        version = self.local_cache.get(version_key)
+        keys = [self._get_cache_key(params) for params in params_list]
+        cache_dicts = [self.local_cache.get(key) for key in keys]
+
+        missing_keys = [key for key, cache_dict in zip(keys, cache_dicts) if cache_dict is None]
+        if version is None:
+            missing_keys.append(version_key)
+        if not missing_keys:
+            return version, cache_dicts
+
+        values = self.cache.get_many(missing_keys)
+        for key, value in six.iteritems(values):
+            if value is not None:
+                self.local_cache.set(key, value)
+        if version is None:
+            version = values.get(version_key)
+        return version, [cache_dict if cache_dict is not None else values.get(key)
+                         for key, cache_dict in zip(keys, cache_dicts)]
+
+    def _set_cache_dicts(self, request, cache_dicts):
+        super(TieredCacher, self)._set_cache_dicts(request, cache_dicts)
+        for params, cache_dict in cache_dicts:
+            self.local_cache.set(self._get_cache_key(params), cache_dict)
+
+
+class SharedMemoryCacher(Cacher):
+    """
+    Cache Proctor assigned groups in a memory-mapped file shared by all
+    worker processes on a host (see shm.py).
+
+    The matrix version is shared too, so a version change seen by one worker
+    is seen by all of them, and an entry cached by one worker is a hit for
+    the others without a cache server round trip. Reads don't take locks.
+
+    The table has a fixed number of slots, and each entry replaces whatever
+    was in its slot, so it holds recently used entries. Only available on
+    Unix.
+    """
+
+    def __init__(self, path=None, slot_count=None, slot_size=None,
+                 version_timeout_seconds=None, stale_seconds=None,
+                 rollover_seconds=None, max_refreshes=None):
+        """
+        path: The file to map. Default: a file in the temporary directory
+            for the current user, PROCTOR_API_ROOT and slot settings (see
+            shm.get_default_path())
+        slot_count: Number of entries the table holds. Default: 4096
+        slot_size: Maximum size of an entry in bytes. Default: 2048
+        """
+        super(SharedMemoryCacher, self).__init__(version_timeout_seconds, stale_seconds,
+                                                 rollover_seconds, max_refreshes)
+        from . import shm
+        if path is None:
+            path = shm.get_default_path(settings.PROCTOR_API_ROOT, slot_count, slot_size)
+        self.table = shm.SharedTable(path, slot_count, slot_size)
+
+    def _get_cache_dict(self, request, params):
+        return self.table.get(params.fingerprint)
+
+    def _set_cache_dict(self, request, params, cache_dict):
+        self.table.set(params.fingerprint, cache_dict)
+
+    def _del_cache_dict(self, request, params):
+        self.table.delete(params.fingerprint)
+
+    def _get_latest_version(self):
+        return self.table.get_version()
+
+    def _set_latest_version(self, version):
+        self.table.set_version(version, time.time() + self.version_timeout_seconds)
+
+
+class LocalCache(object):
+    """
+    Thread-safe in-process LRU cache with a timeout for every entry.
+    """
+
+    def __init__(self, max_entries, timeout_seconds):
+        self.max_entries = max_entries
+        self.timeout_seconds = timeout_seconds
+        self._lock = threading.Lock()
+        # key -> (expiry_time, value), least recently used first.
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return None
+            if time.time() >= entry[0]:
+                return None
+            # Re-insert as most recently used.
+            self._entries[key] = entry
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.timeout_seconds, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RolloverSmoother(object):
+    """
+    Spread the refreshes of a matrix version rollover over a window.
+
+    When the matrix version changes, every cached entry becomes invalid at
+    once, and all active visitors would call the Proctor API together. Instead,
+    each entry keeps being served until its own deadline, a point in the
+    window derived from its fingerprint. Entries are refreshed a little before
+    their deadline with a probability that rises as it approaches ("XFetch"),
+    scaled by how long refreshes take. At most max_refreshes refreshes run in
+    a process at once; entries that can't start one keep being served until
+    the window is over.
+    """
+    KEEP = 'keep'
+    REFRESH = 'refresh'
+    EXPIRED = 'expired'
+
+    def __init__(self, window_seconds, max_refreshes=None):
+        self.window_seconds = window_seconds
+        self.max_refreshes = (max_refreshes if max_refreshes is not None
+                              else constants.ROLLOVER_MAX_REFRESHES)
+        # Moving average of refresh durations.
+        self.refresh_seconds = constants.MAX_HTTP_DEADLINE_SECONDS
+        self._lock = threading.Lock()
+        # fingerprint -> start time of refreshes in progress.
+        self._refreshing = {}
+
+    def adopt(self, fingerprint, age):
+        """
+        Return KEEP, REFRESH or EXPIRED for an entry of the previous version,
+        age seconds after the version changed.
+
+        REFRESH reserves one of the max_refreshes slots until finish() is
+        called for the fingerprint (or the refresh times out).
+        """
+        if age >= self.window_seconds:
+            return self.EXPIRED
+
+        deadline = self.window_seconds * _get_key_fraction(fingerprint)
+        early = -self.refresh_seconds * math.log(1.0 - random.random())
+        if age + early < deadline:
+            return self.KEEP
+
+        with self._lock:
+            now = time.time()
+            for key, started_at in list(self._refreshing.items()):
+                if now - started_at >= constants.ROLLOVER_REFRESH_TIMEOUT_SECONDS:
+                    del self._refreshing[key]
+            if fingerprint in self._refreshing or len(self._refreshing) >= self.max_refreshes:
+                return self.KEEP
+            self._refreshing[fingerprint] = now
+        return self.REFRESH
+
+    def finish(self, fingerprint):
+        """
+        Release the refresh slot of the fingerprint, if it holds one.
+        """
+        with self._lock:
+            started_at = self._refreshing.pop(fingerprint, None)
+            if started_at is not None:
+                duration = time.time() - started_at
+                self.refresh_seconds += (duration - self.refresh_seconds) * 0.1
+
+
+def _get_key_fraction(fingerprint):
+    """
+    Return a number in [0, 1) derived from a hex fingerprint.
+    """
+    return int(fingerprint[:8], 16) / float(16 ** 8)
@@ -6,3 +6,20 @@ API_METHOD_PROCTOR_MATRIX = 'proctor/matrix'
 PROP_NAME_FORCE_GROUPS = 'prforceGroups'
 MAX_HTTP_TIMEOUT_SECONDS = 0.25
 MAX_HTTP_RETRIES = 4
+MAX_HTTP_DEADLINE_SECONDS = 0.5
+HTTP_BACKOFF_BASE_SECONDS = 0.01
+HTTP_BACKOFF_MAX_SECONDS = 0.1
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT_SECONDS = 30
+MATRIX_WATCHER_TIMEOUT_SECONDS = 5
+REFRESH_WORKERS = 2
+REFRESH_QUEUE_SIZE = 100
+ROLLOVER_MAX_REFRESHES = 10
+ROLLOVER_REFRESH_TIMEOUT_SECONDS = 10
+PREFETCH_WORKERS = 8
+PREFETCH_QUEUE_SIZE = 100
+PREFETCH_TIMEOUT_SECONDS = 1
+LOADER_WORKERS = 8
+TEST_TYPE_RANDOM = 'RANDOM'
+# Proctor's built-in test types.
+TEST_TYPES = ('USER', 'ACCOUNT', 'EMAIL', 'PAGE', 'COMPANY', TEST_TYPE_RANDOM)
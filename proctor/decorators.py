@@ -0,0 +1,50 @@
+"""
+Declare which Proctor tests a view uses.
+
+By default, every request identifies all tests in PROCTOR_TESTS. Views that
+only read a few tests (like hot JSON endpoints) can declare them, and the
+middleware then only identifies, caches and builds assignments for those:
+
+    @proctor_tests('buttoncolortst')
+    def my_view(request):
+        if request.proc.buttoncolortst.group == 'blue':
+            ...
+
+Class-based views set the proctor_tests class attribute instead:
+
+    class MyView(generic.TemplateView):
+        proctor_tests = ('buttoncolortst',)
+
+request.proc then only has attributes for the declared tests, and only they
+appear in str(request.proc). A view that declares no tests gets an empty
+request.proc without any cache lookup or API call.
+
+The middleware scopes groups in process_view(). Under ASGI, groups are
+identified before the view is called, so the view is found by resolving the
+request's URL (see aio.resolve_view()).
+"""
+from __future__ import absolute_import, unicode_literals
+
+
+def proctor_tests(*test_names):
+    """
+    Decorate a view to only identify test_names for its requests.
+
+    Tests that aren't in PROCTOR_TESTS are ignored.
+    """
+    def decorator(view_func):
+        view_func.proctor_tests = test_names
+        return view_func
+    return decorator
+
+
+def get_view_tests(view_func):
+    """
+    Return the tuple of tests declared by a view function or the class of a
+    class-based view, or None if it didn't declare any.
+    """
+    test_names = getattr(view_func, 'proctor_tests', None)
+    if test_names is None:
+        # View functions of class-based views have their class since Django 1.9.
+        test_names = getattr(getattr(view_func, 'view_class', None), 'proctor_tests', None)
+    return tuple(test_names) if test_names is not None else None
@@ -0,0 +1,157 @@
+"""
+Encode cached group assignments compactly.
+
+A cache entry used to be a dict holding the whole ProctorParameters (including
+every defined test name and the context variables, like user agents) plus a
+list for every GroupAssignment. With many tests, that bloats cache values and
+sessions, and makes every pickle and unpickle slow.
+
+A compact entry is a tuple:
+
+    (FORMAT_VERSION, params fingerprint, matrix version, assignments, digests)
+
+The fingerprint is ProctorParameters.fingerprint, so validating an entry is
+one string comparison and doesn't need the parameters themselves. Assignments
+are listed in the order of params.defined_tests (which the fingerprint covers)
+instead of being keyed by test name, and unassigned tests are None.
+
+digests are the test definition digests (see get_test_digests()) the
+assignments were made with, in the same order, or None if the matrix wasn't
+known when the entry was written. They let an entry outlive a matrix version
+change that didn't touch its tests.
+
+FORMAT_VERSION is bumped whenever the layout changes. Cachers include it in
+their keys, so processes running different versions never read each other's
+entries during a rollout, and entries of unknown versions are cache misses.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import collections
+import hashlib
+import json
+import zlib
+
+import six
+from django.core import signing
+
+from . import groups
+
+FORMAT_VERSION = 2
+
+CacheEntry = collections.namedtuple(
+    'CacheEntry', 'fingerprint matrix_version group_dict digests')
+
+_UNASSIGNED = tuple(groups._UNASSIGNED_GROUP)
+
+
+def encode_entry(params, group_dict, matrix_version, test_digests=None):
+    """
+    Return the compact cache entry for a group_dict.
+
+    test_digests: Optional dict of test name to digest for matrix_version.
+    """
+    assignments = tuple(_encode_assignment(group_dict.get(test_name))
+                        for test_name in params.defined_tests)
+    digests = None
+    if test_digests is not None:
+        digests = tuple(test_digests.get(test_name, '') for test_name in params.defined_tests)
+    return (FORMAT_VERSION, params.fingerprint, matrix_version, assignments, digests)
+
+
+def decode_entry(entry, params):
+    """
+    Return the CacheEntry for a compact cache entry, or None if the entry
+    wasn't written for the ProctorParameters or has an unknown format.
+
+    Sessions serialized as JSON turn tuples into lists, so both are accepted.
+    """
+    if not isinstance(entry, (tuple, list)) or not entry or entry[0] != FORMAT_VERSION:
+        return None
+
+    _, fingerprint, matrix_version, assignments, digests = entry
+    if fingerprint != params.fingerprint:
+        return None
+
+    group_dict = {test_name: _decode_assignment(matrix_version, assignment)
+                  for test_name, assignment in zip(params.defined_tests, assignments)}
+    return CacheEntry(fingerprint, matrix_version, group_dict, digests)
+
+
+def get_test_digests(matrix_response):
+    """
+    Return a dict of test name to a short digest of its definition, for the
+    tests in a /proctor/matrix response.
+
+    A test's assignments can only change when its definition does. Tests
+    missing from the matrix are treated as having the digest ''.
+    """
+    digests = {}
+    for test_name, test_definition in six.iteritems(matrix_response['tests']):
+        if not test_definition:
+            continue
+        canonical = json.dumps(test_definition, sort_keys=True, separators=(',', ':'),
+                               default=six.text_type)
+        digests[test_name] = hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:12]
+    return digests
+
+
+def get_changed_tests(params, entry, test_digests):
+    """
+    Return the tuple of tests in params.defined_tests whose definition changed
+    since the entry was written, or None if that can't be known.
+    """
+    if entry.digests is None or test_digests is None:
+        return None
+    return tuple(test_name
+                 for test_name, digest in zip(params.defined_tests, entry.digests)
+                 if test_digests.get(test_name, '') != digest)
+
+
+def _encode_assignment(assignment):
+    if assignment is None or tuple(assignment) == _UNASSIGNED:
+        return None
+    return tuple(assignment)
+
+
+def _decode_assignment(matrix_version, assignment):
+    if assignment is None:
+        return groups._UNASSIGNED_GROUP
+    return groups.intern_assignment(matrix_version, *assignment)
+
+
+def sign_entry(entry, salt, compress=False):
+    """
+    Return a signed, URL-safe string of a compact cache entry, for storing
+    it on the client, like in a cookie.
+
+    Like django.core.signing.dumps(), but without a timestamp, so an
+    unchanged entry always has the same signed value.
+    """
+    data = json.dumps(entry, separators=(',', ':')).encode('utf-8')
+    is_compressed = False
+    if compress:
+        compressed = zlib.compress(data)
+        if len(compressed) < len(data) - 1:
+            data = compressed
+            is_compressed = True
+    value = signing.b64_encode(data).decode('ascii')
+    if is_compressed:
+        value = '.' + value
+    return signing.Signer(salt=salt).sign(value)
+
+
+def unsign_entry(signed_value, salt):
+    """
+    Return the compact cache entry of a sign_entry() string.
+
+    Return None if the signature is invalid or the value is malformed.
+    """
+    try:
+        value = signing.Signer(salt=salt).unsign(signed_value)
+        is_compressed = value.startswith('.')
+        data = signing.b64_decode(value.lstrip('.').encode('ascii'))
+        if is_compressed:
+            data = zlib.decompress(data)
+        return json.loads(data.decode('utf-8'))
+    except (signing.BadSignature, ValueError, TypeError, zlib.error):
+        return None
@@ -0,0 +1,102 @@
+"""
+Run background work on a small, bounded pool of daemon threads.
+
+Used to refresh stale cache entries off the request path, and to prefetch lazy
+groups alongside the view. The pool never grows past its worker count, and
+work is dropped instead of queued without bound when Pipet is slow, so a burst
+of stale entries can't pile up threads or memory.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import os
+import threading
+
+from six.moves import queue
+
+from . import constants
+
+logger = logging.getLogger('application.proctor.executor')
+
+
+class BoundedExecutor(object):
+    """
+    Thread pool with a bounded queue that runs each key at most once at a time.
+
+    max_workers: Number of worker threads.
+    max_pending: Maximum number of queued calls. Calls submitted when the
+        queue is full are dropped.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None):
+        self.max_workers = (max_workers if max_workers is not None
+                            else constants.REFRESH_WORKERS)
+        self.max_pending = (max_pending if max_pending is not None
+                            else constants.REFRESH_QUEUE_SIZE)
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._keys = set()
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs) in a worker thread.
+
+        Return False if the call was dropped, because a call with the same key
+        is already queued or running, or because the queue is full.
+        """
+        with self._lock:
+            self._ensure_workers()
+            if key in self._keys:
+                return False
+            try:
+                self._queue.put_nowait((key, fn, args, kwargs))
+            except queue.Full:
+                logger.warning("Proctor background queue is full, dropped %s.", key)
+                return False
+            self._keys.add(key)
+        return True
+
+    def pending(self):
+        """Return the number of calls queued or running."""
+        return len(self._keys)
+
+    def _ensure_workers(self):
+        # Threads don't survive a fork, and neither should the parent's queue.
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._queue = queue.Queue(self.max_pending)
+        self._keys = set()
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self._work, args=(self._queue,),
+                                      name='proctor-worker-{0}'.format(i))
+            thread.daemon = True
+            thread.start()
+
+    def _work(self, work_queue):
+        while True:
+            key, fn, args, kwargs = work_queue.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                logger.exception("Proctor background call %s failed.", key)
+            finally:
+                with self._lock:
+                    self._keys.discard(key)
+
+
+_default_executor = BoundedExecutor()
+# Prefetches are waited on by requests, so they don't queue behind refreshes.
+_prefetch_executor = BoundedExecutor(constants.PREFETCH_WORKERS, constants.PREFETCH_QUEUE_SIZE)
+
+
+def get_default_executor():
+    """Return the process-wide BoundedExecutor."""
+    return _default_executor
+
+
+def get_prefetch_executor():
+    """Return the process-wide BoundedExecutor for lazy group prefetches."""
+    return _prefetch_executor
@@ -61,6 +61,7 @@ from __future__ import absolute_import, unicode_literals
 
 import collections
 import numbers
+import threading
 
 import six
 
@@ -70,6 +71,24 @@ GroupAssignment = collections.namedtuple(
 
 _UNASSIGNED_GROUP = GroupAssignment(group=None, value=None, payload=None)
 
+# Interned GroupAssignments of the most recent matrix versions, see
+# intern_assignment(). Each table maps (group, value, payload, payload type)
+# to a GroupAssignment.
+_MAX_INTERNED_VERSIONS = 2
+_MAX_INTERNED_ASSIGNMENTS = 10000
+_interned = collections.OrderedDict()
+_interned_lock = threading.Lock()
+
+# (test name, GroupAssignment) -> group string, or '' if the assignment isn't
+# logged. See get_group_strings().
+_MAX_GROUP_STRINGS = 10000
+_group_strings = {}
+
+# tuple of test names -> group_dict of unassigned groups, see
+# get_unassigned_groups().
+_MAX_UNASSIGNED_GROUP_DICTS = 100
+_unassigned_group_dicts = {}
+
 
 class ProctorGroups(object):
     """
@@ -77,17 +96,38 @@ class ProctorGroups(object):
 
     All test names provided to defined_tests in extract_groups() are
     guaranteed to exist as attributes of this object.
+
+    Instances are never plain ProctorGroups: constructing one returns an
+    instance of a subclass generated once per set of test names (see
+    get_groups_class()), where every test is a class attribute that reads the
+    group_dict. So construction doesn't depend on the number of tests.
     """
 
+    # __dict__ is kept so that other attributes can still be set, but it's
+    # only allocated if one is.
+    __slots__ = ('_group_dict', '_group_strings', '_group_string', '__dict__', '__weakref__')
+
+    # Set on generated subclasses.
+    _test_names = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._test_names is None:
+            cls = get_groups_class(cls, cls._get_test_names(*args, **kwargs))
+        return super(ProctorGroups, cls).__new__(cls)
+
     def __init__(self, group_dict):
         self._group_dict = group_dict
+        # Memoized by _get_group_strings() and get_group_string().
+        self._group_strings = None
+        self._group_string = None
+
+    def __reduce__(self):
+        # Generated subclasses can't be pickled by name.
+        return ProctorGroups, (self._group_dict,)
 
-        # For convenience, we allow all defined tests to be accessed through
-        # the dot operator on ProctorGroups.
-        for test_name, assignment in six.iteritems(group_dict):
-            # Make sure this doesn't overwrite an already-defined method.
-            if not hasattr(self, test_name):
-                setattr(self, test_name, assignment)
+    @classmethod
+    def _get_test_names(cls, group_dict):
+        return tuple(group_dict)
 
     def __str__(self):
         """
@@ -102,7 +142,26 @@ class ProctorGroups(object):
         "buttoncolortst1,countryalgotst0,newfeaturerollout0"
 
         """
-        return ','.join(self.get_group_string_list())
+        return self.get_group_string()
+
+    def get_group_string(self, extra_groups=()):
+        """
+        Return str(self) followed by the group strings in extra_groups.
+
+        >>> request.proc.get_group_string(['mysitetst1'])
+        "buttoncolortst1,countryalgotst0,newfeaturerollout0,mysitetst1"
+
+        Use this to log additional non-Proctor-related groups. Unlike adding
+        them to get_group_string_list(), this doesn't copy the Proctor groups.
+        """
+        if self._group_string is None:
+            self._group_string = ','.join(self._get_group_strings())
+        extra_group_string = ','.join(extra_groups)
+        if not extra_group_string:
+            return self._group_string
+        if not self._group_string:
+            return extra_group_string
+        return self._group_string + ',' + extra_group_string
 
     def get_group_string_list(self):
         """
@@ -116,11 +175,136 @@ class ProctorGroups(object):
         This method is useful if you'd like to add additional
         non-Proctor-related groups before passing this list to your logger.
         """
-        return [test_name + str(assignment.value)
-                for test_name, assignment in six.iteritems(self._group_dict)
-                if (assignment is not _UNASSIGNED_GROUP and
-                    isinstance(assignment.value, numbers.Number) and
-                    assignment.value >= 0)]
+        return list(self._get_group_strings())
+
+    def _get_group_strings(self):
+        if self._group_strings is None:
+            self._group_strings = get_group_strings(self._group_dict)
+        return self._group_strings
+
+    def _get_assignment(self, test_name):
+        return self._group_dict[test_name]
+
+
+class _TestAttribute(object):
+    """
+    Class attribute of a generated ProctorGroups subclass for one test.
+    """
+
+    __slots__ = ('test_name',)
+
+    def __init__(self, test_name):
+        self.test_name = test_name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return instance._get_assignment(self.test_name)
+        except KeyError:
+            raise AttributeError(self.test_name)
+
+
+# Generated classes by (base class, test names). Cleared when it gets too
+# large, which only happens if group dicts have many different sets of tests.
+_MAX_GROUPS_CLASSES = 100
+_groups_classes = {}
+
+
+def get_groups_class(base, test_names):
+    """
+    Return the subclass of base (ProctorGroups or a subclass) with an
+    attribute for each name in test_names, creating it on first use.
+
+    Test names that would overwrite an existing attribute of base (like a
+    method) are skipped.
+    """
+    key = (base, tuple(test_names))
+    groups_class = _groups_classes.get(key)
+    if groups_class is None:
+        namespace = {test_name: _TestAttribute(test_name)
+                     for test_name in key[1] if not hasattr(base, test_name)}
+        namespace.update(__slots__=(), __module__=base.__module__, _test_names=key[1])
+        groups_class = type(str(base.__name__), (base,), namespace)
+        if len(_groups_classes) >= _MAX_GROUPS_CLASSES:
+            _groups_classes.clear()
+        _groups_classes[key] = groups_class
+    return groups_class
+
+
+def get_group_strings(group_dict):
+    """
+    Return the list of group strings ({testname}{bucketvalue}) of the
+    assignments in group_dict with non-negative bucket values.
+
+    Each test and assignment's string is built once and reused, since
+    requests mostly get the same (interned) assignments.
+    """
+    get_group_string = _group_strings.get
+    group_strings = []
+    for item in six.iteritems(group_dict):
+        try:
+            group_string = get_group_string(item)
+        except TypeError:
+            # Unhashable payload.
+            group_string = _make_group_string(*item)
+        if group_string is None:
+            group_string = _make_group_string(*item)
+            if len(_group_strings) >= _MAX_GROUP_STRINGS:
+                _group_strings.clear()
+            _group_strings[item] = group_string
+        if group_string:
+            group_strings.append(group_string)
+    return group_strings
+
+
+def _make_group_string(test_name, assignment):
+    if (assignment is not _UNASSIGNED_GROUP and
+            isinstance(assignment.value, numbers.Number) and
+            assignment.value >= 0):
+        return test_name + str(assignment.value)
+    return ''
+
+
+def intern_assignment(matrix_version, group, value, payload):
+    """
+    Return a GroupAssignment that's shared by every caller asking for the
+    same assignment under the same matrix version.
+
+    Every request would otherwise allocate its own tuple for each test, even
+    though a matrix only has a handful of distinct assignments. Tables are
+    kept for the two most recent matrix versions, so older versions' payloads
+    are dropped after a change. Assignments with unhashable payloads (lists)
+    aren't shared, so no request can change another's payload.
+    """
+    if group is None and value is None and payload is None:
+        return _UNASSIGNED_GROUP
+
+    table = _interned.get(matrix_version)
+    if table is None:
+        table = _get_intern_table(matrix_version)
+
+    # 1 and 1.0 are equal, but longValue and doubleValue payloads aren't.
+    key = (group, value, payload, type(payload))
+    try:
+        assignment = table.get(key)
+    except TypeError:
+        return GroupAssignment(group, value, payload)
+    if assignment is None:
+        assignment = GroupAssignment(group, value, payload)
+        if len(table) < _MAX_INTERNED_ASSIGNMENTS:
+            assignment = table.setdefault(key, assignment)
+    return assignment
+
+
+def _get_intern_table(matrix_version):
+    with _interned_lock:
+        table = _interned.get(matrix_version)
+        if table is None:
+            table = _interned[matrix_version] = {}
+            while len(_interned) > _MAX_INTERNED_VERSIONS:
+                _interned.popitem(last=False)
+        return table
 
 
 def extract_groups(api_response, defined_tests):
@@ -139,6 +323,7 @@ def extract_groups(api_response, defined_tests):
         return {test_name: _UNASSIGNED_GROUP for test_name in defined_tests}
 
     api_groups = api_response['data']['groups']
+    matrix_version = api_response['data'].get('audit', {}).get('version')
     group_dict = {}
     for test_name in defined_tests:
         if test_name in api_groups:
@@ -147,8 +332,8 @@ def extract_groups(api_response, defined_tests):
             # Sometimes there is no payload.
             payload = (bucket_fields['payload'].popitem()[1]
                        if 'payload' in bucket_fields else None)
-            assignment = GroupAssignment(group=bucket_fields['name'],
-                                         value=bucket_fields['value'], payload=payload)
+            assignment = intern_assignment(matrix_version, bucket_fields['name'],
+                                           bucket_fields['value'], payload)
             group_dict[test_name] = assignment
         else:
             # The API doesn't include a response for unassigned tests.
@@ -158,3 +343,21 @@ def extract_groups(api_response, defined_tests):
             group_dict[test_name] = _UNASSIGNED_GROUP
 
     return group_dict
+
+
+def get_unassigned_groups(defined_tests):
+    """
+    Return a group_dict of every test in defined_tests to the unassigned
+    GroupAssignment, like extract_groups(None, defined_tests).
+
+    The dict is built once per set of tests and shared, so it must not be
+    modified.
+    """
+    key = tuple(defined_tests)
+    group_dict = _unassigned_group_dicts.get(key)
+    if group_dict is None:
+        group_dict = extract_groups(None, key)
+        if len(_unassigned_group_dicts) >= _MAX_UNASSIGNED_GROUP_DICTS:
+            _unassigned_group_dicts.clear()
+        _unassigned_group_dicts[key] = group_dict
+    return group_dict
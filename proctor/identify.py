@@ -1,13 +1,20 @@
 from __future__ import absolute_import, unicode_literals
 
+import six
 from django.conf import settings
 
 from . import api
+from . import executor
 from . import groups
 from . import lazy as lazy_groups
+from . import metrics
+from . import singleflight
 
+_in_flight = singleflight.SingleFlight()
 
-def identify_groups(params, cacher=None, request=None, lazy=False, http=None):
+
+def identify_groups(params, cacher=None, request=None, lazy=False, http=None, evaluator=None,
+                    prefetch=False, prefetch_timeout_seconds=None):
     """
     Identify the groups associated with the params and return ProctorGroups.
 
@@ -18,10 +25,19 @@ def identify_groups(params, cacher=None, request=None, lazy=False, http=None):
     request: The Django request. Only used if cacher is a cache.SessionCacher.
         (default: None)
     http: An instance of requests.Session (or equivalent), used for making
-        http requests (default: None)
+        http requests (default: None, which uses the pooled session)
     lazy: A bool indicating whether group assignment should be lazy. If True,
         cache lookup and HTTP requests to the Proctor API are delayed until
         the group assignments are accessed for the first time. (default: False)
+    evaluator: If provided, use this local.LocalEvaluator instance to assign
+        groups from the downloaded test matrix instead of calling the Proctor
+        API. Falls back to the API when it can't evaluate. (default: None)
+    prefetch: A bool indicating whether lazy group assignment should start in
+        the background right away, so that first access only waits for it.
+        Only used if lazy is True. (default: False)
+    prefetch_timeout_seconds: How long after this call the first access of
+        prefetched groups waits before using unassigned groups.
+        (default: constants.PREFETCH_TIMEOUT_SECONDS)
 
     You can access test group assignments through the dot operator on the
     returned ProctorGroups:
@@ -30,52 +46,180 @@ def identify_groups(params, cacher=None, request=None, lazy=False, http=None):
     GroupAssignment(group=u'blue', value=1, payload=u'#2B60DE')
 
     See groups.py or the README for more details.
+
+    If no test can be assigned with the identifiers in params, like for bots
+    and first-time visitors without a tracking cookie, unassigned groups are
+    returned right away, without a cache lookup or API call.
     """
+    unassigned_groups = get_unassigned_groups(params, evaluator)
+    if unassigned_groups is not None:
+        return unassigned_groups
     if lazy:
-        return lazy_groups.LazyProctorGroups(params, cacher, request, http)
+        proc = lazy_groups.LazyProctorGroups(params, cacher, request, http, evaluator)
+        if prefetch:
+            proc.prefetch(prefetch_timeout_seconds)
+        return proc
     else:
-        return groups.ProctorGroups(load_group_dict(params, cacher, request, http))
+        return groups.ProctorGroups(
+            load_group_dict(params, cacher, request, http, evaluator))
+
+
+def get_unassigned_groups(params, evaluator=None):
+    """
+    Return ProctorGroups with every test unassigned if no test can be assigned
+    with the identifiers in params. Otherwise, return None.
+
+    That's the case if params has no identifiers, since Proctor needs at
+    least one, or if evaluator's current test matrix shows that no test uses
+    the types of its identifiers. Forced groups are always identified.
+    """
+    if params.force_groups:
+        return None
+    if has_identifiers(params):
+        if evaluator is None or evaluator.can_assign(params) is not False:
+            return None
+    return groups.ProctorGroups(groups.get_unassigned_groups(params.defined_tests))
+
+
+def has_identifiers(params):
+    """
+    Return True if params has an identifier that isn't None or empty.
+    """
+    return any(value is not None and value != ''
+               for value in six.itervalues(params.identifier_dict))
 
 
-def load_group_dict(params, cacher=None, request=None, http=None):
+def load_group_dict(params, cacher=None, request=None, http=None, evaluator=None):
     group_dict = None
+    cached = None
     if cacher is not None:
-        group_dict = cacher.get(request, params)
+        cached = cacher.lookup(request, params)
+        if cached.stale:
+            revalidate(params, cacher, http, evaluator, cached)
+        if cached.stale or not cached.changed_tests:
+            group_dict = cached.group_dict
     if group_dict is None:
-        # Cache miss or caching disabled.
-        api_response = api.call_proctor_identify(params, http=http)
-        if api_response:
-            group_dict = groups.extract_groups(api_response, params.defined_tests)
-        else:
+        # Cache miss, partially invalid entry, or caching disabled.
+        # Concurrent identical misses wait on one API call and share it.
+        (group_dict, api_response), shared = _in_flight.do(
+            params.fingerprint, _fetch_group_dict, params, cacher, request, http, evaluator,
+            cached)
+        if group_dict is None:
             # If api request failed, attempt to force load from cache
             if cacher:
                 group_dict = cacher.get(request, params, allow_expired=True)
+                record_fallback(group_dict)
 
             if not group_dict:
                 group_dict = groups.extract_groups(None, params.defined_tests)
-
-        # Must cache the api response, but not if api had an error.
-        if cacher is not None and api_response is not None:
+        elif shared and cacher is not None and cacher.request_scoped:
+            # The shared cache write went into the other request's storage.
             cacher.set(request, params, group_dict, api_response)
 
     return group_dict
 
 
-def proc_by_accountid(accountid):
+def _fetch_group_dict(params, cacher=None, request=None, http=None, evaluator=None,
+                      cached=None):
+    """
+    Call the API and cache the result.
+
+    If cached is a cache.CacheResult with changed tests, only those tests are
+    identified and merged into its group_dict.
+
+    Return (group_dict, api_response). group_dict is None if the API had an
+    error.
+    """
+    identify_params = get_identify_params(params, cached)
+    api_response = _identify(identify_params, http, evaluator)
+    if not api_response:
+        return None, api_response
+
+    group_dict = merge_groups(identify_params, api_response, cached)
+    # Must cache the api response, but not if api had an error.
+    if cacher is not None:
+        cacher.set(request, params, group_dict, api_response)
+    return group_dict, api_response
+
+
+def get_identify_params(params, cached=None):
+    """
+    Return the ProctorParameters to identify, which only include the changed
+    tests if cached is a cache.CacheResult with changed tests.
+    """
+    if cached is not None and cached.changed_tests:
+        return params.with_tests(cached.changed_tests)
+    return params
+
+
+def merge_groups(identify_params, api_response, cached=None):
+    """
+    Return the group_dict of an API response for identify_params, merged into
+    the group_dict of cached if only its changed tests were identified.
+    """
+    group_dict = groups.extract_groups(api_response, identify_params.defined_tests)
+    if cached is not None and cached.changed_tests:
+        merged_group_dict = dict(cached.group_dict)
+        merged_group_dict.update(group_dict)
+        return merged_group_dict
+    return group_dict
+
+
+def record_fallback(group_dict):
+    """
+    Report a lookup of expired cache entries after an API error.
+    """
+    metrics.increment('proctor_cache_fallbacks_total',
+                      {'result': 'hit' if group_dict else 'miss'})
+
+
+def revalidate(params, cacher, http=None, evaluator=None, cached=None):
+    """
+    Refresh the cached groups for params in the background.
+
+    Only for cachers that aren't request-scoped. Return False if the refresh
+    was dropped because it's already pending or the executor is busy.
+    """
+    return executor.get_default_executor().submit(
+        params.fingerprint, _fetch_group_dict, params, cacher, None, http, evaluator, cached)
+
+
+def _identify(params, http=None, evaluator=None):
+    """
+    Return a /groups/identify response, evaluated locally if possible.
+    """
+    if evaluator is not None:
+        api_response = evaluator.identify(params, http=http)
+        if api_response is not None:
+            return api_response
+    return api.call_proctor_identify(params, http=http)
+
+
+def proc_by_accountid(accountid, account_loader=None):
     """ Gets proctor groups by accountid
 
     Args:
         accountid: typically the same id found in request.user.username
+        account_loader: optional loader.AccountLoader, which loads the groups
+            together with the other accounts it was asked for.
 
     Returns:
         GroupAssignment
     """
+    if account_loader is not None:
+        return account_loader.load(accountid)
+    return identify_groups(get_account_params(accountid))
+
+
+def get_account_params(accountid):
+    """
+    Return the ProctorParameters used to identify an account's groups.
+    """
     identifier = {'account': accountid}
-    params = api.ProctorParameters(
+    return api.ProctorParameters(
                 api_root=settings.PROCTOR_API_ROOT,
                 defined_tests=settings.PROCTOR_TESTS,
                 context_dict={'ua': ''},
                 identifier_dict=identifier,
                 force_groups=None,
             )
-    return identify_groups(params)
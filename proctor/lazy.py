@@ -1,9 +1,18 @@
 from __future__ import absolute_import, unicode_literals
 
+import logging
+import sys
+import threading
+import time
+
 import six
 
+from . import constants
+from . import executor
 from . import groups
 
+logger = logging.getLogger('application.proctor.lazy')
+
 
 class LazyProctorGroups(groups.ProctorGroups):
     """
@@ -11,22 +20,38 @@ class LazyProctorGroups(groups.ProctorGroups):
 
     Specifically, the first load will be done when an attribute of a
     GroupAssignment is accessed or when the group string list is requested.
+
+    After prefetch(), the load runs in the background right away, and the
+    first usage only waits for it.
     """
 
-    def __init__(self, params, cacher=None, request=None, http=None):
+    __slots__ = ('loaded', '_params', '_cacher', '_request', '_http', '_evaluator',
+                 '_prefetch')
+
+    def __init__(self, params, cacher=None, request=None, http=None, evaluator=None):
         self.loaded = False
         self._params = params
         self._cacher = cacher
         self._request = request
         self._http = http
-        group_dict = {test: LazyGroupAssignment(self, test)
-                      for test in params.defined_tests}
-        super(LazyProctorGroups, self).__init__(group_dict)
+        self._evaluator = evaluator
+        self._prefetch = None
+        super(LazyProctorGroups, self).__init__(None)
+
+    @classmethod
+    def _get_test_names(cls, params, *args, **kwargs):
+        return params.defined_tests
 
-    def get_group_string_list(self):
+    def _get_assignment(self, test_name):
+        if not self.loaded:
+            # Only tests that are actually used get a lazy assignment.
+            return LazyGroupAssignment(self, test_name)
+        return self._group_dict[test_name]
+
+    def _get_group_strings(self):
         # group_dict must be really loaded before we read it.
         self.load()
-        return super(LazyProctorGroups, self).get_group_string_list()
+        return super(LazyProctorGroups, self)._get_group_strings()
 
     def load(self):
         """
@@ -39,20 +64,118 @@ class LazyProctorGroups(groups.ProctorGroups):
             # Don't double-load.
             return
 
-        self._group_dict = identify.load_group_dict(
-            self._params, self._cacher, self._request, self._http)
+        prefetch, self._prefetch = self._prefetch, None
+        if prefetch is not None:
+            group_dict = prefetch.wait()
+            if group_dict is None:
+                logger.warning("Proctor prefetch did not finish in time. "
+                               "Using unassigned groups.")
+                group_dict = groups.extract_groups(None, self._params.defined_tests)
+            self.set_group_dict(group_dict)
+            return
+
+        self.set_group_dict(identify.load_group_dict(
+            self._params, self._cacher, self._request, self._http, self._evaluator))
+
+    def prefetch(self, timeout_seconds=None, prefetch_executor=None):
+        """
+        Start loading the groups on the prefetch executor's threads, so that
+        the cache lookup and Proctor API call run alongside the view.
+
+        The first usage waits for the load until timeout_seconds after this
+        call (default: constants.PREFETCH_TIMEOUT_SECONDS), and then uses
+        unassigned groups.
+
+        Return False if the groups are loaded on first usage as usual, because
+        the executor's queue is full or because the cacher stores entries on
+        the request, which shouldn't be used from another thread.
+        """
+        if self.loaded or self._prefetch is not None:
+            return False
+        if self._cacher is not None and self._cacher.request_scoped:
+            return False
+
+        if timeout_seconds is None:
+            timeout_seconds = constants.PREFETCH_TIMEOUT_SECONDS
+        prefetch_executor = prefetch_executor or executor.get_prefetch_executor()
+
+        prefetch = _Prefetch(time.time() + timeout_seconds)
+        if not prefetch_executor.submit(prefetch, prefetch.run, self._params, self._cacher,
+                                        self._http, self._evaluator):
+            return False
+        self._prefetch = prefetch
+        return True
+
+    def __reduce__(self):
+        # Pickle as the loaded ProctorGroups.
+        self.load()
+        return super(LazyProctorGroups, self).__reduce__()
+
+    def aload(self):
+        """
+        Async counterpart of load(). Return an awaitable.
+
+        >>> await request.proc.aload()
+        """
+        from . import aio
+        return aio.load_lazy_groups(self)
+
+    def set_group_dict(self, group_dict):
+        """
+        Replace the lazy group_dict with a loaded group_dict.
+        """
+        self._group_dict = group_dict
+        self._group_strings = None
+        self._group_string = None
 
         if self._group_dict:
-            # Replace lazy attributes with loaded group assignments.
-            for test_name, assignment in six.iteritems(self._group_dict):
-                # Don't overwrite anything we don't mean to.
-                if isinstance(getattr(self, test_name), LazyGroupAssignment):
-                    setattr(self, test_name, assignment)
+            # Test attributes now return loaded group assignments.
             self.loaded = True
 
 
+class _Prefetch(object):
+    """
+    A load_group_dict() call running in the background, which can be waited
+    for until a deadline (a time.time() value).
+    """
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.group_dict = None
+        self._exc_info = None
+        self._cancelled = False
+        self._done = threading.Event()
+
+    def run(self, params, cacher, http, evaluator):
+        from . import identify
+
+        if self._cancelled:
+            # Nobody is waiting anymore.
+            return
+        try:
+            self.group_dict = identify.load_group_dict(params, cacher, None, http, evaluator)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def wait(self):
+        """
+        Return the loaded group_dict, or None if it wasn't loaded by the
+        deadline. Raise the exception of the load if it raised one.
+        """
+        if not self._done.wait(max(0, self.deadline - time.time())):
+            self._cancelled = True
+            return None
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+        return self.group_dict
+
+
 class LazyGroupAssignment(object):
 
+    __slots__ = ('_lazy_groups', '_test_name')
+
     def __init__(self, lazy_groups, test_name):
         self._lazy_groups = lazy_groups
         self._test_name = test_name
@@ -0,0 +1,190 @@
+"""
+Load the groups of many accounts together.
+
+identify.proc_by_accountid() makes one API call per account, so a page or a
+job that loops over hundreds of accounts makes hundreds of sequential calls.
+An AccountLoader instead hands out lazy ProctorGroups for each account, and
+the first one used loads all accounts requested so far at once: cache
+entries are fetched with one Cacher.get_many() call, misses are identified on
+up to max_workers threads, and the results are cached with one
+Cacher.set_many() call.
+
+    account_loader = loader.get_account_loader(request)
+    procs = [account_loader.load(account.id) for account in accounts]
+    for account, proc in zip(accounts, procs):
+        if proc.newfeaturerollout.group == 'active':
+            ...
+
+Loaders are meant to be short-lived, like one per request or per job run.
+Requesting the same account twice returns the same ProctorGroups.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+
+from six.moves import queue
+
+from . import constants
+from . import groups
+from . import identify
+from . import lazy
+
+logger = logging.getLogger('application.proctor.loader')
+
+
+class AccountLoader(object):
+    """
+    Batches the identification of account groups.
+
+    cacher: Optional cache.Cacher. Request-scoped cachers (like the session)
+        hold one visitor's groups, so they're not used.
+    http: An instance of requests.Session (or equivalent), or None for the
+        pooled session.
+    evaluator: Optional local.LocalEvaluator.
+    max_workers: Maximum number of concurrent API calls.
+        Default: constants.LOADER_WORKERS
+    """
+
+    def __init__(self, cacher=None, http=None, evaluator=None, max_workers=None):
+        if cacher is not None and cacher.request_scoped:
+            cacher = None
+        self.cacher = cacher
+        self.http = http
+        self.evaluator = evaluator
+        self.max_workers = max_workers or constants.LOADER_WORKERS
+
+        self._lock = threading.Lock()
+        # accountid -> AccountProctorGroups
+        self._groups = {}
+        self._pending = []
+
+    def load(self, accountid):
+        """
+        Return the lazy ProctorGroups of an account.
+        """
+        with self._lock:
+            proc = self._groups.get(accountid)
+            if proc is None:
+                proc = AccountProctorGroups(identify.get_account_params(accountid), self)
+                self._groups[accountid] = proc
+                self._pending.append(proc)
+        return proc
+
+    def load_many(self, accountids):
+        """
+        Return a list of the lazy ProctorGroups of accounts.
+        """
+        return [self.load(accountid) for accountid in accountids]
+
+    def resolve(self):
+        """
+        Load the groups of all accounts requested so far.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        pending = [proc for proc in pending if not proc.loaded]
+        if not pending:
+            return
+
+        group_dicts = [None] * len(pending)
+        if self.cacher is not None:
+            group_dicts = self.cacher.get_many(None, [proc._params for proc in pending])
+
+        misses = [index for index, group_dict in enumerate(group_dicts) if group_dict is None]
+        responses = _fan_out(self._identify, [pending[index]._params for index in misses],
+                             self.max_workers)
+
+        cache_items = []
+        for index, (group_dict, api_response) in zip(misses, responses):
+            params = pending[index]._params
+            if group_dict is not None:
+                cache_items.append((params, group_dict, api_response))
+            elif self.cacher is not None:
+                # If api request failed, attempt to force load from cache
+                group_dict = self.cacher.get(None, params, allow_expired=True)
+                identify.record_fallback(group_dict)
+            group_dicts[index] = group_dict or groups.extract_groups(None, params.defined_tests)
+        if cache_items and self.cacher is not None:
+            self.cacher.set_many(None, cache_items)
+
+        for proc, group_dict in zip(pending, group_dicts):
+            proc.set_group_dict(group_dict)
+
+    def _identify(self, params):
+        """
+        Return (group_dict, api_response). group_dict is None if the API had
+        an error.
+        """
+        api_response = identify._identify(params, self.http, self.evaluator)
+        if not api_response:
+            return None, api_response
+        return groups.extract_groups(api_response, params.defined_tests), api_response
+
+
+class AccountProctorGroups(lazy.LazyProctorGroups):
+    """
+    Lazy ProctorGroups of an account, which are loaded together with the
+    other accounts of its AccountLoader.
+    """
+
+    __slots__ = ('_loader',)
+
+    def __init__(self, params, account_loader):
+        super(AccountProctorGroups, self).__init__(
+            params, account_loader.cacher, None, account_loader.http, account_loader.evaluator)
+        self._loader = account_loader
+
+    def load(self):
+        if self.loaded:
+            return
+        self._loader.resolve()
+        if not self.loaded:
+            # Another thread is resolving the batch with this account.
+            super(AccountProctorGroups, self).load()
+
+
+def get_account_loader(request, cacher=None, http=None, evaluator=None):
+    """
+    Return the AccountLoader of a request, creating it on first use.
+    """
+    account_loader = getattr(request, '_proctor_account_loader', None)
+    if account_loader is None:
+        account_loader = AccountLoader(cacher, http, evaluator)
+        request._proctor_account_loader = account_loader
+    return account_loader
+
+
+def _fan_out(fn, items, max_workers):
+    """
+    Return [fn(item) for item in items], calling fn on up to max_workers
+    threads. Items whose call raised get (None, None).
+    """
+    results = [(None, None)] * len(items)
+    work_queue = queue.Queue()
+    for index, item in enumerate(items):
+        work_queue.put((index, item))
+
+    def work():
+        while True:
+            try:
+                index, item = work_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = fn(item)
+            except Exception:
+                logger.exception("Proctor account groups could not be loaded.")
+
+    if len(items) <= 1 or max_workers <= 1:
+        work()
+        return results
+
+    threads = [threading.Thread(target=work, name='proctor-loader-{0}'.format(i))
+               for i in range(min(max_workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
@@ -0,0 +1,378 @@
+"""
+Evaluate Proctor group assignments in-process from the test matrix.
+
+Instead of calling the Proctor REST API /groups/identify endpoint for every
+cache miss, LocalEvaluator downloads the test matrix once through the
+/proctor/matrix endpoint and applies Proctor's allocation ranges and salted
+identifier hashing itself.
+
+The result of LocalEvaluator.identify() has the same shape as a
+/groups/identify API response, so it can be passed to groups.extract_groups()
+and cache.Cacher.set() exactly like a real API response.
+
+Experimental: identifier hashing and bucket choice aren't checked against
+recorded Pipet responses until a recording is committed (see
+tests/record_identify.py).
+
+Local evaluation only handles what it can evaluate faithfully. Tests with
+eligibility or allocation rules that are not constant expressions depend on
+Pipet's context variable conversion and JEXL evaluation, so identify() returns
+None for them and the caller falls back to the REST API.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import logging
+import re
+import struct
+import threading
+import time
+import uuid
+
+import six
+
+from . import api
+from . import constants
+from . import executor
+
+logger = logging.getLogger('application.proctor.local')
+
+# Hash values are signed 32-bit integers, like Java ints in Proctor.
+_INT_MIN = -(2 ** 31)
+_INT_RANGE = 2 ** 32 - 1
+
+_TRUE_RULES = frozenset(['', '${true}', '${ true }'])
+_FALSE_RULES = frozenset(['${false}', '${ false }'])
+
+# prforceGroups entries are a test name directly followed by a bucket value.
+_FORCE_GROUP_RE = re.compile(r'^(.+?)(-?\d+)$')
+
+
+class UnsupportedRule(Exception):
+    """Raised when a test uses a rule that can't be evaluated locally."""
+
+
+def hash_identifier(salt, identifier):
+    """
+    Return Proctor's signed 32-bit hash of an identifier for a salt.
+
+    This is the big-endian int of the last four bytes of the MD5 digest of the
+    salt followed by the identifier, like Proctor's StandardTestChooser.
+    """
+    digest = hashlib.md5(
+        (salt + identifier).encode('utf-8')).digest()
+    return struct.unpack('>i', digest[12:16])[0]
+
+
+def get_test_salt(test_name, test_definition):
+    """
+    Return the salt used to hash identifiers for a test.
+
+    Salts starting with '&' are shared between tests and used as-is (minus the
+    '&'), so those tests get correlated assignments. Other salts are prefixed
+    with the test name.
+    """
+    salt = test_definition.get('salt') or ''
+    if salt.startswith('&'):
+        return salt[1:] + '.'
+    return test_name + '|' + salt + '.'
+
+
+def parse_force_groups(force_groups):
+    """
+    Return a dict of test name to forced bucket value from a prforceGroups
+    string like "buttoncolortst2,countryalgotst0".
+    """
+    forced = {}
+    if not force_groups:
+        return forced
+
+    for entry in force_groups.split(','):
+        match = _FORCE_GROUP_RE.match(entry.strip())
+        if match:
+            forced[match.group(1)] = int(match.group(2))
+    return forced
+
+
+def _rule_matches(rule):
+    """
+    Return whether a constant rule matches.
+
+    Raise UnsupportedRule if the rule depends on context variables.
+    """
+    if rule is None:
+        return True
+
+    normalized = rule.strip()
+    if normalized in _TRUE_RULES:
+        return True
+    if normalized in _FALSE_RULES:
+        return False
+
+    raise UnsupportedRule(rule)
+
+
+def _choose_bucket(ranges, buckets_by_value, hash_value):
+    """
+    Return the bucket whose allocation range contains hash_value.
+
+    Each range covers a slice of the signed 32-bit hash space proportional to
+    its length, in the order the ranges are defined.
+    """
+    bucket_total = 0.0
+    for test_range in ranges[:-1]:
+        bucket_total += test_range['length']
+        cutoff = int(_INT_MIN + bucket_total * _INT_RANGE)
+        if hash_value <= cutoff:
+            return buckets_by_value.get(test_range['bucketValue'])
+    return buckets_by_value.get(ranges[-1]['bucketValue']) if ranges else None
+
+
+def _bucket_fields(test_definition, bucket):
+    """
+    Return the /groups/identify representation of a matrix bucket.
+
+    Payloads are copied because groups.extract_groups() consumes them and the
+    matrix is shared between requests.
+    """
+    fields = {
+        'name': bucket['name'],
+        'value': bucket['value'],
+        'version': test_definition.get('version'),
+    }
+    payload = bucket.get('payload')
+    if payload:
+        payload = {key: value for key, value in six.iteritems(payload)
+                   if value is not None}
+        if payload:
+            fields['payload'] = payload
+    return fields
+
+
+class LocalEvaluator(object):
+    """
+    Assign test groups locally using a periodically downloaded test matrix.
+
+    api_root: The root URL of the Proctor API. No trailing slash.
+    defined_tests: List of test names this application uses. Only these tests
+        are downloaded and evaluated.
+    identifier_types: Optional dict mapping identifier source keys (the keys
+        of ProctorParameters.identifier_dict) to Proctor test types. Keys
+        without a mapping must be test types themselves, like 'USER'.
+        Requests with other identifiers aren't evaluated locally, since
+        there's no telling which tests they serve.
+    matrix_timeout_seconds: The test matrix is downloaded again at least this
+        often. Default: 5 minutes
+    """
+
+    def __init__(self, api_root, defined_tests, identifier_types=None,
+                 matrix_timeout_seconds=None):
+        self.api_root = api_root
+        self.defined_tests = list(defined_tests)
+        self.identifier_types = identifier_types or {}
+        self.matrix_timeout_seconds = (matrix_timeout_seconds
+                                       if matrix_timeout_seconds is not None
+                                       else (5 * 60))
+
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._matrix_expiry_time = 0
+
+    def identify(self, params, http=None):
+        """
+        Return a /groups/identify shaped response for the ProctorParameters.
+
+        Return None if the assignment can't be evaluated locally, like when
+        the matrix can't be downloaded or a test uses a context rule. Callers
+        should fall back to the REST API in that case.
+        """
+        if params.api_root != self.api_root:
+            return None
+
+        matrix = self.get_matrix(http)
+        if matrix is None:
+            return None
+
+        tests = matrix['tests']
+        if any(test_name not in tests for test_name in params.defined_tests):
+            # Not downloaded, so it's not safe to treat the test as missing.
+            return None
+
+        identifiers = self._get_identifiers_by_type(params.identifier_dict, matrix)
+        if identifiers is None:
+            logger.debug("Proctor local evaluation skipped, unknown identifier types in %s.",
+                         list(params.identifier_dict))
+            return None
+        forced = parse_force_groups(params.force_groups)
+
+        api_groups = {}
+        try:
+            for test_name in params.defined_tests:
+                test_definition = tests[test_name]
+                if not test_definition:
+                    # Test isn't in the matrix. Unassigned.
+                    continue
+                bucket = self._assign(test_name, test_definition, identifiers,
+                                      forced.get(test_name))
+                if bucket is not None:
+                    api_groups[test_name] = _bucket_fields(test_definition, bucket)
+        except UnsupportedRule as e:
+            logger.debug("Proctor local evaluation skipped, unsupported rule: %s", e)
+            return None
+
+        return {'data': {'groups': api_groups, 'audit': matrix['audit']}}
+
+    def can_assign(self, params):
+        """
+        Return False if the current matrix shows that no test of params can
+        be assigned with its identifiers: no test is random or uses the type
+        of one of the identifiers. Return True if a test may be assigned, or
+        None if there's no matrix yet or an identifier's type is unknown (see
+        identifier_types).
+
+        Never downloads the matrix, so it's cheap enough for every request.
+        """
+        matrix = self._matrix
+        if matrix is None or params.api_root != self.api_root:
+            return None
+
+        test_types = matrix['test_types']
+        if any(test_name not in test_types for test_name in params.defined_tests):
+            # Not downloaded, so its type is unknown.
+            return None
+
+        identifiers = self._get_identifiers_by_type(params.identifier_dict, matrix)
+        if identifiers is None:
+            # It may serve any of the tests.
+            return None
+        for test_name in params.defined_tests:
+            test_type = test_types[test_name]
+            if test_type == constants.TEST_TYPE_RANDOM or test_type in identifiers:
+                return True
+        return False
+
+    def get_matrix(self, http=None):
+        """
+        Return the downloaded matrix, or None if it couldn't be downloaded.
+
+        The matrix is a dict of 'audit' and 'tests' like matrix.extract_tests(),
+        'test_types', which maps test names to their type, and 'type_names',
+        the set of test types identifier keys may be named after.
+
+        Only the first download blocks. An expired matrix keeps being returned
+        while one background thread refreshes it, and if a refresh fails, the
+        previous matrix keeps being used.
+        """
+        matrix = self._matrix
+        if matrix is not None:
+            if time.time() >= self._matrix_expiry_time:
+                executor.get_default_executor().submit(
+                    ('matrix', id(self)), self._refresh_expired_matrix, http)
+            return matrix
+
+        with self._lock:
+            # Another thread may have downloaded it while we waited, or just
+            # failed to, in which case the API is used until the next try.
+            if self._matrix is None and time.time() >= self._matrix_expiry_time:
+                self._refresh_matrix(http)
+        return self._matrix
+
+    def needs_download(self):
+        """
+        Return True if get_matrix() would wait for the matrix to download.
+        """
+        return self._matrix is None and time.time() >= self._matrix_expiry_time
+
+    def _refresh_expired_matrix(self, http):
+        with self._lock:
+            # The watcher may have published a matrix since.
+            if time.time() >= self._matrix_expiry_time:
+                self._refresh_matrix(http)
+
+    def _refresh_matrix(self, http):
+        params = api.ProctorParameters(
+            api_root=self.api_root,
+            defined_tests=self.defined_tests,
+            context_dict={},
+            identifier_dict={},
+            force_groups=None,
+        )
+        api_response = api.call_proctor_matrix(params, http=http)
+        # Retry failures on the next refresh instead of on every request.
+        self._matrix_expiry_time = time.time() + self.matrix_timeout_seconds
+        if api_response is None:
+            logger.error("Proctor local evaluation could not download the test matrix.")
+            return
+        self._set_matrix(api_response)
+
+    def publish_matrix(self, matrix_response):
+        """
+        Use a /proctor/matrix response fetched elsewhere, like by
+        watcher.MatrixWatcher. Postpones the next refresh.
+        """
+        with self._lock:
+            self._set_matrix(matrix_response)
+            self._matrix_expiry_time = time.time() + self.matrix_timeout_seconds
+
+    def _set_matrix(self, api_response):
+        api_tests = api_response['tests']
+        tests = {test_name: api_tests.get(test_name) or {}
+                 for test_name in self.defined_tests}
+        test_types = {test_name: test_definition.get('testType')
+                      for test_name, test_definition in six.iteritems(tests)}
+        self._matrix = {
+            'audit': api_response.get('audit', {}),
+            'tests': tests,
+            # Used on every request by can_assign(). Tests missing from the
+            # matrix have no type.
+            'test_types': test_types,
+            # Identifier keys that are test type names don't need a mapping.
+            'type_names': frozenset(constants.TEST_TYPES).union(test_types.values()),
+        }
+
+    def _get_identifiers_by_type(self, identifier_dict, matrix):
+        """
+        Return a dict of test type to identifier, or None if the type of an
+        identifier is unknown: its key has no mapping in identifier_types and
+        isn't a test type name.
+        """
+        identifiers = {}
+        for key, value in six.iteritems(identifier_dict):
+            if value is None or value == '':
+                continue
+            test_type = self.identifier_types.get(key)
+            if test_type is None:
+                if key not in matrix['type_names']:
+                    return None
+                test_type = key
+            identifiers[test_type] = six.text_type(value)
+        return identifiers
+
+    def _assign(self, test_name, test_definition, identifiers, forced_value):
+        """
+        Return the matrix bucket assigned for a test, or None if unassigned.
+        """
+        buckets_by_value = {bucket['value']: bucket
+                            for bucket in test_definition.get('buckets', [])}
+
+        if forced_value is not None and forced_value in buckets_by_value:
+            return buckets_by_value[forced_value]
+
+        test_type = test_definition.get('testType')
+        if test_type == constants.TEST_TYPE_RANDOM:
+            identifier = uuid.uuid4().hex
+        else:
+            identifier = identifiers.get(test_type)
+            if identifier is None:
+                # No matching identifier, so Proctor skips the test.
+                return None
+
+        if not _rule_matches(test_definition.get('rule')):
+            return None
+
+        for allocation in test_definition.get('allocations', []):
+            if _rule_matches(allocation.get('rule')):
+                salt = get_test_salt(test_name, test_definition)
+                return _choose_bucket(allocation.get('ranges', []), buckets_by_value,
+                                      hash_identifier(salt, identifier))
+        return None
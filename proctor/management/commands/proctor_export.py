@@ -0,0 +1,248 @@
+"""
+Export the group assignments of many accounts.
+
+    python manage.py proctor_export --input ids.txt --output groups.csv --checkpoint ckpt.json
+
+Account ids are read one per line from a file or stdin and streamed through
+in batches, so memory stays bounded no matter how many accounts there are.
+Each batch is identified by a loader.AccountLoader on a pool of threads,
+using local matrix evaluation if PROCTOR_LOCAL_EVALUATION is True and the
+Proctor API through the pooled HTTP session otherwise.
+
+With --checkpoint, the number of exported accounts and the size of the
+output file are saved after every batch, and --resume continues an
+interrupted export where it stopped. Output written after the last
+checkpoint is truncated first, so no account is exported twice.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+import six
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import constants
+from ... import loader
+from ... import local
+from ... import watcher
+
+FORMATS = ('csv', 'jsonl')
+
+
+class Command(BaseCommand):
+    help = "Export the Proctor group assignments of account ids read from a file or stdin."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input', default='-',
+                            help="File of account ids, one per line. Default: stdin")
+        parser.add_argument('--output', default='-',
+                            help="File to write assignments to. Default: stdout")
+        parser.add_argument('--format', choices=FORMATS, default='csv',
+                            help="csv: one column of bucket values per test. "
+                                 "jsonl: one JSON object per account with full assignments.")
+        parser.add_argument('--workers', type=int, default=constants.LOADER_WORKERS,
+                            help="Number of concurrent identify calls.")
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of accounts identified together.")
+        parser.add_argument('--checkpoint',
+                            help="File where progress is saved after every batch.")
+        parser.add_argument('--resume', action='store_true',
+                            help="Skip the accounts exported according to --checkpoint "
+                                 "and append to --output.")
+        parser.add_argument('--progress', type=int, default=10000,
+                            help="Report progress every this many accounts. 0 disables it.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError("--batch-size and --workers must be positive.")
+        if options['resume'] and not options['checkpoint']:
+            raise CommandError("--resume needs --checkpoint.")
+        if options['resume'] and options['output'] == '-':
+            raise CommandError("--resume needs an --output file to append to.")
+
+        skip, offset = read_checkpoint(options['checkpoint']) if options['resume'] else (0, 0)
+        defined_tests = tuple(settings.PROCTOR_TESTS)
+        evaluator = get_evaluator()
+
+        if skip:
+            truncate_output(options['output'], offset)
+        input_file = _open(options['input'], 'r', sys.stdin)
+        output_file = _open(options['output'], 'a' if skip else 'w', self.stdout)
+        try:
+            header = format_header(options['format'], defined_tests)
+            if header and not skip:
+                output_file.write(header)
+                offset += len(header.encode('utf-8'))
+
+            exported = skip
+            started_at = time.time()
+            next_report = exported + options['progress']
+            batches = iter_batches(iter_identifiers(input_file, skip), options['batch_size'])
+            for rows in export_batches(batches, defined_tests, options['format'],
+                                       options['workers'], evaluator):
+                data = ''.join(rows)
+                output_file.write(data)
+                output_file.flush()
+                exported += len(rows)
+                offset += len(data.encode('utf-8'))
+                if options['checkpoint']:
+                    write_checkpoint(options['checkpoint'], exported, offset)
+                if options['progress'] and exported >= next_report:
+                    self._report(exported - skip, started_at)
+                    next_report = exported + options['progress']
+            if options['progress']:
+                self._report(exported - skip, started_at)
+        finally:
+            if input_file is not sys.stdin:
+                input_file.close()
+            if output_file is not self.stdout:
+                output_file.close()
+
+    def _report(self, exported, started_at):
+        elapsed = max(time.time() - started_at, 1e-6)
+        self.stderr.write("Exported {0} accounts ({1:.0f}/s).".format(
+            exported, exported / elapsed))
+
+
+def get_evaluator():
+    """
+    Return a local.LocalEvaluator if PROCTOR_LOCAL_EVALUATION is True, like
+    the middleware. It's kept up to date by the matrix watcher, if enabled.
+    """
+    if not getattr(settings, 'PROCTOR_LOCAL_EVALUATION', False):
+        return None
+    evaluator = local.LocalEvaluator(
+        settings.PROCTOR_API_ROOT,
+        settings.PROCTOR_TESTS,
+        identifier_types=getattr(settings, 'PROCTOR_LOCAL_IDENTIFIER_TYPES', None),
+    )
+    matrix_watcher = watcher.get_default_watcher()
+    if matrix_watcher is not None:
+        matrix_watcher.register(evaluator)
+        matrix_watcher.ensure_running()
+    return evaluator
+
+
+def iter_identifiers(lines, skip=0):
+    """
+    Yield the non-blank, stripped lines of an iterable, after skipping the
+    first skip of them.
+    """
+    skipped = 0
+    for line in lines:
+        identifier = line.strip()
+        if not identifier:
+            continue
+        if skipped < skip:
+            skipped += 1
+            continue
+        yield identifier
+
+
+def iter_batches(iterable, batch_size):
+    """
+    Yield lists of up to batch_size items of an iterable.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def export_batches(batches, defined_tests, output_format, workers, evaluator=None):
+    """
+    Yield the list of formatted rows of each batch of account ids.
+    """
+    for accountids in batches:
+        # A new loader per batch, so that memory doesn't grow with the input.
+        account_loader = loader.AccountLoader(evaluator=evaluator, max_workers=workers)
+        procs = account_loader.load_many(accountids)
+        account_loader.resolve()
+        yield [format_row(output_format, accountid, defined_tests, proc._group_dict)
+               for accountid, proc in zip(accountids, procs)]
+
+
+def format_header(output_format, defined_tests):
+    if output_format == 'csv':
+        return _format_csv_row(('account',) + tuple(defined_tests))
+    return ''
+
+
+def format_row(output_format, accountid, defined_tests, group_dict):
+    """
+    Return the output line of an account's group_dict.
+    """
+    if output_format == 'csv':
+        return _format_csv_row([accountid] + [
+            '' if group_dict[test_name].value is None else group_dict[test_name].value
+            for test_name in defined_tests])
+    return six.text_type(json.dumps({
+        'account': accountid,
+        'groups': {test_name: group_dict[test_name]._asdict() for test_name in defined_tests},
+    }, sort_keys=True)) + '\n'
+
+
+def read_checkpoint(path):
+    """
+    Return (number of accounts already exported, size of the output file in
+    bytes after them), or (0, 0).
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    with io.open(path, encoding='utf-8') as checkpoint_file:
+        try:
+            checkpoint = json.load(checkpoint_file)
+            return int(checkpoint['exported']), int(checkpoint['offset'])
+        except (ValueError, KeyError, TypeError):
+            raise CommandError("Checkpoint file {0} is invalid.".format(path))
+
+
+def write_checkpoint(path, exported, offset):
+    # Written to a temporary file first, so that a crash never leaves a
+    # truncated checkpoint.
+    temporary_path = path + '.tmp'
+    with io.open(temporary_path, 'w', encoding='utf-8') as checkpoint_file:
+        checkpoint_file.write(six.text_type(json.dumps({'exported': exported,
+                                                        'offset': offset})))
+    os.rename(temporary_path, path)
+
+
+def truncate_output(path, offset):
+    """
+    Drop what was written to the output file after the checkpoint, like a
+    batch that was written before a crash but never checkpointed.
+    """
+    with io.open(path, 'r+b') as output_file:
+        output_file.seek(0, os.SEEK_END)
+        if output_file.tell() < offset:
+            raise CommandError("Output file {0} is shorter than its checkpoint.".format(path))
+        output_file.truncate(offset)
+
+
+def _open(path, mode, default):
+    if path == '-':
+        return default
+    return io.open(path, mode, encoding='utf-8', newline='')
+
+
+def _format_csv_row(values):
+    values = [six.text_type(value) for value in values]
+    if six.PY2:
+        # Python 2's csv module only writes byte strings.
+        output = io.BytesIO()
+        values = [value.encode('utf-8') for value in values]
+    else:
+        output = io.StringIO()
+    csv.writer(output, lineterminator=str('\n')).writerow(values)
+    row = output.getvalue()
+    return row.decode('utf-8') if six.PY2 else row
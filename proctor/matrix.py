@@ -14,7 +14,7 @@ def identify_matrix(params, cacher=None, request=None, http=None):
     request: The Django request. Only used if cacher is a cache.SessionCacher.
         (default: None)
     http: An instance of requests.Session (or equivalent), used for making
-        http requests (default: None)
+        http requests (default: None, which uses the pooled session)
 
     """
     test_dict = None
@@ -0,0 +1,242 @@
+"""
+Counters and latency histograms for the cache and the Proctor API.
+
+django-proctor reports:
+
+    proctor_cache_lookups_total{cacher, result}
+        Cache lookups. result is hit, miss, expired (the matrix version
+        expired), invalidated, stale, partial (some tests changed), or
+        rollover_keep / rollover_refresh (see cache.RolloverSmoother).
+    proctor_cache_fallbacks_total{result}
+        Lookups of expired entries after an API call failed. result is hit or
+        miss.
+    proctor_cache_seconds{cacher, operation}
+        Latency of cache lookups and writes. operation is get, set, get_many
+        or set_many.
+    proctor_api_calls_total{method, outcome}
+        Proctor API calls. outcome is success, http_error, invalid_response,
+        timeout, connection_error, error, circuit_open, or negative_cached
+        (skipped because the call failed recently, see negative.py).
+    proctor_negative_cache_entries_total{scope}
+        Failures remembered by the negative cache. scope is root or params.
+    proctor_api_seconds{method}
+        Latency of Proctor API calls, including retries.
+
+Nothing is recorded until a sink is added, so metrics cost almost nothing
+when unused. Sinks receive every measurement:
+
+    metrics.add_sink(metrics.StatsdSink(statsd_client))
+
+MemorySink aggregates measurements in the process, for tests and for the
+Prometheus text exposition view (views.private.MetricsView). Setting PROCTOR_METRICS to
+True adds the default MemorySink.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import bisect
+import collections
+import contextlib
+import threading
+import time
+
+import six
+
+# Upper bounds of histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+_sinks = []
+
+
+def add_sink(sink):
+    """
+    Send all measurements to sink from now on.
+    """
+    if sink not in _sinks:
+        _sinks.append(sink)
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def increment(name, labels, value=1):
+    """
+    Increment the counter name with the labels (a dict).
+    """
+    for sink in _sinks:
+        sink.increment(name, labels, value)
+
+
+def observe(name, labels, seconds):
+    """
+    Record a duration in the histogram name with the labels (a dict).
+    """
+    for sink in _sinks:
+        sink.observe(name, labels, seconds)
+
+
+@contextlib.contextmanager
+def timer(name, labels):
+    """
+    Observe the time spent in the with block.
+    """
+    if not _sinks:
+        yield
+        return
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        observe(name, labels, time.time() - started_at)
+
+
+class Sink(object):
+    """
+    Receives measurements. Override increment() and observe().
+    """
+
+    def increment(self, name, labels, value):
+        pass
+
+    def observe(self, name, labels, seconds):
+        pass
+
+
+class StatsdSink(Sink):
+    """
+    Send measurements to a statsd client.
+
+    client: An object with incr(stat, count) and timing(stat, milliseconds)
+        methods, like statsd.StatsClient. Label values are appended to the
+        stat name in sorted label order, like proctor_cache_lookups_total.CacheCacher.hit.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def increment(self, name, labels, value):
+        self.client.incr(self._get_stat(name, labels), value)
+
+    def observe(self, name, labels, seconds):
+        self.client.timing(self._get_stat(name, labels), seconds * 1000)
+
+    def _get_stat(self, name, labels):
+        return '.'.join([name] + [six.text_type(labels[key]) for key in sorted(labels)])
+
+
+Histogram = collections.namedtuple('Histogram', 'buckets counts count sum')
+
+
+class MemorySink(Sink):
+    """
+    Aggregate measurements in process memory.
+
+    buckets: Upper bounds of histogram buckets in seconds.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # (name, sorted label items) -> value
+        self._counters = collections.defaultdict(int)
+        # (name, sorted label items) -> [bucket counts..., count, sum]
+        self._histograms = {}
+
+    def increment(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                histogram[index] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+    def snapshot(self):
+        """
+        Return (counters, histograms). Both are dicts keyed by
+        (name, tuple of sorted label items). Histograms are Histogram tuples
+        whose counts are per bucket, not cumulative.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: Histogram(self.buckets, tuple(values[:-2]), values[-2], values[-1])
+                for key, values in six.iteritems(self._histograms)}
+        return counters, histograms
+
+    def get_counter(self, name, **labels):
+        """Return the value of one counter. For tests."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def format_prometheus(sink):
+    """
+    Return the measurements of a MemorySink in the Prometheus text
+    exposition format.
+    """
+    counters, histograms = sink.snapshot()
+    lines = []
+
+    for name in sorted(set(key[0] for key in counters)):
+        lines.append('# TYPE {0} counter'.format(name))
+        for (key_name, labels), value in sorted(six.iteritems(counters)):
+            if key_name == name:
+                lines.append('{0}{1} {2}'.format(name, _format_labels(labels), value))
+
+    for name in sorted(set(key[0] for key in histograms)):
+        lines.append('# TYPE {0} histogram'.format(name))
+        for (key_name, labels), histogram in sorted(six.iteritems(histograms)):
+            if key_name != name:
+                continue
+            cumulative = 0
+            for upper_bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append('{0}_bucket{1} {2}'.format(
+                    name, _format_labels(labels + (('le', repr(upper_bound)),)), cumulative))
+            lines.append('{0}_bucket{1} {2}'.format(
+                name, _format_labels(labels + (('le', '+Inf'),)), histogram.count))
+            lines.append('{0}_count{1} {2}'.format(name, _format_labels(labels), histogram.count))
+            lines.append('{0}_sum{1} {2!r}'.format(name, _format_labels(labels), histogram.sum))
+
+    return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(key, six.text_type(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in labels) + '}'
+
+
+_default_memory_sink = MemorySink()
+
+
+def get_memory_sink():
+    """
+    Return the process-wide MemorySink, which is added by enable().
+    """
+    return _default_memory_sink
+
+
+def enable():
+    """
+    Add the process-wide MemorySink, which the Prometheus view exposes.
+    """
+    add_sink(_default_memory_sink)
@@ -6,9 +6,18 @@ from django.core.exceptions import ImproperlyConfigured
 from django.utils.deprecation import MiddlewareMixin
 
 from . import api
+from . import breaker
 from . import cache
 from . import identify
 from . import constants
+from . import decorators
+from . import groups
+from . import lazy
+from . import local
+from . import metrics
+from . import negative
+from . import session
+from . import watcher
 
 
 class BaseProctorMiddleware(MiddlewareMixin):
@@ -22,11 +31,28 @@ class BaseProctorMiddleware(MiddlewareMixin):
     See the README or groups.py for details on the 'proc' object.
 
     Detects 'prforceGroups' in the request and sets cookies appropriately.
+
+    Supports both WSGI and ASGI. When Django runs the middleware
+    asynchronously, the Proctor API call is awaited instead of blocking a
+    thread (see aio.py).
     """
+    sync_capable = True
+    async_capable = True
 
     def __init__(self, get_response=None):
         super(BaseProctorMiddleware, self).__init__(get_response)
         self.cacher = self.get_cacher()
+        self.evaluator = self.get_evaluator()
+        self._configure_session()
+        self._configure_breaker()
+        self._configure_negative_cache()
+        if getattr(settings, 'PROCTOR_METRICS', False):
+            metrics.enable()
+        self.watcher = self.get_watcher()
+        if self.watcher is not None:
+            self.watcher.register(self.cacher)
+            self.watcher.register(self.evaluator)
+            self.watcher.ensure_running()
 
         if isinstance(settings.PROCTOR_TESTS, six.string_types):
             # User accidentally defined a string instead of tuple in settings.
@@ -39,13 +65,81 @@ class BaseProctorMiddleware(MiddlewareMixin):
                 "PROCTOR_TESTS = ('mytest',)"
             )
 
+    def __acall__(self, request):
+        """
+        Handle a request when the middleware chain is async. Django 3.1+ calls
+        this instead of __call__() when get_response is a coroutine.
+        """
+        from . import aio
+        return aio.middleware_call(self, request)
+
     def process_request(self, request):
         """
-        Call the Proctor API and obtain all test group assignments.
+        Prepare request.proc for the request's test group assignments.
+
+        Groups are identified in process_view(), once the view and the tests
+        it declares (see decorators.py) are known. Until then, request.proc
+        is lazy and identifies all tests if it's used, like by other
+        middleware or by an error page of a request that never reaches a view.
+        """
+        if self.watcher is not None:
+            # Restarts the polling thread in forked workers.
+            self.watcher.ensure_running()
+
+        params = self.get_params(request)
+
+        request.proc = identify.identify_groups(
+            params, cacher=self.cacher, request=request, lazy=True, http=self.get_http(),
+            evaluator=self.evaluator)
+
+        return None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """
+        Call the Proctor API and obtain the test group assignments the view
+        uses: the tests it declares, or all of PROCTOR_TESTS.
 
         Group assignments are placed into request.proc for other Django apps.
         """
-        params = api.ProctorParameters(
+        proc = getattr(request, 'proc', None)
+        if not isinstance(proc, lazy.LazyProctorGroups) or proc.loaded:
+            # Identified already, by async middleware or on first access.
+            return None
+
+        params = self.get_view_params(proc._params, view_func)
+        if params is None:
+            request.proc = groups.ProctorGroups({})
+            return None
+
+        request.proc = identify.identify_groups(
+            params, cacher=self.cacher, request=request, lazy=self.is_lazy(), http=proc._http,
+            evaluator=self.evaluator, prefetch=self.is_prefetch(),
+            prefetch_timeout_seconds=getattr(settings, 'PROCTOR_PREFETCH_TIMEOUT', None))
+
+        return None
+
+    def get_view_params(self, params, view_func):
+        """
+        Return the api.ProctorParameters to identify for a view: params with
+        only the tests the view declares (see decorators.py), or params if it
+        declares none. Return None if it declares no tests in params.
+        """
+        view_tests = decorators.get_view_tests(view_func)
+        if view_tests is None or (self.cacher and self.cacher.request_scoped):
+            # Session and cookie cachers hold a single entry for all views.
+            return params
+        view_tests = frozenset(view_tests)
+        defined_tests = tuple(test_name for test_name in params.defined_tests
+                              if test_name in view_tests)
+        if not defined_tests:
+            return None
+        return params.with_tests(defined_tests)
+
+    def get_params(self, request):
+        """
+        Return the api.ProctorParameters for a given request.
+        """
+        return api.ProctorParameters(
             api_root=settings.PROCTOR_API_ROOT,
             defined_tests=settings.PROCTOR_TESTS,
             context_dict=self.get_context(request),
@@ -53,13 +147,11 @@ class BaseProctorMiddleware(MiddlewareMixin):
             force_groups=self._get_force_groups(request),
         )
 
-        request.proc = identify.identify_groups(
-            params, cacher=self.cacher, request=request, lazy=self.is_lazy(), http=self.get_http())
-
-        return None
-
     def process_response(self, request, response):
-        """Add prforceGroups cookie if necessary."""
+        """Add prforceGroups and cache cookies if necessary."""
+        if self.cacher is not None:
+            self.cacher.update_response(request, response)
+
         # Only necessary if user has new prforceGroups for us.
         if self.is_privileged(request) and constants.PROP_NAME_FORCE_GROUPS in request.GET:
             # Cookie lasts until end of browser session.
@@ -111,32 +203,144 @@ class BaseProctorMiddleware(MiddlewareMixin):
         """
         cache_method = getattr(settings, 'PROCTOR_CACHE_METHOD', None)
 
+        rollover_seconds = getattr(settings, 'PROCTOR_CACHE_ROLLOVER_SECONDS', None)
+        max_refreshes = getattr(settings, 'PROCTOR_CACHE_MAX_REFRESHES', None)
+
         if cache_method is None:
             return None
         elif cache_method == 'session':
-            return cache.SessionCacher()
+            return cache.SessionCacher(rollover_seconds=rollover_seconds,
+                                       max_refreshes=max_refreshes)
+        elif cache_method == 'cookie':
+            return cache.CookieCacher(
+                getattr(settings, 'PROCTOR_CACHE_COOKIE_NAME', None),
+                max_age_seconds=getattr(settings, 'PROCTOR_CACHE_COOKIE_AGE', None),
+                compress=getattr(settings, 'PROCTOR_CACHE_COOKIE_COMPRESS', True),
+                rollover_seconds=rollover_seconds,
+                max_refreshes=max_refreshes,
+                secure=getattr(settings, 'PROCTOR_CACHE_COOKIE_SECURE',
+                               settings.SESSION_COOKIE_SECURE),
+                samesite=getattr(settings, 'PROCTOR_CACHE_COOKIE_SAMESITE',
+                                 getattr(settings, 'SESSION_COOKIE_SAMESITE', None)),
+            )
         elif cache_method == 'cache':
             cache_name = getattr(settings, 'PROCTOR_CACHE_NAME', None)
-            return cache.CacheCacher(cache_name)
+            return cache.CacheCacher(
+                cache_name,
+                stale_seconds=getattr(settings, 'PROCTOR_CACHE_STALE_SECONDS', None),
+                rollover_seconds=rollover_seconds,
+                max_refreshes=max_refreshes,
+            )
+        elif cache_method == 'tiered':
+            return cache.TieredCacher(
+                getattr(settings, 'PROCTOR_CACHE_NAME', None),
+                local_max_entries=getattr(settings, 'PROCTOR_LOCAL_CACHE_SIZE', None),
+                local_timeout_seconds=getattr(settings, 'PROCTOR_LOCAL_CACHE_TIMEOUT', None),
+                stale_seconds=getattr(settings, 'PROCTOR_CACHE_STALE_SECONDS', None),
+                rollover_seconds=rollover_seconds,
+                max_refreshes=max_refreshes,
+            )
+        elif cache_method == 'shared_memory':
+            return cache.SharedMemoryCacher(
+                getattr(settings, 'PROCTOR_SHARED_MEMORY_PATH', None),
+                slot_count=getattr(settings, 'PROCTOR_SHARED_MEMORY_SLOTS', None),
+                slot_size=getattr(settings, 'PROCTOR_SHARED_MEMORY_SLOT_SIZE', None),
+                stale_seconds=getattr(settings, 'PROCTOR_CACHE_STALE_SECONDS', None),
+                rollover_seconds=rollover_seconds,
+                max_refreshes=max_refreshes,
+            )
         else:
             raise ImproperlyConfigured(
                 "{0} is an unrecognized PROCTOR_CACHE_METHOD.".format(
                     cache_method))
 
+    def get_evaluator(self):
+        """
+        Create a local.LocalEvaluator if the PROCTOR_LOCAL_EVALUATION Django
+        setting is True.
+
+        Return None to always call the Proctor API for group assignments.
+        """
+        if not getattr(settings, 'PROCTOR_LOCAL_EVALUATION', False):
+            return None
+
+        return local.LocalEvaluator(
+            settings.PROCTOR_API_ROOT,
+            settings.PROCTOR_TESTS,
+            identifier_types=getattr(settings, 'PROCTOR_LOCAL_IDENTIFIER_TYPES', None),
+        )
+
+    def get_watcher(self):
+        """
+        Return the watcher.MatrixWatcher that keeps the cacher's matrix
+        version fresh, if the PROCTOR_WATCH_MATRIX Django setting is True.
+
+        Return None to learn the matrix version from API responses only.
+        """
+        return watcher.get_default_watcher()
+
     def is_lazy(self):
         return getattr(settings, 'PROCTOR_LAZY', False)
 
+    def is_prefetch(self):
+        return getattr(settings, 'PROCTOR_PREFETCH', False)
+
     def get_http(self):
         """
         Return an instance of requests.Session (or equivalent) that will be
         used to make HTTP requests to the proctor API.
 
-        Return None to not use a session (e.g. requests.get).
+        Return None to use the process-wide pooled session. Its pool size and
+        idle timeout are set with the PROCTOR_HTTP_POOL_SIZE and
+        PROCTOR_HTTP_IDLE_TIMEOUT Django settings.
 
         This method is called every time process_request is called.
         """
         return None
 
+    def get_async_http(self):
+        """
+        Return an instance of httpx.AsyncClient (or equivalent) that will be
+        used to make HTTP requests to the proctor API for async requests.
+
+        Return None to use the pooled client from aio.get_client().
+
+        This method is called for every async request.
+        """
+        return None
+
+    def _configure_session(self):
+        """
+        Replace the default pooled session if its Django settings are set.
+        """
+        pool_size = getattr(settings, 'PROCTOR_HTTP_POOL_SIZE', None)
+        idle_timeout_seconds = getattr(settings, 'PROCTOR_HTTP_IDLE_TIMEOUT', None)
+        if pool_size is None and idle_timeout_seconds is None:
+            return
+
+        manager = session.SessionManager(pool_size, idle_timeout_seconds)
+        current = session.get_default_manager()
+        if ((current.pool_size, current.idle_timeout_seconds) !=
+                (manager.pool_size, manager.idle_timeout_seconds)):
+            session.set_default_manager(manager)
+
+    def _configure_breaker(self):
+        """
+        Set the circuit breaker options if their Django settings are set.
+        """
+        failure_threshold = getattr(settings, 'PROCTOR_CIRCUIT_FAILURE_THRESHOLD', None)
+        reset_timeout_seconds = getattr(settings, 'PROCTOR_CIRCUIT_RESET_TIMEOUT', None)
+        if failure_threshold is not None or reset_timeout_seconds is not None:
+            breaker.configure(failure_threshold, reset_timeout_seconds)
+
+    def _configure_negative_cache(self):
+        """
+        Enable negative caching of API failures if its Django setting is set.
+        """
+        negative_cache_timeout = getattr(settings, 'PROCTOR_NEGATIVE_CACHE_TIMEOUT', None)
+        if negative_cache_timeout is not None:
+            negative.configure(negative_cache_timeout)
+
     def _get_force_groups(self, request):
         """
         Return the force groups string from the request after verifying it.
@@ -0,0 +1,108 @@
+"""
+Remember failed Proctor API calls for a short time.
+
+Without negative caching, every request for an identifier whose API call just
+failed makes the call again, with retries. During a partial outage (like one
+bad Pipet node behind a load balancer) that multiplies outbound traffic.
+
+After a failed call, the same call is skipped for timeout_seconds, and callers
+go straight to their fallback (expired cached groups or unassigned groups).
+Failures that mean the API itself is unreachable (timeouts, connection errors
+and server errors) skip every call to that API root. Other failures (like a
+client error for one set of parameters) only skip calls with the same
+parameters.
+
+Unlike the circuit breaker (breaker.py), which opens after several consecutive
+failures, one failure is enough, but only for a much shorter time.
+Disabled unless configured with a timeout.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import time
+
+from . import metrics
+
+_MAX_ENTRIES = 10000
+
+
+class NegativeCache(object):
+    """
+    Thread-safe set of recently failed calls, each expiring after
+    timeout_seconds.
+    """
+
+    def __init__(self, timeout_seconds):
+        self.timeout_seconds = timeout_seconds
+        self._lock = threading.Lock()
+        # key -> expiry time
+        self._entries = {}
+
+    def is_failing(self, params, api_method):
+        """
+        Return the scope ('root' or 'params') of a negative entry that covers
+        the call, or None if the call should be made.
+        """
+        if not self._entries:
+            return None
+        now = time.time()
+        for scope, key in self._get_keys(params, api_method):
+            expiry_time = self._entries.get(key)
+            if expiry_time is not None and now < expiry_time:
+                return scope
+        return None
+
+    def record_failure(self, params, api_method, root_wide):
+        """
+        Skip calls like this one for timeout_seconds. If root_wide is True,
+        skip all calls to params.api_root.
+        """
+        scope, key = self._get_keys(params, api_method)[0 if root_wide else 1]
+        with self._lock:
+            if len(self._entries) >= _MAX_ENTRIES:
+                self._prune()
+            self._entries[key] = time.time() + self.timeout_seconds
+        metrics.increment('proctor_negative_cache_entries_total', {'scope': scope})
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _get_keys(self, params, api_method):
+        return [('root', ('root', params.api_root)),
+                ('params', ('params', api_method, params.fingerprint))]
+
+    def _prune(self):
+        now = time.time()
+        for key, expiry_time in list(self._entries.items()):
+            if now >= expiry_time:
+                del self._entries[key]
+        if len(self._entries) >= _MAX_ENTRIES:
+            self._entries.clear()
+
+
+_negative_cache = None
+
+
+def get_negative_cache():
+    """
+    Return the process-wide NegativeCache, or None if it's disabled.
+    """
+    return _negative_cache
+
+
+def configure(timeout_seconds=None):
+    """
+    Enable negative caching with a timeout, or disable it if the timeout is
+    None or 0.
+    """
+    global _negative_cache
+    _negative_cache = NegativeCache(timeout_seconds) if timeout_seconds else None
+
+
+def reset():
+    """
+    Forget all failures.
+    """
+    if _negative_cache is not None:
+        _negative_cache.clear()
@@ -0,0 +1,171 @@
+"""
+Provide a process-wide pooled keep-alive HTTP session for Proctor API calls.
+
+Without a session, every Proctor API call made with the requests module opens
+a new TCP (and often TLS) connection. SessionManager keeps one
+requests.Session per process with a bounded connection pool, so connections to
+Pipet are reused across requests and threads.
+
+The session is recreated after a fork, because connections inherited from a
+parent process can't be shared safely. Pooled connections that have been idle
+for longer than idle_timeout_seconds are closed before the next use, since
+servers and load balancers drop idle keep-alive connections on their own.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import os
+import threading
+import time
+
+import requests
+import requests.adapters
+
+logger = logging.getLogger('application.proctor.session')
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_IDLE_TIMEOUT_SECONDS = 60
+
+
+class SessionManager(object):
+    """
+    Thread-safe and fork-safe owner of a pooled requests.Session.
+
+    pool_size: Maximum number of keep-alive connections kept per host.
+        Default: 10
+    idle_timeout_seconds: Pooled connections unused for this long are closed
+        before the next request. Default: 60 seconds
+    """
+
+    def __init__(self, pool_size=None, idle_timeout_seconds=None):
+        self.pool_size = pool_size if pool_size is not None else DEFAULT_POOL_SIZE
+        self.idle_timeout_seconds = (idle_timeout_seconds
+                                     if idle_timeout_seconds is not None
+                                     else DEFAULT_IDLE_TIMEOUT_SECONDS)
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+        self._last_used_time = 0
+        # Counters from pools that were already reaped.
+        self._reaped_connections = 0
+        self._reaped_requests = 0
+
+    def get_session(self):
+        """
+        Return the requests.Session to use for the current process.
+        """
+        now = time.time()
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                self._session = self._create_session()
+                self._pid = os.getpid()
+            elif now - self._last_used_time > self.idle_timeout_seconds:
+                self._reap_idle_connections()
+            self._last_used_time = now
+            return self._session
+
+    def close(self):
+        """
+        Close the session and all of its pooled connections.
+        """
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._reap_idle_connections()
+                self._session.close()
+            self._session = None
+
+    def stats(self):
+        """
+        Return connection reuse counters for the current process as a dict.
+
+        connections: Number of TCP connections opened.
+        requests: Number of HTTP requests sent.
+        reused: Number of requests sent over an already-open connection.
+        """
+        with self._lock:
+            connections = self._reaped_connections
+            requests_sent = self._reaped_requests
+            for pool in self._get_pools():
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+
+        return {
+            'connections': connections,
+            'requests': requests_sent,
+            'reused': max(requests_sent - connections, 0),
+        }
+
+    def _create_session(self):
+        if self._session is not None:
+            # Inherited from the parent process. Don't close its sockets.
+            logger.debug("Proctor HTTP session recreated after fork.")
+        self._reaped_connections = 0
+        self._reaped_requests = 0
+
+        session = requests.Session()
+        # Retries are handled by api.call_proctor.
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _get_pools(self):
+        if self._session is None or self._pid != os.getpid():
+            return []
+
+        pools = []
+        for adapter in set(self._session.adapters.values()):
+            pool_manager = getattr(adapter, 'poolmanager', None)
+            if pool_manager is None:
+                continue
+            for key in list(pool_manager.pools.keys()):
+                pool = pool_manager.pools.get(key)
+                if pool is not None:
+                    pools.append(pool)
+        return pools
+
+    def _reap_idle_connections(self):
+        for pool in self._get_pools():
+            self._reaped_connections += pool.num_connections
+            self._reaped_requests += pool.num_requests
+        for adapter in set(self._session.adapters.values()):
+            pool_manager = getattr(adapter, 'poolmanager', None)
+            if pool_manager is not None:
+                pool_manager.clear()
+        logger.debug("Proctor HTTP session closed idle connections.")
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def get_default_manager():
+    """
+    Return the process-wide SessionManager, creating it if necessary.
+    """
+    global _default_manager
+    if _default_manager is None:
+        with _default_manager_lock:
+            if _default_manager is None:
+                _default_manager = SessionManager()
+    return _default_manager
+
+
+def set_default_manager(manager):
+    """
+    Replace the process-wide SessionManager, like with a configured one.
+    """
+    global _default_manager
+    with _default_manager_lock:
+        previous, _default_manager = _default_manager, manager
+    if previous is not None and previous is not manager:
+        previous.close()
+
+
+def get_session():
+    """
+    Return the process-wide pooled requests.Session.
+    """
+    return get_default_manager().get_session()
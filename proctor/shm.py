@@ -0,0 +1,286 @@
+"""
+A fixed-size table in a memory-mapped file, shared by processes on a host.
+
+Used by cache.SharedMemoryCacher, so that every worker process on a host sees
+the same matrix version and cached assignments without a cache server.
+
+The file holds a header, one record for the matrix version, and slot_count
+slots of slot_size bytes. Keys are params fingerprints (20 hex characters)
+and each key maps to exactly one slot, so a newer entry simply replaces
+whatever was in its slot. Values are JSON.
+
+A file is never shrunk while other processes may have it mapped, since they
+would crash reading past its new end. If an existing file has a different
+layout (like after slot settings changed), a new file is created next to it
+and renamed over it. Processes that mapped the old file keep using it until
+they restart.
+
+Every record starts with a sequence number (a "seqlock"). Writers take an
+exclusive lock on the file, make the sequence number odd, write, and make it
+even again. Readers never lock: they read the sequence number, the record and
+the sequence number again, and retry if a write was in progress or happened
+in between.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger('application.proctor.shm')
+
+DEFAULT_SLOT_COUNT = 4096
+DEFAULT_SLOT_SIZE = 2048
+
+_MAGIC = b'PROCSHM1'
+# magic, slot count, slot size
+_HEADER = struct.Struct(str('=8sII'))
+_SEQ = struct.Struct(str('=Q'))
+# seq, expiry time, length
+_VERSION = struct.Struct(str('=QdH'))
+_VERSION_OFFSET = 64
+_VERSION_MAX_LENGTH = 128
+# seq, key, length
+_SLOT = struct.Struct(str('=Q20sI'))
+_SLOTS_OFFSET = 256
+
+_READ_ATTEMPTS = 5
+_OPEN_ATTEMPTS = 5
+
+# Don't follow a symlink planted at the path, like in a shared temp directory.
+_O_NOFOLLOW = getattr(os, 'O_NOFOLLOW', 0)
+
+
+def get_default_path(api_root, slot_count=None, slot_size=None):
+    """
+    Return a path in the temporary directory for a table of an API root.
+
+    The path is different for every user and layout, so processes of other
+    users or with other slot settings never open the same file. Apps of the
+    same user and API root share it, which is safe since entries are keyed
+    by the full params fingerprint.
+    """
+    layout = '{0}\n{1}\n{2}'.format(
+        api_root, slot_count or DEFAULT_SLOT_COUNT, slot_size or DEFAULT_SLOT_SIZE)
+    digest = hashlib.sha1(layout.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(),
+                        'django-proctor-{0}-{1}.shm'.format(os.geteuid(), digest))
+
+
+class SharedTable(object):
+    """
+    Memory-mapped table of JSON values and a matrix version.
+
+    path: The file to map. It's created if needed. Every process sharing a
+        file must use the same slot_count and slot_size.
+    slot_count: Number of slots. Default: 4096
+    slot_size: Size of a slot in bytes. Values that don't fit aren't stored.
+        Default: 2048
+    """
+
+    def __init__(self, path, slot_count=None, slot_size=None):
+        self.path = path
+        self.slot_count = slot_count or DEFAULT_SLOT_COUNT
+        self.slot_size = slot_size or DEFAULT_SLOT_SIZE
+        self.size = _SLOTS_OFFSET + self.slot_count * self.slot_size
+
+        # File locks don't exclude threads of the same process.
+        self._thread_lock = threading.Lock()
+        self._fd = self._open()
+        self._mmap = mmap.mmap(self._fd, self.size)
+
+    def get(self, key):
+        """
+        Return the value stored for key, or None.
+        """
+        offset = self._get_slot_offset(key)
+        raw_key = key.encode('ascii')
+
+        def read():
+            _, slot_key, length = _SLOT.unpack_from(self._mmap, offset)
+            if slot_key != raw_key:
+                return None
+            start = offset + _SLOT.size
+            return self._mmap[start:start + length]
+
+        data = self._read(offset, read)
+        return json.loads(data.decode('utf-8')) if data else None
+
+    def set(self, key, value):
+        """
+        Store value for key, replacing whatever was in its slot.
+
+        Return False if the value is too large for a slot.
+        """
+        data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        if _SLOT.size + len(data) > self.slot_size:
+            logger.debug("Proctor shared memory value for %s is too large (%d bytes).",
+                         key, len(data))
+            return False
+
+        offset = self._get_slot_offset(key)
+        with self._writing(offset) as seq:
+            _SLOT.pack_into(self._mmap, offset, seq, key.encode('ascii'), len(data))
+            start = offset + _SLOT.size
+            self._mmap[start:start + len(data)] = data
+        return True
+
+    def delete(self, key):
+        offset = self._get_slot_offset(key)
+        with self._writing(offset) as seq:
+            _, slot_key, _ = _SLOT.unpack_from(self._mmap, offset)
+            if slot_key == key.encode('ascii'):
+                _SLOT.pack_into(self._mmap, offset, seq, b'', 0)
+
+    def get_version(self):
+        """
+        Return the stored matrix version, or None if it expired.
+        """
+        def read():
+            _, expiry_time, length = _VERSION.unpack_from(self._mmap, _VERSION_OFFSET)
+            start = _VERSION_OFFSET + _VERSION.size
+            return expiry_time, self._mmap[start:start + length]
+
+        record = self._read(_VERSION_OFFSET, read)
+        if record is None:
+            return None
+        expiry_time, data = record
+        if not data or time.time() >= expiry_time:
+            return None
+        return json.loads(data.decode('utf-8'))
+
+    def set_version(self, version, expiry_time):
+        data = json.dumps(version).encode('utf-8')
+        if len(data) > _VERSION_MAX_LENGTH:
+            logger.warning("Proctor matrix version %r is too long for shared memory.", version)
+            return
+        with self._writing(_VERSION_OFFSET) as seq:
+            _VERSION.pack_into(self._mmap, _VERSION_OFFSET, seq, expiry_time, len(data))
+            start = _VERSION_OFFSET + _VERSION.size
+            self._mmap[start:start + len(data)] = data
+
+    def close(self):
+        self._mmap.close()
+        os.close(self._fd)
+
+    def _get_slot_offset(self, key):
+        return _SLOTS_OFFSET + (int(key[:8], 16) % self.slot_count) * self.slot_size
+
+    def _read(self, offset, read):
+        """
+        Return read() of a consistent record, or None if writers kept
+        changing it.
+        """
+        for _ in range(_READ_ATTEMPTS):
+            seq = _SEQ.unpack_from(self._mmap, offset)[0]
+            if seq % 2:
+                continue
+            value = read()
+            if _SEQ.unpack_from(self._mmap, offset)[0] == seq:
+                return value
+        return None
+
+    @contextlib.contextmanager
+    def _writing(self, offset):
+        """
+        Lock the table for writing the record at offset. Yield the sequence
+        number to write in the record, which marks it as being written.
+        """
+        with self._file_lock():
+            seq = _SEQ.unpack_from(self._mmap, offset)[0] + 1
+            _SEQ.pack_into(self._mmap, offset, seq)
+            try:
+                yield seq
+            finally:
+                _SEQ.pack_into(self._mmap, offset, seq + 1)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        with self._thread_lock:
+            # POSIX record locks belong to the process, unlike flock() locks,
+            # which forked workers would share through the inherited descriptor.
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _open(self):
+        """
+        Open the file with this table's layout, creating or replacing it if
+        needed, and return its descriptor.
+        """
+        for _ in range(_OPEN_ATTEMPTS):
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | _O_NOFOLLOW, 0o600)
+            initialized = False
+            try:
+                with self._file_lock():
+                    initialized = self._initialize()
+            finally:
+                if not initialized:
+                    os.close(self._fd)
+            if initialized:
+                return self._fd
+        raise IOError("Proctor shared memory file {0} kept being replaced.".format(self.path))
+
+    def _initialize(self):
+        """
+        Give the locked file this table's layout, unless another process
+        already did. Return False if the file at the path was replaced, so
+        that it must be opened again.
+        """
+        stat = os.fstat(self._fd)
+        if stat.st_uid != os.geteuid():
+            raise ImproperlyConfigured(
+                "Proctor shared memory file {0} belongs to another user.".format(self.path))
+        try:
+            path_stat = os.stat(self.path)
+        except OSError:
+            # Renamed or deleted while we waited for the lock.
+            return False
+        if (path_stat.st_dev, path_stat.st_ino) != (stat.st_dev, stat.st_ino):
+            return False
+
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        header = os.read(self._fd, _HEADER.size)
+        expected = _HEADER.pack(_MAGIC, self.slot_count, self.slot_size)
+        if header == expected and stat.st_size == self.size:
+            return True
+
+        if stat.st_size == 0:
+            # New file, which nobody has mapped yet.
+            os.ftruncate(self._fd, self.size)
+            os.write(self._fd, expected)
+            return True
+
+        logger.warning("Proctor shared memory file %s has a different layout. Replacing it.",
+                       self.path)
+        self._replace(expected)
+        return False
+
+    def _replace(self, header):
+        """
+        Atomically replace the file with a new one with this table's layout.
+        """
+        fd, temporary_path = tempfile.mkstemp(
+            prefix='.django-proctor-', dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            try:
+                os.ftruncate(fd, self.size)
+                os.write(fd, header)
+            finally:
+                os.close(fd)
+            os.rename(temporary_path, self.path)
+        except Exception:
+            os.unlink(temporary_path)
+            raise
@@ -0,0 +1,67 @@
+"""
+Coalesce concurrent identical calls into one.
+
+A burst of requests from one visitor (a page plus its XHRs, or prefetches) can
+miss the cache at the same moment, because the first API response hasn't been
+stored yet. With SingleFlight, the first caller for a key makes the call and
+concurrent callers with the same key wait for it and share its result.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import sys
+import threading
+
+import six
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+        # Number of callers that waited on this call instead of making it.
+        self.dups = 0
+
+
+class SingleFlight(object):
+    """
+    Thread-safe group of in-flight calls, keyed by strings.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Call fn(*args, **kwargs) unless a call with the same key is in flight.
+
+        Return (result, shared). shared is True if the result came from
+        another caller's call. Exceptions raised by fn are raised to every
+        caller waiting on it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.dups += 1
+
+        if not leader:
+            call.done.wait()
+            if call.exc_info is not None:
+                six.reraise(*call.exc_info)
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
@@ -0,0 +1,27 @@
+from __future__ import absolute_import, unicode_literals
+
+import sys
+
+import pytest
+
+from proctor import breaker
+from proctor import negative
+
+# asyncio tests use Python 3 syntax, asyncio.run() (3.7) and AsyncMock (3.8).
+collect_ignore = ['test_aio.py'] if sys.version_info < (3, 8) else []
+
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breakers():
+    """Don't let API failures in one test open the circuit for the next."""
+    breaker.reset()
+    yield
+    breaker.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_negative_cache():
+    """Don't let API failures in one test skip calls in the next."""
+    negative.reset()
+    yield
+    negative.reset()
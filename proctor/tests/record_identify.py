@@ -0,0 +1,114 @@
+r"""
+Record /groups/identify responses from a live Pipet for the local evaluation
+parity tests in test_local.py.
+
+    DJANGO_SETTINGS_MODULE=proctor.tests.settings python -m proctor.tests.record_identify \
+        --api-root http://pipet.example.com --tests buttoncolortst,sharedsalttst \
+        --identifier tk=USER --identifier acctid=ACCOUNT --force-groups buttoncolortst0 \
+        > proctor/tests/recorded_identify.json
+
+Pick tests whose allocations split identifiers between buckets with uneven
+ranges, and at least two that share a '&' salt, so that the recordings check
+identifier hashing and bucket choice. Pass --force-groups (like
+buttoncolortst0) to also record forced assignments. Tests with rules that
+depend on context variables can't be evaluated locally and are rejected.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import json
+import sys
+import uuid
+
+from proctor import api
+from proctor import local
+
+TIMEOUT_SECONDS = 5
+DEADLINE_SECONDS = 30
+FORCED_COUNT = 10
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--api-root', required=True)
+    parser.add_argument('--tests', required=True, help="Comma-separated test names.")
+    parser.add_argument('--identifier', action='append', required=True,
+                        help="Identifier source key and its test type, like tk=USER.")
+    parser.add_argument('--count', type=int, default=200,
+                        help="Number of random identifiers to record.")
+    parser.add_argument('--force-groups', action='append', default=[],
+                        help="A prforceGroups value to also record for the first "
+                             "FORCED_COUNT identifiers.")
+    args = parser.parse_args(argv)
+
+    defined_tests = args.tests.split(',')
+    identifier_types = dict(identifier.split('=', 1) for identifier in args.identifier)
+
+    matrix_response = api.call_proctor_matrix(
+        _params(args.api_root, defined_tests, {}), timeout=TIMEOUT_SECONDS,
+        deadline_seconds=DEADLINE_SECONDS)
+    if matrix_response is None:
+        sys.exit("Could not download the test matrix.")
+    check_tests(matrix_response, defined_tests)
+
+    recordings = []
+    for index in range(args.count):
+        identifier_dict = {key: uuid.uuid4().hex for key in identifier_types}
+        forced = args.force_groups if index < FORCED_COUNT else []
+        for force_groups in [None] + forced:
+            recordings.append(record(args.api_root, defined_tests, identifier_dict,
+                                     force_groups, matrix_response))
+
+    json.dump({
+        'matrix': matrix_response,
+        'defined_tests': defined_tests,
+        'identifier_types': identifier_types,
+        'identify': recordings,
+    }, sys.stdout, indent=2, sort_keys=True)
+
+
+def record(api_root, defined_tests, identifier_dict, force_groups, matrix_response):
+    params = _params(api_root, defined_tests, identifier_dict)
+    params.force_groups = force_groups
+    api_response = api.call_proctor_identify(params, timeout=TIMEOUT_SECONDS,
+                                             deadline_seconds=DEADLINE_SECONDS)
+    if api_response is None:
+        sys.exit("Could not identify {0}.".format(identifier_dict))
+    if api_response['data']['audit']['version'] != matrix_response['audit']['version']:
+        sys.exit("The test matrix changed while recording. Record again.")
+    return {
+        'identifier_dict': identifier_dict,
+        'force_groups': force_groups,
+        'groups': api_response['data']['groups'],
+    }
+
+
+def check_tests(matrix_response, defined_tests):
+    """
+    Exit if a test is missing from the matrix or can't be evaluated locally.
+    """
+    for test_name in defined_tests:
+        test_definition = matrix_response['tests'].get(test_name)
+        if not test_definition:
+            sys.exit("{0} isn't in the test matrix.".format(test_name))
+        rules = [test_definition.get('rule')] + [
+            allocation.get('rule') for allocation in test_definition.get('allocations', [])]
+        try:
+            for rule in rules:
+                local._rule_matches(rule)
+        except local.UnsupportedRule as e:
+            sys.exit("{0} has a rule that depends on context: {1}".format(test_name, e))
+
+
+def _params(api_root, defined_tests, identifier_dict):
+    return api.ProctorParameters(
+        api_root=api_root,
+        defined_tests=defined_tests,
+        context_dict={},
+        identifier_dict=identifier_dict,
+        force_groups=None,
+    )
+
+
+if __name__ == '__main__':
+    main()
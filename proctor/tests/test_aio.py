@@ -0,0 +1,143 @@
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+
+import mock
+from django.conf.urls import url
+
+from proctor import aio
+from proctor import cache
+from proctor.decorators import proctor_tests
+from proctor.lazy import LazyProctorGroups
+from proctor.tests.test_middleware import ProctorMiddleware
+from proctor.tests.utils import create_proctor_parameters
+
+
+@proctor_tests('othertst')
+def scoped_view(request):
+    pass
+
+
+# This module is the urlconf of the requests in TestAsyncMiddleware.
+urlpatterns = [url(r'^scoped/$', scoped_view)]
+
+
+def mock_async_http_get_data(group_data=None, status_code=200):
+    mock_response = mock.Mock(status_code=status_code)
+    mock_response.json.return_value = {
+        'data': {
+            'groups': group_data,
+            'audit': {'version': "1"},
+        },
+    }
+
+    mock_http = mock.Mock()
+    mock_http.get = mock.AsyncMock(return_value=mock_response)
+    return mock_http
+
+
+class TestAsyncIdentifyGroups:
+
+    def test_requested_group_resolved(self):
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['fake_proctor_test'])
+        mock_http = mock_async_http_get_data({'fake_proctor_test': {'name': 'active', 'value': 1}})
+
+        groups = asyncio.run(aio.identify_groups(params, http=mock_http))
+
+        mock_http.get.assert_awaited_once_with(
+            'fake-proctor-api-url/groups/identify',
+            params={'id.account': 1234, 'ctx.ua': '', 'test': 'fake_proctor_test'},
+            timeout=mock.ANY,
+        )
+        assert groups.fake_proctor_test.group == 'active'
+
+    def test_cached_result_used(self):
+        params = create_proctor_parameters({'account': 5678}, defined_tests=['fake_proctor_test'])
+        mock_http = mock_async_http_get_data({'fake_proctor_test': {'name': 'active', 'value': 1}})
+        cacher = cache.CacheCacher()
+
+        async def identify_twice():
+            await aio.identify_groups(params, cacher=cacher, http=mock_http)
+            return await aio.identify_groups(params, cacher=cacher, http=mock_http)
+
+        groups = asyncio.run(identify_twice())
+
+        mock_http.get.assert_awaited_once()
+        assert groups.fake_proctor_test.value == 1
+
+    def test_api_error_falls_back_to_unassigned(self):
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['fake_proctor_test'])
+        mock_http = mock.Mock()
+        mock_http.get = mock.AsyncMock(side_effect=asyncio.TimeoutError())
+
+        groups = asyncio.run(aio.identify_groups(params, http=mock_http))
+
+        assert groups.fake_proctor_test.group is None
+
+    def test_lazy_groups_awaitable(self):
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['fake_proctor_test'])
+        proc = LazyProctorGroups(params)
+        api_response = {'data': {'groups': {'fake_proctor_test': {'name': 'active', 'value': 1}},
+                                 'audit': {'version': "1"}}}
+
+        with mock.patch.object(aio, 'call_proctor_identify',
+                               mock.AsyncMock(return_value=api_response)):
+            asyncio.run(proc.aload())
+
+        assert proc.loaded
+        assert proc.fake_proctor_test.group == 'active'
+
+    def test_local_evaluation_without_thread(self):
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['fake_proctor_test'])
+        api_response = {'data': {'groups': {}, 'audit': {'version': "1"}}}
+        evaluator = mock.Mock()
+        evaluator.identify.return_value = api_response
+
+        with mock.patch.object(aio, 'sync_to_async') as mock_sync_to_async:
+            evaluator.needs_download.return_value = False
+            assert asyncio.run(aio._identify(params, evaluator=evaluator)) is api_response
+            mock_sync_to_async.assert_not_called()
+
+            evaluator.needs_download.return_value = True
+            mock_sync_to_async.return_value = mock.AsyncMock(return_value=api_response)
+            assert asyncio.run(aio._identify(params, evaluator=evaluator)) is api_response
+            mock_sync_to_async.assert_called_once_with(evaluator.identify, thread_sensitive=False)
+
+
+class TestAsyncMiddleware:
+
+    def test_proc_added_to_request(self):
+        response = mock.Mock()
+        get_response = mock.AsyncMock(return_value=response)
+        middleware = ProctorMiddleware(get_response)
+        request = mock.Mock(GET={}, COOKIES={}, path_info='/', urlconf=__name__)
+
+        with mock.patch.object(aio, 'call_proctor_identify',
+                               mock.AsyncMock(return_value=None)) as mock_call:
+            result = asyncio.run(middleware.__acall__(request))
+
+        assert result is response
+        mock_call.assert_awaited_once()
+        assert request.proc.fake_proctor_test_in_settings.group is None
+
+    def test_declared_view_tests_identified(self):
+        get_response = mock.AsyncMock(return_value=mock.Mock())
+        middleware = ProctorMiddleware(get_response)
+        request = mock.Mock(GET={}, COOKIES={}, path_info='/scoped/', urlconf=__name__)
+
+        with mock.patch.object(aio, 'call_proctor_identify') as mock_call:
+            asyncio.run(middleware.__acall__(request))
+
+        mock_call.assert_not_called()
+        assert str(request.proc) == ''
+
+    def test_resolve_view(self):
+        request = mock.Mock(path_info='/scoped/', urlconf=__name__)
+        assert aio.resolve_view(request) is scoped_view
+
+        request.path_info = '/unknown'
+        assert aio.resolve_view(request) is None
+
+    def test_declares_sync_and_async(self):
+        assert ProctorMiddleware.sync_capable
+        assert ProctorMiddleware.async_capable
@@ -1,8 +1,9 @@
 from __future__ import absolute_import, unicode_literals
 
 import mock
+import requests
 
-from proctor import api, constants
+from proctor import api, breaker, constants
 from proctor.tests.utils import create_proctor_parameters
 
 
@@ -26,3 +27,105 @@ class TestApi:
 
             api.call_proctor(params, http=mocked_requests)
             assert mocked_requests.get.call_count == 1
+
+    def test_open_circuit_skips_request(self):
+        params = create_proctor_parameters({})
+        mock_http = mock.Mock()
+        mock_http.get.side_effect = requests.exceptions.ConnectionError()
+
+        for _ in range(constants.CIRCUIT_FAILURE_THRESHOLD):
+            assert api.call_proctor(params, http=mock_http, deadline_seconds=None) is None
+        mock_http.get.reset_mock()
+
+        assert api.call_proctor(params, http=mock_http) is None
+        mock_http.get.assert_not_called()
+
+    def test_client_error_keeps_circuit_closed(self):
+        params = create_proctor_parameters({})
+        mock_http = mock.Mock()
+        mock_http.get.return_value = mock.Mock(status_code=400)
+        mock_http.get.return_value.json.return_value = {'meta': {'error': 'bad request'}}
+
+        for _ in range(constants.CIRCUIT_FAILURE_THRESHOLD):
+            api.call_proctor(params, http=mock_http)
+
+        assert breaker.get_breaker(params.api_root).state == breaker.CLOSED
+
+    def test_deadline_shared_by_attempts(self):
+        params = create_proctor_parameters({})
+        mock_http = mock.Mock()
+        clock = [1000.0]
+
+        def slow_timeout(*args, **kwargs):
+            clock[0] += kwargs['timeout']
+            raise requests.exceptions.Timeout()
+        mock_http.get.side_effect = slow_timeout
+
+        with mock.patch('time.time', side_effect=lambda: clock[0]), \
+                mock.patch('time.sleep', side_effect=lambda seconds: None):
+            assert api.call_proctor(params, http=mock_http, timeout=0.25,
+                                    deadline_seconds=0.5) is None
+
+        # Two 0.25 s attempts use up the whole budget.
+        assert mock_http.get.call_count == 2
+        assert clock[0] - 1000.0 <= 0.5
+
+    def test_spent_deadline_is_a_timeout(self):
+        params = create_proctor_parameters({})
+        mock_http = mock.Mock()
+        clock = [1000.0]
+
+        def slow_timeout(*args, **kwargs):
+            assert kwargs['timeout'] > 0
+            clock[0] += kwargs['timeout']
+            raise requests.exceptions.Timeout()
+        mock_http.get.side_effect = slow_timeout
+
+        def oversleep(seconds):
+            clock[0] += seconds + 0.02
+
+        with mock.patch('time.time', side_effect=lambda: clock[0]), \
+                mock.patch('random.uniform', return_value=0.005), \
+                mock.patch('time.sleep', side_effect=oversleep):
+            assert api.call_proctor(params, http=mock_http, timeout=0.1,
+                                    deadline_seconds=0.115) is None
+
+        # The backoff overslept the deadline, so no attempt with a timeout of 0.
+        assert mock_http.get.call_count == 1
+        assert breaker.get_breaker(params.api_root)._failures == 1
+
+
+class TestProctorParameters:
+
+    def create_params(self, **kwargs):
+        fields = {'api_root': 'http://pipet', 'defined_tests': ('onetst', 'twotst'),
+                  'context_dict': {'ua': 'Firefox', 'country': 'US'},
+                  'identifier_dict': {'USER': 'abc123'}, 'force_groups': None}
+        fields.update(kwargs)
+        return api.ProctorParameters(**fields)
+
+    def test_equal_params_same_fingerprint(self):
+        params = self.create_params()
+        other_params = self.create_params(defined_tests=['onetst', 'twotst'],
+                                          context_dict={'country': 'US', 'ua': 'Firefox'})
+
+        assert params.fingerprint == other_params.fingerprint
+
+    def test_each_field_changes_fingerprint(self):
+        fingerprint = self.create_params().fingerprint
+        changes = [{'api_root': 'http://other'}, {'defined_tests': ['onetst']},
+                   {'context_dict': {'ua': 'Chrome'}}, {'identifier_dict': {'USER': 'xyz'}},
+                   {'force_groups': 'onetst1'}]
+
+        for change in changes:
+            assert self.create_params(**change).fingerprint != fingerprint
+
+    def test_fingerprint_memoized_until_field_set(self):
+        params = self.create_params()
+        with mock.patch('hashlib.sha1', wraps=api.hashlib.sha1) as mock_sha1:
+            fingerprint = params.fingerprint
+            assert params.fingerprint == fingerprint
+            assert mock_sha1.call_count == 1
+
+        params.force_groups = 'onetst1'
+        assert params.fingerprint != fingerprint
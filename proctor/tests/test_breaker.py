@@ -0,0 +1,71 @@
+from __future__ import absolute_import, unicode_literals
+
+import mock
+
+from proctor import breaker
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_consecutive_failures(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=2, reset_timeout_seconds=30)
+
+        circuit.record_failure()
+        assert circuit.allow_request()
+        circuit.record_failure()
+
+        assert circuit.state == breaker.OPEN
+        assert not circuit.allow_request()
+
+    def test_success_resets_failures(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=2)
+
+        circuit.record_failure()
+        circuit.record_success()
+        circuit.record_failure()
+
+        assert circuit.state == breaker.CLOSED
+
+    def test_half_open_allows_one_probe(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=1, reset_timeout_seconds=30)
+        with mock.patch('time.time', return_value=1000):
+            circuit.record_failure()
+
+        with mock.patch('time.time', return_value=1031):
+            assert circuit.state == breaker.HALF_OPEN
+            assert circuit.allow_request()
+            assert not circuit.allow_request()
+
+            circuit.record_success()
+
+        assert circuit.state == breaker.CLOSED
+        assert circuit.allow_request()
+
+    def test_failed_probe_reopens(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=3, reset_timeout_seconds=30)
+        with mock.patch('time.time', return_value=1000):
+            for _ in range(3):
+                circuit.record_failure()
+
+        with mock.patch('time.time', return_value=1031):
+            assert circuit.allow_request()
+            circuit.record_failure()
+            assert not circuit.allow_request()
+
+    def test_lost_probe_expires(self):
+        circuit = breaker.CircuitBreaker(failure_threshold=1, reset_timeout_seconds=30)
+        with mock.patch('time.time', return_value=1000):
+            circuit.record_failure()
+
+        with mock.patch('time.time', return_value=1031):
+            # The probe's outcome is never reported.
+            assert circuit.allow_request()
+        with mock.patch('time.time', return_value=1060):
+            assert not circuit.allow_request()
+        with mock.patch('time.time', return_value=1061):
+            assert circuit.allow_request()
+            assert not circuit.allow_request()
+
+    def test_one_breaker_per_api_root(self):
+        assert breaker.get_breaker('http://a') is breaker.get_breaker('http://a')
+        assert breaker.get_breaker('http://a') is not breaker.get_breaker('http://b')
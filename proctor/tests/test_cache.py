@@ -0,0 +1,430 @@
+from __future__ import absolute_import, unicode_literals
+
+import json
+
+import django.core.cache
+import mock
+import pytest
+from django.http import HttpResponse
+
+from proctor import cache
+from proctor import encoding
+from proctor.groups import GroupAssignment
+from proctor.tests.utils import create_proctor_parameters
+
+
+def api_response(version='1'):
+    return {'data': {'groups': {}, 'audit': {'version': version}}}
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    django.core.cache.caches['default'].clear()
+
+
+class TestStaleWhileRevalidate:
+
+    def setup_method(self):
+        self.params = create_proctor_parameters({'account': 1234},
+                                                defined_tests=['fake_proctor_test'])
+        self.group_dict = {'fake_proctor_test': GroupAssignment('active', 1, None)}
+
+    def test_disabled_by_default(self):
+        cacher = cache.CacheCacher()
+        cacher.set(None, self.params, self.group_dict, api_response('1'))
+        cacher.update_matrix_version(api_response('2'))
+
+        assert cacher.lookup(None, self.params) == (None, False, ())
+
+    def test_previous_version_served_stale(self):
+        cacher = cache.CacheCacher(stale_seconds=60)
+        with mock.patch('time.time', return_value=1000):
+            cacher.set(None, self.params, self.group_dict, api_response('1'))
+            cacher.update_matrix_version(api_response('2'))
+
+        with mock.patch('time.time', return_value=1059):
+            assert cacher.lookup(None, self.params) == (self.group_dict, True, ())
+            assert cacher.get(None, self.params) is None
+            assert cacher.get(None, self.params, allow_expired=True) == self.group_dict
+
+        with mock.patch('time.time', return_value=1060):
+            assert cacher.lookup(None, self.params) == (None, False, ())
+
+    def test_version_changed_by_other_process(self):
+        cacher = cache.CacheCacher(stale_seconds=60)
+        cacher.set(None, self.params, self.group_dict, api_response('1'))
+        cache.CacheCacher().update_matrix_version(api_response('2'))
+
+        assert cacher.lookup(None, self.params) == (self.group_dict, True, ())
+
+    def test_expired_version_served_stale(self):
+        cacher = cache.CacheCacher(stale_seconds=60)
+        cacher.set(None, self.params, self.group_dict, api_response('1'))
+        cacher.cache.delete(cacher._get_cache_version_key())
+
+        assert cacher.lookup(None, self.params) == (self.group_dict, True, ())
+
+    def test_older_versions_not_served(self):
+        cacher = cache.CacheCacher(stale_seconds=60)
+        cacher.set(None, self.params, self.group_dict, api_response('1'))
+        cacher.update_matrix_version(api_response('2'))
+        cacher.update_matrix_version(api_response('3'))
+
+        assert cacher.lookup(None, self.params) == (None, False, ())
+
+
+class TestIncrementalInvalidation:
+
+    def setup_method(self):
+        self.params = create_proctor_parameters({'account': 1234}, defined_tests=['atst', 'btst'])
+        self.group_dict = {'atst': GroupAssignment('active', 1, None),
+                           'btst': GroupAssignment('control', 0, None)}
+
+    def _matrix_response(self, version, btst_salt='b'):
+        return {'audit': {'version': version},
+                'tests': {'atst': {'salt': 'a'}, 'btst': {'salt': btst_salt}}}
+
+    def test_unchanged_tests_stay_valid(self):
+        cacher = cache.CacheCacher()
+        cacher.publish_matrix(self._matrix_response('1'))
+        cacher.set(None, self.params, self.group_dict, api_response('1'))
+        cacher.publish_matrix(self._matrix_response('2'))
+
+        assert cacher.lookup(None, self.params) == (self.group_dict, False, ())
+
+    def test_changed_tests_listed(self):
+        cacher = cache.CacheCacher()
+        cacher.publish_matrix(self._matrix_response('1'))
+        cacher.set(None, self.params, self.group_dict, api_response('1'))
+        cacher.publish_matrix(self._matrix_response('2', btst_salt='b2'))
+
+        assert cacher.lookup(None, self.params) == (self.group_dict, False, ('btst',))
+        assert cacher.get(None, self.params) is None
+
+    def test_unknown_digests_invalidate_everything(self):
+        cacher = cache.CacheCacher()
+        cacher.set(None, self.params, self.group_dict, api_response('1'))
+        cacher.publish_matrix(self._matrix_response('2'))
+
+        assert cacher.lookup(None, self.params) == (None, False, ())
+
+    def test_changed_tests_served_stale(self):
+        cacher = cache.CacheCacher(stale_seconds=60)
+        cacher.publish_matrix(self._matrix_response('1'))
+        cacher.set(None, self.params, self.group_dict, api_response('1'))
+        cacher.publish_matrix(self._matrix_response('2', btst_salt='b2'))
+
+        assert cacher.lookup(None, self.params) == (self.group_dict, True, ('btst',))
+
+
+class TestRollover:
+
+    def setup_method(self):
+        self.params = create_proctor_parameters({'account': 1234},
+                                                defined_tests=['fake_proctor_test'])
+        self.group_dict = {'fake_proctor_test': GroupAssignment('active', 1, None)}
+        self.deadline = 100 * cache._get_key_fraction(self.params.fingerprint)
+
+    def _rolled_over_cacher(self, cacher):
+        with mock.patch('time.time', return_value=1000):
+            cacher.set(None, self.params, self.group_dict, api_response('1'))
+            cacher.update_matrix_version(api_response('2'))
+        return cacher
+
+    def test_previous_version_kept_before_deadline(self):
+        cacher = self._rolled_over_cacher(cache.CacheCacher(rollover_seconds=100))
+
+        with mock.patch('time.time', return_value=1000 + self.deadline - 1), \
+                mock.patch('random.random', return_value=0):
+            assert cacher.lookup(None, self.params) == (self.group_dict, False, ())
+
+    def test_refreshed_at_deadline(self):
+        cacher = self._rolled_over_cacher(cache.CacheCacher(rollover_seconds=100))
+
+        with mock.patch('time.time', return_value=1000 + self.deadline), \
+                mock.patch('random.random', return_value=0):
+            assert cacher.lookup(None, self.params) == (self.group_dict, True, ())
+            # Only one refresh per entry at a time.
+            assert cacher.lookup(None, self.params) == (self.group_dict, False, ())
+
+    def test_expired_after_window(self):
+        cacher = self._rolled_over_cacher(cache.CacheCacher(rollover_seconds=100))
+
+        with mock.patch('time.time', return_value=1100):
+            assert cacher.lookup(None, self.params) == (None, False, ())
+
+    def test_request_scoped_cacher_refreshes_synchronously(self):
+        request = mock.Mock(session={})
+        cacher = cache.SessionCacher(rollover_seconds=100)
+        with mock.patch('time.time', return_value=1000):
+            cacher.set(request, self.params, self.group_dict, api_response('1'))
+            cacher.update_matrix_version(api_response('2'))
+
+        with mock.patch('time.time', return_value=1000 + self.deadline), \
+                mock.patch('random.random', return_value=0):
+            assert cacher.lookup(request, self.params) == (None, False, ())
+
+
+class TestRolloverSmoother:
+
+    def test_max_refreshes(self):
+        smoother = cache.RolloverSmoother(100, max_refreshes=1)
+
+        assert smoother.adopt('00000000', 50) == smoother.REFRESH
+        assert smoother.adopt('00000001', 50) == smoother.KEEP
+        smoother.finish('00000000')
+        assert smoother.adopt('00000001', 50) == smoother.REFRESH
+
+    def test_refresh_slots_time_out(self):
+        smoother = cache.RolloverSmoother(100, max_refreshes=1)
+        with mock.patch('time.time', return_value=1000):
+            assert smoother.adopt('00000000', 50) == smoother.REFRESH
+        with mock.patch('time.time', return_value=1010):
+            assert smoother.adopt('00000001', 50) == smoother.REFRESH
+
+    def test_early_refresh_is_probabilistic(self):
+        smoother = cache.RolloverSmoother(100)
+        smoother.refresh_seconds = 1
+        # The deadline is at 50 seconds. With this draw, refresh 0.69 seconds early.
+        with mock.patch('random.random', return_value=0.5):
+            assert smoother.adopt('80000000', 49.2) == smoother.KEEP
+            assert smoother.adopt('80000000', 49.4) == smoother.REFRESH
+        # A luckier draw waits until the deadline.
+        with mock.patch('random.random', return_value=0):
+            assert smoother.adopt('80000001', 49.9) == smoother.KEEP
+
+
+class TestTieredCacher:
+
+    def setup_method(self):
+        self.params = create_proctor_parameters({'account': 1234},
+                                                defined_tests=['fake_proctor_test'])
+        self.group_dict = {'fake_proctor_test': GroupAssignment('active', 1, None)}
+
+    def test_hit_served_from_memory(self):
+        cacher = cache.TieredCacher()
+        cacher.set(None, self.params, self.group_dict, api_response())
+
+        with mock.patch.object(cacher.cache, 'get') as mock_cache_get:
+            assert cacher.get(None, self.params) == self.group_dict
+        mock_cache_get.assert_not_called()
+
+    def test_hit_from_second_tier_fills_memory(self):
+        cache.TieredCacher().set(None, self.params, self.group_dict, api_response())
+        cacher = cache.TieredCacher()
+
+        assert cacher.get(None, self.params) == self.group_dict
+        with mock.patch.object(cacher.cache, 'get') as mock_cache_get:
+            assert cacher.get(None, self.params) == self.group_dict
+        mock_cache_get.assert_not_called()
+
+    def test_new_version_invalidates_both_tiers(self):
+        cacher = cache.TieredCacher(local_timeout_seconds=10)
+        with mock.patch('time.time', return_value=1000):
+            cacher.set(None, self.params, self.group_dict, api_response('1'))
+            # Another process sees a new matrix version.
+            cache.CacheCacher().update_matrix_version(api_response('2'))
+            assert cacher.get(None, self.params) == self.group_dict
+
+        with mock.patch('time.time', return_value=1011):
+            assert cacher.get(None, self.params) is None
+        assert cacher.local_cache.get(cacher._get_cache_key(self.params)) is None
+
+    def test_old_version_keeps_newer_shared_entry(self):
+        cacher = cache.TieredCacher(local_timeout_seconds=10)
+        with mock.patch('time.time', return_value=1000):
+            cacher.update_matrix_version(api_response('1'))
+            # Another process sees a new matrix version and caches an entry.
+            cache.CacheCacher().set(None, self.params, self.group_dict, api_response('2'))
+
+            assert cacher.get(None, self.params) == self.group_dict
+            assert cacher.cache.get(cacher._get_cache_key(self.params)) is not None
+            assert cacher._get_latest_version() == '2'
+
+
+class TestCookieCacher:
+
+    def setup_method(self):
+        self.params = create_proctor_parameters({'account': 1234},
+                                                defined_tests=['fake_proctor_test'])
+        self.group_dict = {'fake_proctor_test': GroupAssignment('active', 1, None)}
+
+    def _round_trip(self, cacher):
+        request = mock.Mock(COOKIES={})
+        cacher.set(request, self.params, self.group_dict, api_response())
+        response = HttpResponse()
+        cacher.update_response(request, response)
+        return response.cookies['prcache'].value
+
+    def test_returning_visitor_hit(self):
+        cacher = cache.CookieCacher()
+        cookie = self._round_trip(cacher)
+
+        request = mock.Mock(COOKIES={'prcache': cookie})
+        assert cacher.get(request, self.params) == self.group_dict
+
+    def test_unchanged_cookie_not_sent(self):
+        cacher = cache.CookieCacher()
+        cookie = self._round_trip(cacher)
+
+        request = mock.Mock(spec=['COOKIES'], COOKIES={'prcache': cookie})
+        cacher.set(request, self.params, self.group_dict, api_response())
+        response = HttpResponse()
+        cacher.update_response(request, response)
+        assert 'prcache' not in response.cookies
+
+    def test_tampered_cookie_ignored(self):
+        cacher = cache.CookieCacher()
+        cookie = self._round_trip(cacher)
+
+        request = mock.Mock(COOKIES={'prcache': 'x' + cookie})
+        assert cacher.get(request, self.params) is None
+
+    def test_cookie_attributes(self):
+        cacher = cache.CookieCacher(secure=True, samesite='Strict')
+        request = mock.Mock(COOKIES={})
+        cacher.set(request, self.params, self.group_dict, api_response())
+        response = HttpResponse()
+        cacher.update_response(request, response)
+
+        morsel = response.cookies['prcache']
+        assert morsel['httponly']
+        assert morsel['secure']
+        assert morsel['samesite'] == 'Strict'
+
+    def test_compressed(self):
+        params = create_proctor_parameters(
+            {'account': 1234}, defined_tests=['test{0}'.format(index) for index in range(40)])
+        group_dict = {test_name: GroupAssignment('active', 1, None)
+                      for test_name in params.defined_tests}
+        entry = encoding.encode_entry(params, group_dict, '1')
+
+        compressed = encoding.sign_entry(entry, 'salt', compress=True)
+        assert len(compressed) < len(encoding.sign_entry(entry, 'salt'))
+        assert encoding.unsign_entry(compressed, 'salt') == json.loads(json.dumps(entry))
+
+    def test_invalid_entry_deleted(self):
+        cacher = cache.CookieCacher()
+        cookie = self._round_trip(cacher)
+        cacher.update_matrix_version(api_response('2'))
+
+        request = mock.Mock(COOKIES={'prcache': cookie})
+        assert cacher.get(request, self.params) is None
+        response = HttpResponse()
+        cacher.update_response(request, response)
+        assert response.cookies['prcache']['max-age'] == 0
+
+
+class TestLocalCache:
+
+    def test_least_recently_used_evicted(self):
+        local_cache = cache.LocalCache(max_entries=2, timeout_seconds=10)
+        local_cache.set('a', 1)
+        local_cache.set('b', 2)
+        local_cache.get('a')
+        local_cache.set('c', 3)
+
+        assert local_cache.get('b') is None
+        assert local_cache.get('a') == 1
+        assert local_cache.get('c') == 3
+
+    def test_entries_expire(self):
+        local_cache = cache.LocalCache(max_entries=2, timeout_seconds=10)
+        with mock.patch('time.time', return_value=1000):
+            local_cache.set('a', 1)
+        with mock.patch('time.time', return_value=1010):
+            assert local_cache.get('a') is None
+        assert len(local_cache) == 0
+
+
+class TestSessionCacher:
+
+    def test_compact_entry_stored_in_session(self):
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['fake_proctor_test'])
+        group_dict = {'fake_proctor_test': GroupAssignment('active', 1, None)}
+        request = mock.Mock(session={'proctorcache': {'group_dict': {}}})
+        cacher = cache.SessionCacher()
+
+        cacher.set(request, params, group_dict, api_response())
+
+        assert list(request.session) == [cacher._get_session_dict_key()]
+        assert cacher.get(request, params) == group_dict
+
+
+class TestCacheCacher:
+
+    def test_cache_key_fixed_length(self):
+        cacher = cache.CacheCacher()
+        short_params = create_proctor_parameters({'USER': 'a'})
+        long_params = create_proctor_parameters({'USER': 'a b\n' * 100, 'account': 1234})
+
+        short_key = cacher._get_cache_key(short_params)
+        long_key = cacher._get_cache_key(long_params)
+
+        assert len(short_key) == len(long_key)
+        assert ' ' not in long_key and '\n' not in long_key
+
+
+class TestBulkOperations:
+
+    def setup_method(self):
+        self.params_list = [
+            create_proctor_parameters({'account': account}, defined_tests=['fake_proctor_test'])
+            for account in range(5)]
+        self.group_dict = {'fake_proctor_test': GroupAssignment('active', 1, None)}
+
+    def set_some(self, cacher):
+        cacher.set_many(None, [(params, self.group_dict, api_response())
+                               for params in self.params_list[::2]])
+
+    def test_one_round_trip_each(self):
+        cacher = cache.CacheCacher()
+        with mock.patch.object(cacher.cache, 'set_many', wraps=cacher.cache.set_many) as set_many:
+            self.set_some(cacher)
+        assert set_many.call_count == 1
+
+        with mock.patch.object(cacher.cache, 'get_many', wraps=cacher.cache.get_many) as get_many, \
+                mock.patch.object(cacher, '_get_latest_version') as get_latest_version, \
+                mock.patch.object(cacher, '_get_cache_dict') as get_cache_dict:
+            group_dicts = cacher.get_many(None, self.params_list)
+
+        assert group_dicts == [self.group_dict, None, self.group_dict, None, self.group_dict]
+        assert get_many.call_count == 1
+        get_latest_version.assert_not_called()
+        get_cache_dict.assert_not_called()
+
+    def test_matches_single_lookups(self):
+        cacher = cache.CacheCacher()
+        self.set_some(cacher)
+
+        assert cacher.get_many(None, self.params_list) == [
+            cacher.get(None, params) for params in self.params_list]
+        cacher.update_matrix_version(api_response('2'))
+        assert cacher.get_many(None, self.params_list) == [None] * 5
+
+    def test_expired_version(self):
+        cacher = cache.CacheCacher()
+        self.set_some(cacher)
+        cacher.cache.delete(cacher._get_cache_version_key())
+
+        assert cacher.lookup_many(None, self.params_list[:1]) == [(None, False, ())]
+
+    def test_tiered_cacher_fills_memory(self):
+        cache.TieredCacher().set_many(None, [(self.params_list[0], self.group_dict,
+                                              api_response())])
+        cacher = cache.TieredCacher()
+        cacher.set_many(None, [(self.params_list[1], self.group_dict, api_response())])
+
+        assert cacher.get_many(None, self.params_list[:3]) == [
+            self.group_dict, self.group_dict, None]
+        with mock.patch.object(cacher.cache, 'get_many') as get_many:
+            assert cacher.get_many(None, self.params_list[:2]) == [
+                self.group_dict, self.group_dict]
+        get_many.assert_not_called()
+
+    def test_default_implementation(self):
+        request = mock.Mock(session={})
+        cacher = cache.SessionCacher()
+        cacher.set_many(request, [(self.params_list[0], self.group_dict, api_response())])
+
+        assert cacher.get_many(request, self.params_list[:2]) == [self.group_dict, None]
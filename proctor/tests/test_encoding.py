@@ -0,0 +1,97 @@
+from __future__ import absolute_import, unicode_literals
+
+import json
+import pickle
+
+from proctor import encoding
+from proctor.groups import GroupAssignment, extract_groups
+from proctor.tests.utils import create_proctor_parameters
+
+
+class TestEncoding:
+
+    def setup_method(self):
+        self.params = create_proctor_parameters({'account': 1234},
+                                                defined_tests=['activetst', 'unassignedtst'])
+        self.group_dict = {
+            'activetst': GroupAssignment(group='active', value=1, payload=[1.5, 2.5]),
+            'unassignedtst': GroupAssignment(group=None, value=None, payload=None),
+        }
+
+    def test_round_trip(self):
+        entry = encoding.encode_entry(self.params, self.group_dict, '42')
+
+        decoded = encoding.decode_entry(entry, self.params)
+
+        assert decoded.matrix_version == '42'
+        assert decoded.group_dict == self.group_dict
+
+    def test_round_trip_through_json(self):
+        # Django sessions serialize to JSON by default, which makes tuples lists.
+        entry = json.loads(json.dumps(encoding.encode_entry(self.params, self.group_dict, '42')))
+
+        assert encoding.decode_entry(entry, self.params).group_dict == self.group_dict
+
+    def test_decoded_assignments_shared(self):
+        group_dict = {'activetst': GroupAssignment(group='active', value=1, payload='a'),
+                      'unassignedtst': GroupAssignment(group=None, value=None, payload=None)}
+        entry = encoding.encode_entry(self.params, group_dict, '43')
+
+        first = encoding.decode_entry(entry, self.params).group_dict
+        second = encoding.decode_entry(entry, self.params).group_dict
+
+        assert first == group_dict
+        assert first['activetst'] is second['activetst']
+
+    def test_other_params_rejected(self):
+        entry = encoding.encode_entry(self.params, self.group_dict, '42')
+        other_params = create_proctor_parameters({'account': 1234},
+                                                 defined_tests=['unassignedtst', 'activetst'])
+
+        assert encoding.decode_entry(entry, other_params) is None
+
+    def test_unknown_format_rejected(self):
+        entry = encoding.encode_entry(self.params, self.group_dict, '42')
+
+        assert encoding.decode_entry((encoding.FORMAT_VERSION + 1,) + entry[1:],
+                                     self.params) is None
+        assert encoding.decode_entry({'group_dict': {}}, self.params) is None
+
+    def test_digests_round_trip(self):
+        entry = encoding.encode_entry(self.params, self.group_dict, '42', {'activetst': 'abc'})
+
+        assert encoding.decode_entry(entry, self.params).digests == ('abc', '')
+
+    def test_changed_tests(self):
+        matrix_response = {'audit': {'version': '1'},
+                           'tests': {'activetst': {'salt': 'a'}, 'unassignedtst': {'salt': 'u'}}}
+        entry = encoding.decode_entry(
+            encoding.encode_entry(self.params, self.group_dict, '1',
+                                  encoding.get_test_digests(matrix_response)),
+            self.params)
+
+        assert encoding.get_changed_tests(
+            self.params, entry, encoding.get_test_digests(matrix_response)) == ()
+        matrix_response['tests']['activetst']['salt'] = 'b'
+        assert encoding.get_changed_tests(
+            self.params, entry, encoding.get_test_digests(matrix_response)) == ('activetst',)
+        # Removed from the matrix.
+        assert encoding.get_changed_tests(self.params, entry, {}) == (
+            'activetst', 'unassignedtst')
+        assert encoding.get_changed_tests(self.params, entry, None) is None
+
+    def test_smaller_than_full_params(self):
+        tests = ['longtestname{0}tst'.format(index) for index in range(80)]
+        params = create_proctor_parameters({'USER': 'a' * 32, 'account': 1234},
+                                           defined_tests=tests)
+        params.context_dict = {'ua': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36'}
+        api_groups = {test: {'name': 'active', 'value': 1} for test in tests[::2]}
+        group_dict = extract_groups({'data': {'groups': api_groups}}, tests)
+        full_entry = {'group_dict': {key: list(value) for key, value in group_dict.items()},
+                      'params': params.as_dict(),
+                      'matrix_version': '42'}
+
+        compact_entry = encoding.encode_entry(params, group_dict, '42')
+
+        assert (len(pickle.dumps(compact_entry, protocol=2)) * 2 <
+                len(pickle.dumps(full_entry, protocol=2)))
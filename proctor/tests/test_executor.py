@@ -0,0 +1,54 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+import mock
+
+from proctor import executor
+
+
+class TestBoundedExecutor:
+
+    def test_calls_run_in_background(self):
+        bounded_executor = executor.BoundedExecutor(max_workers=1, max_pending=10)
+        done = threading.Event()
+
+        assert bounded_executor.submit('key', done.set)
+        assert done.wait(5)
+
+    def test_duplicate_keys_dropped(self):
+        bounded_executor = executor.BoundedExecutor(max_workers=1, max_pending=10)
+        release = threading.Event()
+        calls = []
+
+        def call(value):
+            release.wait(5)
+            calls.append(value)
+
+        assert bounded_executor.submit('key', call, 1)
+        assert not bounded_executor.submit('key', call, 2)
+        release.set()
+
+    def test_full_queue_drops_calls(self):
+        bounded_executor = executor.BoundedExecutor(max_workers=1, max_pending=1)
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        assert bounded_executor.submit('running', block)
+        assert started.wait(5)
+        assert bounded_executor.submit('queued', release.wait, 5)
+        assert not bounded_executor.submit('dropped', release.wait, 5)
+        release.set()
+
+    def test_workers_restarted_after_fork(self):
+        bounded_executor = executor.BoundedExecutor(max_workers=1, max_pending=10)
+        bounded_executor.submit('key', lambda: None)
+        parent_queue = bounded_executor._queue
+
+        with mock.patch('os.getpid', return_value=-1):
+            bounded_executor.submit('key', lambda: None)
+        assert bounded_executor._queue is not parent_queue
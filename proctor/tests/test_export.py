@@ -0,0 +1,106 @@
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from mock import patch
+
+from proctor.management.commands import proctor_export
+
+
+def get_api_response(params, http=None, evaluator=None):
+    value = int(params.identifier_dict['account']) % 2
+    return {'data': {'groups': {'fake_proctor_test_in_settings': {
+        'name': 'group{0}'.format(value), 'value': value}}, 'audit': {'version': '1'}}}
+
+
+@pytest.fixture
+def mock_identify():
+    with patch('proctor.identify._identify', side_effect=get_api_response) as mock_identify:
+        yield mock_identify
+
+
+def export(tmpdir, accountids, *args, **options):
+    input_path = tmpdir.join('accounts.txt')
+    input_path.write('\n'.join(accountids) + '\n')
+    output_path = tmpdir.join('groups.out')
+    call_command(proctor_export.Command(), *args, input=str(input_path),
+                 output=str(output_path), progress=0, **options)
+    return output_path.read()
+
+
+class TestExportCommand:
+
+    def test_csv(self, tmpdir, mock_identify):
+        output = export(tmpdir, ['1', '2', '', '3'], batch_size=2)
+
+        assert output == ('account,fake_proctor_test_in_settings\n'
+                          '1,1\n'
+                          '2,0\n'
+                          '3,1\n')
+        assert mock_identify.call_count == 3
+
+    def test_jsonl(self, tmpdir, mock_identify):
+        output = export(tmpdir, ['1'], format='jsonl')
+
+        assert json.loads(output) == {
+            'account': '1',
+            'groups': {'fake_proctor_test_in_settings': {
+                'group': 'group1', 'value': 1, 'payload': None}}}
+
+    def test_failed_calls_unassigned(self, tmpdir, mock_identify):
+        mock_identify.side_effect = None
+        mock_identify.return_value = None
+
+        assert export(tmpdir, ['1,"x"']).splitlines()[1] == '"1,""x""",'
+
+    def test_csv_quoting(self):
+        row = proctor_export._format_csv_row(['caf\xe9', 'a,b', 'say "hi"', 'two\nlines', 1])
+
+        assert row == 'caf\xe9,"a,b","say ""hi""","two\nlines",1\n'
+
+    def test_resume_from_checkpoint(self, tmpdir, mock_identify):
+        checkpoint = str(tmpdir.join('checkpoint'))
+        export(tmpdir, ['1', '2'], checkpoint=checkpoint)
+        assert json.loads(tmpdir.join('checkpoint').read()) == {'exported': 2, 'offset': 46}
+        # A batch written before a crash, but not checkpointed.
+        tmpdir.join('groups.out').write('3,1\n', mode='a')
+
+        output = export(tmpdir, ['1', '2', '3', '4'], '--resume', checkpoint=checkpoint)
+
+        assert output == ('account,fake_proctor_test_in_settings\n'
+                          '1,1\n'
+                          '2,0\n'
+                          '3,1\n'
+                          '4,0\n')
+        assert mock_identify.call_count == 4
+        assert json.loads(tmpdir.join('checkpoint').read()) == {'exported': 4, 'offset': 54}
+
+    def test_resume_output_shorter_than_checkpoint(self, tmpdir, mock_identify):
+        checkpoint = str(tmpdir.join('checkpoint'))
+        export(tmpdir, ['1', '2'], checkpoint=checkpoint)
+        tmpdir.join('groups.out').write('')
+
+        with pytest.raises(CommandError):
+            export(tmpdir, ['1', '2', '3'], '--resume', checkpoint=checkpoint)
+
+    def test_resume_needs_checkpoint(self, tmpdir):
+        with pytest.raises(CommandError):
+            export(tmpdir, ['1'], '--resume')
+
+    def test_identifiers_streamed(self):
+        lines = iter(['1\n', '\n', '2\n', '3\n'])
+        batches = proctor_export.iter_batches(proctor_export.iter_identifiers(lines, skip=1), 1)
+
+        assert next(batches) == ['2']
+        assert next(lines) == '3\n'
+
+    def test_stdout(self, mock_identify):
+        stdout = io.StringIO()
+        with patch('sys.stdin', io.StringIO('1\n')):
+            call_command(proctor_export.Command(), progress=0, stdout=stdout)
+
+        assert stdout.getvalue() == 'account,fake_proctor_test_in_settings\n1,1\n'
@@ -1,6 +1,11 @@
 from __future__ import absolute_import, unicode_literals
 
-from proctor.groups import ProctorGroups, GroupAssignment
+import pickle
+
+import pytest
+
+from proctor.groups import (
+    ProctorGroups, GroupAssignment, _UNASSIGNED_GROUP, extract_groups, intern_assignment)
 
 
 class TestProctorGroups:
@@ -18,3 +23,96 @@ class TestProctorGroups:
     def test_string_encoding_for_inactive_group(self):
         groups = ProctorGroups({"test_two": GroupAssignment(group=None, value=-1, payload=None)})
         assert groups.get_group_string_list() == []
+
+    def test_group_string(self):
+        groups = ProctorGroups({
+            "test_one": GroupAssignment(group="test", value=0, payload=""),
+            "test_two": GroupAssignment(group="inactive", value=-1, payload=""),
+            "test_three": GroupAssignment(group="active", value=1, payload=[1, 2]),
+        })
+        assert str(groups) == "test_one0,test_three1"
+        assert str(groups) == "test_one0,test_three1"
+        assert groups.get_group_string(["extra1"]) == "test_one0,test_three1,extra1"
+        assert groups.get_group_string(iter([])) == "test_one0,test_three1"
+
+    def test_group_string_without_proctor_groups(self):
+        groups = ProctorGroups({"test_two": GroupAssignment(group=None, value=-1, payload=None)})
+        assert groups.get_group_string() == ""
+        assert groups.get_group_string(["extra1", "extra2"]) == "extra1,extra2"
+
+    def test_group_string_list_can_be_changed(self):
+        groups = ProctorGroups({"test_one": GroupAssignment(group="test", value=0, payload="")})
+        groups.get_group_string_list().append("extra1")
+        assert groups.get_group_string_list() == ["test_one0"]
+
+    def test_tests_are_attributes(self):
+        assignment = GroupAssignment(group="active", value=1, payload=None)
+        groups = ProctorGroups({"test_one": assignment, "get_group_string_list": assignment})
+        assert groups.test_one is assignment
+        # Tests never overwrite methods.
+        assert callable(groups.get_group_string_list)
+        with pytest.raises(AttributeError):
+            groups.test_not_defined
+
+    def test_class_generated_once_per_test_set(self):
+        assignment = GroupAssignment(group="active", value=1, payload=None)
+        first = ProctorGroups({"test_one": assignment, "test_two": assignment})
+        second = ProctorGroups({"test_one": assignment, "test_two": assignment})
+        other = ProctorGroups({"test_one": assignment})
+        assert type(first) is type(second)
+        assert type(first) is not type(other)
+        assert isinstance(first, ProctorGroups)
+        assert not hasattr(other, "test_two")
+
+    def test_no_instance_dict_allocated(self):
+        groups = ProctorGroups({"test_one": GroupAssignment(group="test", value=0, payload="")})
+        groups.test_one
+        assert vars(groups) == {}
+
+    def test_pickle(self):
+        groups = ProctorGroups({"test_one": GroupAssignment(group="test", value=0, payload="")})
+        unpickled = pickle.loads(pickle.dumps(groups))
+        assert unpickled.test_one == groups.test_one
+        assert str(unpickled) == "test_one0"
+
+
+class TestInternAssignment:
+
+    def test_same_assignment_shared(self):
+        first = intern_assignment('intern1', 'active', 1, 'blue')
+        assert first == GroupAssignment(group='active', value=1, payload='blue')
+        assert intern_assignment('intern1', 'active', 1, 'blue') is first
+        assert intern_assignment('intern1', 'active', 1, 'green') is not first
+
+    def test_unassigned(self):
+        assert intern_assignment('intern1', None, None, None) is _UNASSIGNED_GROUP
+
+    def test_payload_types_not_confused(self):
+        long_assignment = intern_assignment('intern1', 'active', 1, 1)
+        double_assignment = intern_assignment('intern1', 'active', 1, 1.0)
+        assert isinstance(double_assignment.payload, float)
+        assert long_assignment is not double_assignment
+
+    def test_unhashable_payload_not_shared(self):
+        first = intern_assignment('intern1', 'active', 1, ['a', 'b'])
+        second = intern_assignment('intern1', 'active', 1, ['a', 'b'])
+        assert first == second
+        assert first.payload is not second.payload
+
+    def test_old_versions_dropped(self):
+        first = intern_assignment('intern2', 'active', 1, None)
+        intern_assignment('intern3', 'active', 1, None)
+        assert intern_assignment('intern2', 'active', 1, None) is first
+        intern_assignment('intern4', 'active', 1, None)
+        intern_assignment('intern5', 'active', 1, None)
+        assert intern_assignment('intern2', 'active', 1, None) is not first
+
+    def test_extract_groups_shares_assignments(self):
+        def get_response():
+            return {'data': {'groups': {'test_one': {'name': 'active', 'value': 1},
+                                        'test_two': {'name': 'active', 'value': 1}},
+                             'audit': {'version': 'intern6'}}}
+
+        first = extract_groups(get_response(), ['test_one', 'test_two'])
+        second = extract_groups(get_response(), ['test_one', 'test_two'])
+        assert first['test_one'] is first['test_two'] is second['test_one']
@@ -8,6 +8,7 @@ from mock import ANY, patch
 from proctor import api
 from proctor import cache
 from proctor import identify
+from proctor.groups import GroupAssignment
 from proctor.tests.utils import create_proctor_parameters
 
 
@@ -41,6 +42,48 @@ class TestIdentifyGroups:
         # Then request only made once
         mock_requests.get.assert_called_once()
 
+    def test_stale_result_revalidated_in_background(self):
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['fake_proctor_test'])
+        cacher = cache.CacheCacher(stale_seconds=60)
+        cacher.set(None, params, {'fake_proctor_test': GroupAssignment('active', 1, None)},
+                   {'data': {'groups': {}, 'audit': {'version': '1'}}})
+        cacher.update_matrix_version({'data': {'groups': {}, 'audit': {'version': '2'}}})
+        mock_requests = mock_http_get_data({'fake_proctor_test': {'name': 'control', 'value': 0}})
+
+        with patch('proctor.executor.BoundedExecutor.submit') as mock_submit:
+            groups = identify.identify_groups(params, cacher=cacher, http=mock_requests)
+
+        # Stale groups are returned without waiting for the API.
+        assert groups.fake_proctor_test.group == 'active'
+        mock_requests.get.assert_not_called()
+        mock_submit.assert_called_once_with(
+            params.fingerprint, identify._fetch_group_dict, params, cacher, None,
+            mock_requests, None, ANY)
+
+    def test_only_changed_tests_identified(self):
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['atst', 'btst'])
+        cacher = cache.CacheCacher()
+        cacher.publish_matrix({'audit': {'version': '1'},
+                               'tests': {'atst': {'salt': 'a'}, 'btst': {'salt': 'b'}}})
+        cacher.set(None, params, {'atst': GroupAssignment('active', 1, None),
+                                  'btst': GroupAssignment('active', 1, None)},
+                   {'data': {'groups': {}, 'audit': {'version': '1'}}})
+        cacher.publish_matrix({'audit': {'version': '2'},
+                               'tests': {'atst': {'salt': 'a'}, 'btst': {'salt': 'b2'}}})
+        mock_requests = mock_http_get_json({'data': {
+            'groups': {'btst': {'name': 'control', 'value': 0}},
+            'audit': {'version': '2'},
+        }})
+
+        groups = identify.identify_groups(params, cacher=cacher, http=mock_requests)
+
+        assert groups.atst.group == 'active'
+        assert groups.btst.group == 'control'
+        assert mock_requests.get.call_args[1]['params']['test'] == 'btst'
+        # The merged result is cached for the new version.
+        assert cacher.get(None, params) == {'atst': GroupAssignment('active', 1, None),
+                                            'btst': GroupAssignment('control', 0, None)}
+
     @patch('proctor.api.call_proctor_identify')
     def test_proctor_response_and_cacher_are_none(self, mock_call_proctor_identify):
         mock_call_proctor_identify.return_value = None
@@ -53,7 +96,7 @@ class TestIdentifyGroups:
         assert group['fake_proctor_test'].value is None
 
     def test_response_has_no_group_data(self):
-        params = create_proctor_parameters({})
+        params = create_proctor_parameters({'account': 1234})
         mock_requests = mock_http_get_json({'data': {}})
 
         # When
@@ -64,7 +107,7 @@ class TestIdentifyGroups:
         mock_logger.error.assert_called_once_with(ANY, ANY, 'missing groups field', ANY)
 
     def test_api_error_message(self):
-        params = create_proctor_parameters({})
+        params = create_proctor_parameters({'account': 1234})
         mock_requests = mock_http_get_data(
             group_data={},
             added_data={'meta': {'error': 'scary message'}},
@@ -79,6 +122,46 @@ class TestIdentifyGroups:
         mock_logger.error.assert_called_once_with(ANY, ANY, ANY, ANY, 'scary message')
 
 
+class TestUnassignedGroups:
+
+    def test_no_identifiers_skips_cache_and_api(self):
+        params = create_proctor_parameters({'USER': None, 'account': ''},
+                                           defined_tests=['fake_proctor_test'])
+        mock_requests = mock_http_get_data({'fake_proctor_test': {'name': 'active', 'value': 1}})
+        cacher = mock.Mock(spec=cache.CacheCacher)
+
+        proc = identify.identify_groups(params, cacher=cacher, http=mock_requests, lazy=True)
+
+        assert proc.fake_proctor_test.group is None
+        assert str(proc) == ''
+        mock_requests.get.assert_not_called()
+        cacher.lookup.assert_not_called()
+
+    def test_group_dict_shared(self):
+        params = create_proctor_parameters({}, defined_tests=['fake_proctor_test'])
+
+        first = identify.identify_groups(params)
+        second = identify.identify_groups(params)
+
+        assert first is not second
+        assert first._group_dict is second._group_dict
+
+    def test_forced_groups_identified(self):
+        params = api.ProctorParameters(
+            api_root='fake-proctor-api-url',
+            defined_tests=['fake_proctor_test'],
+            context_dict={},
+            identifier_dict={},
+            force_groups='fake_proctor_test1',
+        )
+        mock_requests = mock_http_get_data({'fake_proctor_test': {'name': 'active', 'value': 1}})
+
+        proc = identify.identify_groups(params, http=mock_requests)
+
+        assert proc.fake_proctor_test.value == 1
+        mock_requests.get.assert_called_once()
+
+
 class TestProcByAccountid:
 
     def test_fake_proctor_test_not_found(self):
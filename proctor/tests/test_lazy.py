@@ -1,9 +1,15 @@
 from __future__ import absolute_import, unicode_literals
 
-from mock import patch
+import threading
+
+from mock import Mock, patch
 import pytest
 
-from proctor.lazy import LazyProctorGroups
+from proctor.cache import SessionCacher
+from proctor.executor import BoundedExecutor
+from proctor.groups import GroupAssignment
+from proctor.identify import identify_groups
+from proctor.lazy import LazyGroupAssignment, LazyProctorGroups
 from proctor.tests.utils import create_proctor_parameters
 
 
@@ -18,3 +24,106 @@ class TestLazyProctorGroups:
             lazy_proctor_groups.load()
         except AttributeError:
             pytest.fail("Attribute error thrown when loading with self._group_dict == None")
+
+    @patch('proctor.identify.load_group_dict')
+    def test_loads_on_first_assignment_use(self, mock_load_group_dict):
+        assignment = GroupAssignment(group='active', value=1, payload=None)
+        mock_load_group_dict.return_value = {'fake_proctor_test': assignment}
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['fake_proctor_test'])
+        lazy_proctor_groups = LazyProctorGroups(params)
+
+        lazy_assignment = lazy_proctor_groups.fake_proctor_test
+        assert isinstance(lazy_assignment, LazyGroupAssignment)
+        assert not mock_load_group_dict.called
+
+        assert lazy_assignment.group == 'active'
+        assert lazy_proctor_groups.loaded
+        assert lazy_proctor_groups.fake_proctor_test is assignment
+        assert mock_load_group_dict.call_count == 1
+        with pytest.raises(AttributeError):
+            lazy_proctor_groups.test_not_defined
+
+    def test_methods_not_overwritten_by_tests(self):
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['load', 'loaded'])
+        lazy_proctor_groups = LazyProctorGroups(params)
+        assert lazy_proctor_groups.loaded is False
+        assert callable(lazy_proctor_groups.load)
+
+    @patch('proctor.identify.load_group_dict')
+    def test_group_string_loads(self, mock_load_group_dict):
+        mock_load_group_dict.return_value = {
+            'fake_proctor_test': GroupAssignment(group='active', value=1, payload=None)}
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['fake_proctor_test'])
+        lazy_proctor_groups = LazyProctorGroups(params)
+
+        assert str(lazy_proctor_groups) == 'fake_proctor_test1'
+        assert lazy_proctor_groups.get_group_string(['extra1']) == 'fake_proctor_test1,extra1'
+        assert mock_load_group_dict.call_count == 1
+
+
+class TestPrefetch:
+
+    def setup_method(self):
+        self.params = create_proctor_parameters({'account': 1234},
+                                                defined_tests=['fake_proctor_test'])
+        self.assignment = GroupAssignment(group='active', value=1, payload=None)
+        self.executor = BoundedExecutor(max_workers=1, max_pending=10)
+
+    @patch('proctor.identify.load_group_dict')
+    def test_loads_in_background(self, mock_load_group_dict):
+        loading = threading.Event()
+
+        def load_group_dict(*args):
+            loading.set()
+            return {'fake_proctor_test': self.assignment}
+        mock_load_group_dict.side_effect = load_group_dict
+        lazy_proctor_groups = LazyProctorGroups(self.params)
+
+        assert lazy_proctor_groups.prefetch(5, self.executor)
+        assert loading.wait(5)
+        assert lazy_proctor_groups.fake_proctor_test.group == 'active'
+        assert lazy_proctor_groups.fake_proctor_test is self.assignment
+        mock_load_group_dict.assert_called_once_with(self.params, None, None, None, None)
+
+    @patch('proctor.identify.load_group_dict')
+    def test_deadline_uses_unassigned_groups(self, mock_load_group_dict):
+        release = threading.Event()
+        mock_load_group_dict.side_effect = lambda *args: release.wait(5)
+        lazy_proctor_groups = LazyProctorGroups(self.params)
+
+        assert lazy_proctor_groups.prefetch(0.01, self.executor)
+        try:
+            assert lazy_proctor_groups.fake_proctor_test.group is None
+            assert lazy_proctor_groups.loaded
+        finally:
+            release.set()
+
+    @patch('proctor.identify.load_group_dict')
+    def test_exception_raised_on_access(self, mock_load_group_dict):
+        mock_load_group_dict.side_effect = ValueError('bad')
+        lazy_proctor_groups = LazyProctorGroups(self.params)
+
+        assert lazy_proctor_groups.prefetch(5, self.executor)
+        with pytest.raises(ValueError):
+            lazy_proctor_groups.load()
+
+    @patch('proctor.identify.load_group_dict')
+    def test_request_scoped_cacher_loads_on_access(self, mock_load_group_dict):
+        mock_load_group_dict.return_value = {'fake_proctor_test': self.assignment}
+        cacher = SessionCacher()
+        request = Mock()
+        lazy_proctor_groups = LazyProctorGroups(self.params, cacher, request)
+
+        assert not lazy_proctor_groups.prefetch(5, self.executor)
+        assert not mock_load_group_dict.called
+        assert lazy_proctor_groups.fake_proctor_test.group == 'active'
+        mock_load_group_dict.assert_called_once_with(self.params, cacher, request, None, None)
+
+    @patch('proctor.identify.load_group_dict')
+    def test_identify_groups_prefetches(self, mock_load_group_dict):
+        mock_load_group_dict.return_value = {'fake_proctor_test': self.assignment}
+
+        with patch.object(LazyProctorGroups, 'prefetch') as mock_prefetch:
+            identify_groups(self.params, lazy=True, prefetch=True, prefetch_timeout_seconds=2)
+
+        mock_prefetch.assert_called_once_with(2)
@@ -0,0 +1,101 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+from mock import Mock, patch
+
+from proctor import cache
+from proctor import identify
+from proctor import loader
+
+
+def get_api_response(params, http=None, evaluator=None):
+    value = params.identifier_dict['account'] % 2
+    return {'data': {'groups': {'fake_proctor_test_in_settings': {'name': 'group', 'value': value}},
+                     'audit': {'version': '1'}}}
+
+
+class TestAccountLoader:
+
+    @patch('proctor.identify._identify', side_effect=get_api_response)
+    def test_accounts_loaded_together(self, mock_identify):
+        account_loader = loader.AccountLoader()
+        procs = account_loader.load_many([1, 2, 3])
+        assert not mock_identify.called
+
+        assert procs[0].fake_proctor_test_in_settings.value == 1
+        assert mock_identify.call_count == 3
+        assert [proc.fake_proctor_test_in_settings.value for proc in procs] == [1, 0, 1]
+        assert mock_identify.call_count == 3
+
+    @patch('proctor.identify._identify', side_effect=get_api_response)
+    def test_repeated_accounts_loaded_once(self, mock_identify):
+        account_loader = loader.AccountLoader()
+
+        assert account_loader.load(1) is account_loader.load(1)
+        str(account_loader.load(1))
+        assert mock_identify.call_count == 1
+
+    @patch('proctor.identify._identify')
+    def test_calls_run_concurrently(self, mock_identify):
+        lock = threading.Lock()
+        started = []
+        all_started = threading.Event()
+
+        def identify_concurrently(params, http=None, evaluator=None):
+            with lock:
+                started.append(params)
+                if len(started) == 3:
+                    all_started.set()
+            # Only returns if all three calls are running at once.
+            assert all_started.wait(5)
+            return get_api_response(params)
+        mock_identify.side_effect = identify_concurrently
+        account_loader = loader.AccountLoader(max_workers=3)
+
+        procs = account_loader.load_many([1, 2, 3])
+
+        assert str(procs[1]) == 'fake_proctor_test_in_settings0'
+
+    @patch('proctor.identify._identify', side_effect=get_api_response)
+    def test_cacher_used_in_bulk(self, mock_identify):
+        cacher = cache.CacheCacher()
+        first_loader = loader.AccountLoader(cacher)
+        str(first_loader.load(1))
+
+        cacher.get_many = Mock(wraps=cacher.get_many)
+        cacher.set_many = Mock(wraps=cacher.set_many)
+        second_loader = loader.AccountLoader(cacher)
+        procs = second_loader.load_many([1, 2])
+        str(procs[0])
+
+        assert mock_identify.call_count == 2
+        cacher.get_many.assert_called_once_with(None, [procs[0]._params, procs[1]._params])
+        assert cacher.set_many.call_count == 1
+        assert [item[0] for item in cacher.set_many.call_args[0][1]] == [procs[1]._params]
+
+    @patch('proctor.identify._identify')
+    def test_failed_accounts_unassigned(self, mock_identify):
+        mock_identify.side_effect = [None, ValueError('bad')]
+        account_loader = loader.AccountLoader(max_workers=1)
+
+        procs = account_loader.load_many([1, 2])
+
+        assert procs[0].fake_proctor_test_in_settings.group is None
+        assert procs[1].fake_proctor_test_in_settings.group is None
+
+    def test_request_scoped_cacher_not_used(self):
+        assert loader.AccountLoader(cache.SessionCacher()).cacher is None
+
+    def test_request_loader_reused(self):
+        request = Mock(spec=[])
+        assert loader.get_account_loader(request) is loader.get_account_loader(request)
+
+    @patch('proctor.identify._identify', side_effect=get_api_response)
+    def test_proc_by_accountid_with_loader(self, mock_identify):
+        account_loader = loader.AccountLoader()
+
+        proc = identify.proc_by_accountid(3, account_loader)
+
+        assert proc is account_loader.load(3)
+        assert proc.fake_proctor_test_in_settings.value == 1
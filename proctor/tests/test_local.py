@@ -0,0 +1,407 @@
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+import os
+import time
+
+import mock
+import pytest
+
+from proctor import groups
+from proctor import identify
+from proctor import local
+from proctor.tests.utils import create_proctor_parameters
+
+
+MATRIX_RESPONSE = {
+    'audit': {'version': '42', 'updatedBy': 'proctor', 'updated': 1500000000000},
+    'tests': {
+        'buttoncolortst': {
+            'version': '7',
+            'testType': 'USER',
+            'salt': 'buttoncolortst',
+            'rule': None,
+            'buckets': [
+                {'name': 'inactive', 'value': -1, 'payload': {'stringValue': '#888888'}},
+                {'name': 'control', 'value': 0, 'payload': {'stringValue': '#888888'}},
+                {'name': 'blue', 'value': 1, 'payload': {'stringValue': '#2B60DE'}},
+            ],
+            'allocations': [
+                {'rule': None, 'ranges': [
+                    {'bucketValue': -1, 'length': 0.0},
+                    {'bucketValue': 0, 'length': 0.0},
+                    {'bucketValue': 1, 'length': 1.0},
+                ]},
+            ],
+        },
+        'accountrollout': {
+            'version': '3',
+            'testType': 'ACCOUNT',
+            'salt': '&rollouts',
+            'rule': '${true}',
+            'buckets': [
+                {'name': 'inactive', 'value': -1},
+                {'name': 'active', 'value': 1},
+            ],
+            'allocations': [
+                {'rule': '${false}', 'ranges': [{'bucketValue': 1, 'length': 1.0}]},
+                {'rule': '', 'ranges': [{'bucketValue': -1, 'length': 1.0}]},
+            ],
+        },
+        'disabledtst': {
+            'version': '5',
+            'testType': 'USER',
+            'salt': 'disabledtst',
+            'rule': '${false}',
+            'buckets': [{'name': 'active', 'value': 1}],
+            'allocations': [{'rule': None, 'ranges': [{'bucketValue': 1, 'length': 1.0}]}],
+        },
+        'splittst': {
+            'version': '9',
+            'testType': 'USER',
+            'salt': 'splittst',
+            'rule': None,
+            'buckets': [
+                {'name': 'control', 'value': 0},
+                {'name': 'test', 'value': 1},
+            ],
+            'allocations': [
+                {'rule': None, 'ranges': [
+                    {'bucketValue': 0, 'length': 0.25},
+                    {'bucketValue': 1, 'length': 0.75},
+                ]},
+            ],
+        },
+        'contexttst': {
+            'version': '2',
+            'testType': 'USER',
+            'salt': 'contexttst',
+            'rule': "${country == 'US'}",
+            'buckets': [{'name': 'active', 'value': 1}],
+            'allocations': [{'rule': None, 'ranges': [{'bucketValue': 1, 'length': 1.0}]}],
+        },
+    },
+}
+
+# /groups/identify responses for the matrix above. Every identifier gets the
+# same bucket in these allocations, so they don't check identifier hashing.
+# See TestLocalEvaluatorRecordings for that.
+# Each entry: (identifier_dict, force_groups, defined_tests, expected groups)
+RECORDED_IDENTIFY = [
+    (
+        {'USER': 'abc123'}, None, ['buttoncolortst', 'disabledtst'],
+        {'buttoncolortst': {'name': 'blue', 'value': 1, 'version': '7',
+                            'payload': {'stringValue': '#2B60DE'}}},
+    ),
+    (
+        {'USER': 'abc123', 'account': 1234}, None, ['buttoncolortst', 'accountrollout'],
+        {'buttoncolortst': {'name': 'blue', 'value': 1, 'version': '7',
+                            'payload': {'stringValue': '#2B60DE'}},
+         'accountrollout': {'name': 'inactive', 'value': -1, 'version': '3'}},
+    ),
+    (
+        {'account': 1234}, None, ['buttoncolortst', 'accountrollout'],
+        {'accountrollout': {'name': 'inactive', 'value': -1, 'version': '3'}},
+    ),
+    (
+        {'USER': 'abc123'}, 'buttoncolortst0,disabledtst1', ['buttoncolortst', 'disabledtst'],
+        {'buttoncolortst': {'name': 'control', 'value': 0, 'version': '7',
+                            'payload': {'stringValue': '#888888'}},
+         'disabledtst': {'name': 'active', 'value': 1, 'version': '5'}},
+    ),
+    (
+        {'USER': 'abc123'}, None, ['buttoncolortst', 'notinmatrixtst'],
+        {'buttoncolortst': {'name': 'blue', 'value': 1, 'version': '7',
+                            'payload': {'stringValue': '#2B60DE'}}},
+    ),
+]
+
+
+# Responses recorded from a live Pipet by record_identify.py.
+RECORDINGS_PATH = os.path.join(os.path.dirname(__file__), 'recorded_identify.json')
+
+
+def load_recordings():
+    if not os.path.exists(RECORDINGS_PATH):
+        return None
+    with io.open(RECORDINGS_PATH, encoding='utf-8') as recordings_file:
+        return json.load(recordings_file)
+
+
+RECORDINGS = load_recordings()
+
+needs_recordings = pytest.mark.skipif(
+    RECORDINGS is None,
+    reason="No recorded_identify.json. Record one from Pipet with proctor.tests.record_identify.")
+
+
+def create_evaluator(defined_tests, matrix_response=MATRIX_RESPONSE):
+    evaluator = local.LocalEvaluator('fake-proctor-api-url', defined_tests,
+                                     identifier_types={'account': 'ACCOUNT'})
+    patcher = mock.patch('proctor.api.call_proctor_matrix', return_value=matrix_response)
+    return evaluator, patcher
+
+
+class TestLocalEvaluatorParity:
+
+    @pytest.mark.parametrize('identifier_dict,force_groups,defined_tests,recorded_groups',
+                             RECORDED_IDENTIFY)
+    def test_matches_recorded_identify_response(self, identifier_dict, force_groups,
+                                                defined_tests, recorded_groups):
+        params = create_proctor_parameters(identifier_dict, defined_tests=defined_tests)
+        params.force_groups = force_groups
+        evaluator, patcher = create_evaluator(defined_tests)
+        recorded_response = {'data': {'groups': recorded_groups,
+                                      'audit': MATRIX_RESPONSE['audit']}}
+
+        with patcher:
+            local_response = evaluator.identify(params)
+
+        assert (groups.extract_groups(local_response, defined_tests) ==
+                groups.extract_groups(recorded_response, defined_tests))
+        assert local_response['data']['audit']['version'] == '42'
+
+
+@needs_recordings
+class TestLocalEvaluatorRecordings:
+
+    def test_recordings_cover_hashing(self):
+        tests = RECORDINGS['matrix']['tests']
+        split_tests = {}
+        for test_name in RECORDINGS['defined_tests']:
+            for allocation in tests[test_name].get('allocations', []):
+                lengths = [test_range['length'] for test_range in allocation.get('ranges', [])]
+                if any(0 < length < 1 for length in lengths):
+                    split_tests.setdefault(test_name, set()).update(lengths)
+        shared_salts = [tests[test_name].get('salt') for test_name in split_tests
+                        if (tests[test_name].get('salt') or '').startswith('&')]
+        hashes = [
+            local.hash_identifier(local.get_test_salt(test_name, tests[test_name]), identifier)
+            for recording in RECORDINGS['identify']
+            for identifier in recording['identifier_dict'].values()
+            for test_name in split_tests]
+
+        assert split_tests, "No recorded test splits identifiers between buckets."
+        assert any(len(lengths) > 1 for lengths in split_tests.values()), \
+            "No recorded test has uneven allocation ranges."
+        assert len(shared_salts) > len(set(shared_salts)), \
+            "No two recorded split tests share a '&' salt."
+        assert min(hashes) < 0 < max(hashes), "Recorded hashes aren't both negative and positive."
+        assert any(recording.get('force_groups') for recording in RECORDINGS['identify']), \
+            "No recording has forced groups."
+
+    def test_matches_recorded_identify_responses(self):
+        defined_tests = RECORDINGS['defined_tests']
+        evaluator = local.LocalEvaluator('fake-proctor-api-url', defined_tests,
+                                         identifier_types=RECORDINGS['identifier_types'])
+        evaluator.publish_matrix(RECORDINGS['matrix'])
+
+        for recording in RECORDINGS['identify']:
+            params = create_proctor_parameters(recording['identifier_dict'],
+                                               defined_tests=defined_tests)
+            params.force_groups = recording.get('force_groups')
+            recorded_response = {'data': {'groups': recording['groups'],
+                                          'audit': RECORDINGS['matrix']['audit']}}
+
+            local_response = evaluator.identify(params)
+
+            assert (groups.extract_groups(local_response, defined_tests) ==
+                    groups.extract_groups(recorded_response, defined_tests)), \
+                (recording['identifier_dict'], params.force_groups)
+
+
+class TestLocalEvaluator:
+
+    def test_matrix_downloaded_once(self):
+        params = create_proctor_parameters({'USER': 'abc123'}, defined_tests=['buttoncolortst'])
+        evaluator, patcher = create_evaluator(['buttoncolortst'])
+
+        with patcher as mock_call_proctor_matrix:
+            evaluator.identify(params)
+            evaluator.identify(params)
+
+        mock_call_proctor_matrix.assert_called_once()
+
+    def test_expired_matrix_refreshed_in_background(self):
+        params = create_proctor_parameters({'USER': 'abc123'}, defined_tests=['buttoncolortst'])
+        evaluator, patcher = create_evaluator(['buttoncolortst'])
+        with patcher:
+            evaluator.get_matrix()
+        evaluator._matrix_expiry_time = 0
+
+        with patcher as mock_call_proctor_matrix, \
+                mock.patch('proctor.executor.BoundedExecutor.submit') as mock_submit:
+            assert evaluator.identify(params) is not None
+
+        mock_call_proctor_matrix.assert_not_called()
+        mock_submit.assert_called_once_with(
+            ('matrix', id(evaluator)), evaluator._refresh_expired_matrix, None)
+
+        with patcher as mock_call_proctor_matrix:
+            evaluator._refresh_expired_matrix(None)
+        mock_call_proctor_matrix.assert_called_once()
+        assert evaluator._matrix_expiry_time > time.time()
+
+    def test_failed_first_download_not_retried_per_request(self):
+        evaluator, patcher = create_evaluator(['buttoncolortst'], matrix_response=None)
+        assert evaluator.needs_download()
+
+        with patcher as mock_call_proctor_matrix:
+            assert evaluator.get_matrix() is None
+            assert not evaluator.needs_download()
+            assert evaluator.get_matrix() is None
+
+        mock_call_proctor_matrix.assert_called_once()
+
+    def test_context_rule_falls_back(self):
+        params = create_proctor_parameters({'USER': 'abc123'}, defined_tests=['contexttst'])
+        evaluator, patcher = create_evaluator(['contexttst'])
+
+        with patcher:
+            assert evaluator.identify(params) is None
+
+    def test_matrix_error_falls_back(self):
+        params = create_proctor_parameters({'USER': 'abc123'}, defined_tests=['buttoncolortst'])
+        evaluator, patcher = create_evaluator(['buttoncolortst'], matrix_response=None)
+
+        with patcher:
+            assert evaluator.identify(params) is None
+
+    def test_allocation_ranges_split_identifiers(self):
+        evaluator, patcher = create_evaluator(['splittst'])
+        values = []
+
+        with patcher:
+            for user in range(4000):
+                params = create_proctor_parameters({'USER': 'user%d' % user},
+                                                   defined_tests=['splittst'])
+                api_response = evaluator.identify(params)
+                values.append(api_response['data']['groups']['splittst']['value'])
+
+        # Same identifier always gets the same bucket.
+        with patcher:
+            repeat = evaluator.identify(create_proctor_parameters(
+                {'USER': 'user0'}, defined_tests=['splittst']))
+        assert repeat['data']['groups']['splittst']['value'] == values[0]
+
+        control_share = values.count(0) / float(len(values))
+        assert 0.2 < control_share < 0.3
+
+    def test_can_assign(self):
+        evaluator, patcher = create_evaluator(['buttoncolortst', 'accountrollout'])
+
+        user_params = create_proctor_parameters({'USER': 'abc123'},
+                                                defined_tests=['buttoncolortst'])
+        assert evaluator.can_assign(user_params) is None
+        with patcher:
+            evaluator.get_matrix()
+
+        assert evaluator.can_assign(user_params) is True
+        assert evaluator.can_assign(create_proctor_parameters(
+            {'account': 1234}, defined_tests=['buttoncolortst'])) is False
+        assert evaluator.can_assign(create_proctor_parameters(
+            {'account': 1234}, defined_tests=['buttoncolortst', 'accountrollout'])) is True
+        assert evaluator.can_assign(create_proctor_parameters(
+            {'account': 1234}, defined_tests=['notdownloadedtst'])) is None
+
+    def test_unmapped_identifier_can_be_assigned(self):
+        evaluator, patcher = create_evaluator(['buttoncolortst'])
+        with patcher:
+            evaluator.get_matrix()
+
+        assert evaluator.can_assign(create_proctor_parameters(
+            {'acctid': 1234}, defined_tests=['buttoncolortst'])) is None
+
+    def test_random_test_can_be_assigned(self):
+        matrix_response = {'audit': {'version': '1'}, 'tests': {
+            'randomtst': {'testType': 'RANDOM', 'salt': 'randomtst'}}}
+        evaluator, patcher = create_evaluator(['randomtst'], matrix_response)
+        with patcher:
+            evaluator.get_matrix()
+
+        assert evaluator.can_assign(create_proctor_parameters(
+            {'account': 1234}, defined_tests=['randomtst'])) is True
+
+    def test_unmapped_identifier_falls_back(self):
+        params = create_proctor_parameters({'USER': 'abc123', 'acctid': 1234},
+                                           defined_tests=['buttoncolortst', 'accountrollout'])
+        evaluator, patcher = create_evaluator(['buttoncolortst', 'accountrollout'])
+
+        with patcher:
+            assert evaluator.identify(params) is None
+
+    def test_identifier_named_after_type(self):
+        params = create_proctor_parameters({'ACCOUNT': 1234}, defined_tests=['accountrollout'])
+        evaluator = local.LocalEvaluator('fake-proctor-api-url', ['accountrollout'])
+
+        with mock.patch('proctor.api.call_proctor_matrix', return_value=MATRIX_RESPONSE):
+            api_response = evaluator.identify(params)
+
+        assert api_response['data']['groups']['accountrollout']['value'] == -1
+
+    def test_shared_salt_ignores_test_name(self):
+        definition = {'salt': '&shared'}
+        assert (local.get_test_salt('onetst', definition) ==
+                local.get_test_salt('othertst', definition))
+
+    def test_parse_force_groups(self):
+        assert local.parse_force_groups('buttoncolortst2,rollouttst-1,') == {
+            'buttoncolortst': 2, 'rollouttst': -1}
+
+
+class TestIdentifyWithEvaluator:
+
+    @mock.patch('proctor.api.call_proctor_identify')
+    def test_api_not_called(self, mock_call_proctor_identify):
+        params = create_proctor_parameters({'USER': 'abc123'}, defined_tests=['buttoncolortst'])
+        evaluator, patcher = create_evaluator(['buttoncolortst'])
+
+        with patcher:
+            proc = identify.identify_groups(params, evaluator=evaluator)
+
+        assert proc.buttoncolortst.group == 'blue'
+        assert proc.buttoncolortst.payload == '#2B60DE'
+        mock_call_proctor_identify.assert_not_called()
+
+    @mock.patch('proctor.api.call_proctor_identify')
+    def test_unused_identifier_types_not_evaluated(self, mock_call_proctor_identify):
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['buttoncolortst'])
+        evaluator, patcher = create_evaluator(['buttoncolortst'])
+        with patcher:
+            evaluator.get_matrix()
+
+        with mock.patch.object(evaluator, 'identify') as mock_identify:
+            proc = identify.identify_groups(params, evaluator=evaluator)
+
+        assert proc.buttoncolortst.group is None
+        mock_identify.assert_not_called()
+        mock_call_proctor_identify.assert_not_called()
+
+    @mock.patch('proctor.api.call_proctor_identify')
+    def test_unmapped_identifier_identified_by_api(self, mock_call_proctor_identify):
+        mock_call_proctor_identify.return_value = {'data': {
+            'groups': {'accountrollout': {'name': 'active', 'value': 1}},
+            'audit': {'version': '42'},
+        }}
+        params = create_proctor_parameters({'acctid': 1234}, defined_tests=['accountrollout'])
+        evaluator, patcher = create_evaluator(['accountrollout'])
+        with patcher:
+            evaluator.get_matrix()
+
+        proc = identify.identify_groups(params, evaluator=evaluator)
+
+        assert proc.accountrollout.value == 1
+        mock_call_proctor_identify.assert_called_once()
+
+    @mock.patch('proctor.api.call_proctor_identify')
+    def test_api_called_when_evaluation_unsupported(self, mock_call_proctor_identify):
+        mock_call_proctor_identify.return_value = None
+        params = create_proctor_parameters({'USER': 'abc123'}, defined_tests=['contexttst'])
+        evaluator, patcher = create_evaluator(['contexttst'])
+
+        with patcher:
+            proc = identify.identify_groups(params, evaluator=evaluator)
+
+        assert proc.contexttst.group is None
+        mock_call_proctor_identify.assert_called_once()
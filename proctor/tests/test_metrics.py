@@ -0,0 +1,112 @@
+from __future__ import absolute_import, unicode_literals
+
+import django.core.cache
+import mock
+import pytest
+import requests
+
+from proctor import api
+from proctor import cache
+from proctor import metrics
+from proctor.tests.utils import create_proctor_parameters
+
+
+@pytest.fixture
+def sink():
+    memory_sink = metrics.MemorySink(buckets=(0.1, 1.0))
+    metrics.add_sink(memory_sink)
+    yield memory_sink
+    metrics.remove_sink(memory_sink)
+
+
+class TestMemorySink:
+
+    def test_counters(self, sink):
+        metrics.increment('calls', {'outcome': 'success'})
+        metrics.increment('calls', {'outcome': 'success'}, 2)
+
+        assert sink.get_counter('calls', outcome='success') == 3
+        assert sink.get_counter('calls', outcome='timeout') == 0
+
+    def test_histograms(self, sink):
+        metrics.observe('seconds', {}, 0.05)
+        metrics.observe('seconds', {}, 0.5)
+        metrics.observe('seconds', {}, 5)
+
+        _, histograms = sink.snapshot()
+        histogram = histograms[('seconds', ())]
+        assert histogram.counts == (1, 1)
+        assert histogram.count == 3
+        assert histogram.sum == pytest.approx(5.55)
+
+    def test_nothing_recorded_without_sinks(self):
+        memory_sink = metrics.MemorySink()
+        metrics.increment('calls', {})
+        assert memory_sink.snapshot() == ({}, {})
+
+
+class TestFormatPrometheus:
+
+    def test_format(self, sink):
+        metrics.increment('proctor_api_calls_total', {'method': 'groups/identify',
+                                                      'outcome': 'success'})
+        metrics.observe('proctor_api_seconds', {'method': 'groups/identify'}, 0.5)
+
+        assert metrics.format_prometheus(sink) == (
+            '# TYPE proctor_api_calls_total counter\n'
+            'proctor_api_calls_total{method="groups/identify",outcome="success"} 1\n'
+            '# TYPE proctor_api_seconds histogram\n'
+            'proctor_api_seconds_bucket{method="groups/identify",le="0.1"} 0\n'
+            'proctor_api_seconds_bucket{method="groups/identify",le="1.0"} 1\n'
+            'proctor_api_seconds_bucket{method="groups/identify",le="+Inf"} 1\n'
+            'proctor_api_seconds_count{method="groups/identify"} 1\n'
+            'proctor_api_seconds_sum{method="groups/identify"} 0.5\n'
+        )
+
+
+class TestStatsdSink:
+
+    def test_stat_names(self):
+        client = mock.Mock()
+        statsd_sink = metrics.StatsdSink(client)
+        statsd_sink.increment('proctor_cache_lookups_total',
+                              {'result': 'hit', 'cacher': 'CacheCacher'}, 1)
+        statsd_sink.observe('proctor_api_seconds', {'method': 'groups/identify'}, 0.25)
+
+        client.incr.assert_called_once_with('proctor_cache_lookups_total.CacheCacher.hit', 1)
+        client.timing.assert_called_once_with('proctor_api_seconds.groups/identify', 250)
+
+
+class TestInstrumentation:
+
+    def test_cache_lookups(self, sink):
+        django.core.cache.caches['default'].clear()
+        params = create_proctor_parameters({'account': 1234})
+        cacher = cache.CacheCacher()
+        cacher.get(None, params)
+        cacher.update_matrix_version({'data': {'audit': {'version': '1'}}})
+        cacher.get(None, params)
+
+        assert sink.get_counter('proctor_cache_lookups_total',
+                                cacher='CacheCacher', result='expired') == 1
+        assert sink.get_counter('proctor_cache_lookups_total',
+                                cacher='CacheCacher', result='miss') == 1
+
+    def test_api_outcomes(self, sink):
+        params = create_proctor_parameters({'account': 1234})
+        http = mock.Mock()
+        http.get.side_effect = requests.exceptions.ConnectionError()
+        api.call_proctor(params, http=http, deadline_seconds=None)
+
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {'data': {'groups': {}, 'audit': {'version': '1'}}}
+        http.get.side_effect = None
+        http.get.return_value = response
+        api.call_proctor(params, http=http)
+
+        assert sink.get_counter('proctor_api_calls_total', method='groups/identify',
+                                outcome='connection_error') == 1
+        assert sink.get_counter('proctor_api_calls_total', method='groups/identify',
+                                outcome='success') == 1
+        _, histograms = sink.snapshot()
+        assert histograms[('proctor_api_seconds', (('method', 'groups/identify'),))].count == 2
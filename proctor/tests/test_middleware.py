@@ -1,8 +1,11 @@
 from __future__ import absolute_import, unicode_literals
 
 from unittest import TestCase
-from mock import Mock
+from django.test import override_settings
+from mock import Mock, patch
 
+from proctor.decorators import proctor_tests
+from proctor.groups import GroupAssignment
 from proctor.middleware import BaseProctorMiddleware
 
 
@@ -47,3 +50,93 @@ class TestBaseProctorMiddleware(TestCase):
             raise AssertionError(msg)
 
         get_response_callback.assert_called_once_with(request)
+
+    def test_watcher_registers_cacher(self):
+        watcher = Mock()
+        with patch.object(self.middleware_class, 'get_watcher', return_value=watcher):
+            middleware = self.middleware_class()
+
+        watcher.register.assert_any_call(middleware.cacher)
+        watcher.ensure_running.assert_called_once_with()
+
+        middleware.process_request(Mock(proc=None))
+        assert watcher.ensure_running.call_count == 2
+
+    def test_cacher_updates_response(self):
+        self.middleware.cacher = Mock()
+        request = Mock(GET={})
+        response = Mock()
+
+        assert self.middleware.process_response(request, response) is response
+        self.middleware.cacher.update_response.assert_called_once_with(request, response)
+
+    @override_settings(PROCTOR_CACHE_METHOD='cookie', SESSION_COOKIE_SECURE=True,
+                       PROCTOR_CACHE_COOKIE_SAMESITE='Strict')
+    def test_cookie_cacher_follows_session_cookie(self):
+        cacher = self.middleware_class().cacher
+
+        assert cacher.secure
+        assert cacher.samesite == 'Strict'
+
+
+def make_view():
+    def view(request):
+        pass
+    return view
+
+
+class TestViewTests(TestCase):
+
+    def setUp(self):
+        settings_override = override_settings(
+            PROCTOR_TESTS=['buttoncolortst', 'algotst', 'newfeaturetst'])
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.middleware = ProctorMiddleware()
+        self.request = Mock(proc=None)
+        self.middleware.process_request(self.request)
+
+    def get_loaded_tests(self, view_func):
+        assignment = GroupAssignment(group='active', value=1, payload=None)
+        with patch('proctor.identify.load_group_dict') as mock_load_group_dict:
+            mock_load_group_dict.side_effect = lambda params, *args: {
+                test_name: assignment for test_name in params.defined_tests}
+            self.middleware.process_view(self.request, view_func, (), {})
+            str(self.request.proc)
+        if not mock_load_group_dict.called:
+            return None
+        return mock_load_group_dict.call_args[0][0].defined_tests
+
+    def test_undeclared_view_gets_all_tests(self):
+        assert self.get_loaded_tests(make_view()) == ['buttoncolortst', 'algotst', 'newfeaturetst']
+
+    def test_declared_view_gets_its_tests(self):
+        scoped_view = proctor_tests('newfeaturetst', 'buttoncolortst', 'unknowntst')(make_view())
+
+        assert self.get_loaded_tests(scoped_view) == ['buttoncolortst', 'newfeaturetst']
+        assert self.request.proc.buttoncolortst.group == 'active'
+        assert not hasattr(self.request.proc, 'algotst')
+
+    def test_class_based_view_attribute(self):
+        view_func = Mock(spec=['view_class'])
+        view_func.view_class.proctor_tests = ('algotst',)
+
+        assert self.get_loaded_tests(view_func) == ['algotst']
+
+    def test_view_without_tests_skips_identify(self):
+        assert self.get_loaded_tests(proctor_tests()(make_view())) is None
+        assert str(self.request.proc) == ''
+
+    def test_request_scoped_cacher_gets_all_tests(self):
+        self.middleware.cacher = Mock(request_scoped=True)
+
+        assert self.get_loaded_tests(proctor_tests('algotst')(make_view())) == [
+            'buttoncolortst', 'algotst', 'newfeaturetst']
+
+    def test_proc_used_before_view_keeps_all_tests(self):
+        with patch('proctor.identify.load_group_dict') as mock_load_group_dict:
+            mock_load_group_dict.return_value = {
+                'buttoncolortst': GroupAssignment(group='active', value=1, payload=None)}
+            str(self.request.proc)
+
+        assert self.get_loaded_tests(proctor_tests('algotst')(make_view())) is None
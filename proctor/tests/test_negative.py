@@ -0,0 +1,101 @@
+from __future__ import absolute_import, unicode_literals
+
+import mock
+import pytest
+import requests
+
+from proctor import api
+from proctor import constants
+from proctor import negative
+from proctor.tests.utils import create_proctor_parameters
+
+
+@pytest.fixture
+def negative_cache():
+    negative.configure(5)
+    yield negative.get_negative_cache()
+    negative.configure(None)
+
+
+def _http_response(status_code):
+    response = mock.Mock(status_code=status_code, reason='Error')
+    response.json.return_value = {'meta': {'error': 'Error'}}
+    return response
+
+
+class TestNegativeCache:
+
+    def setup_method(self):
+        self.params = create_proctor_parameters({'account': 1234})
+        self.other_params = create_proctor_parameters({'account': 5678})
+
+    def test_params_failure(self):
+        negative_cache = negative.NegativeCache(5)
+        negative_cache.record_failure(self.params, constants.API_METHOD_GROUPS_IDENTIFY,
+                                      root_wide=False)
+
+        assert negative_cache.is_failing(
+            self.params, constants.API_METHOD_GROUPS_IDENTIFY) == 'params'
+        assert negative_cache.is_failing(
+            self.other_params, constants.API_METHOD_GROUPS_IDENTIFY) is None
+        assert negative_cache.is_failing(
+            self.params, constants.API_METHOD_PROCTOR_MATRIX) is None
+
+    def test_root_failure(self):
+        negative_cache = negative.NegativeCache(5)
+        negative_cache.record_failure(self.params, constants.API_METHOD_GROUPS_IDENTIFY,
+                                      root_wide=True)
+
+        assert negative_cache.is_failing(
+            self.other_params, constants.API_METHOD_PROCTOR_MATRIX) == 'root'
+
+    def test_entries_expire(self):
+        negative_cache = negative.NegativeCache(5)
+        with mock.patch('time.time', return_value=1000):
+            negative_cache.record_failure(self.params, constants.API_METHOD_GROUPS_IDENTIFY,
+                                          root_wide=True)
+        with mock.patch('time.time', return_value=1005):
+            assert negative_cache.is_failing(
+                self.params, constants.API_METHOD_GROUPS_IDENTIFY) is None
+
+
+class TestCallProctor:
+
+    def setup_method(self):
+        self.params = create_proctor_parameters({'account': 1234})
+        self.other_params = create_proctor_parameters({'account': 5678})
+
+    def test_disabled_by_default(self):
+        http = mock.Mock()
+        http.get.side_effect = requests.exceptions.ConnectionError()
+
+        api.call_proctor(self.params, http=http, deadline_seconds=None)
+        api.call_proctor(self.params, http=http, deadline_seconds=None)
+        assert http.get.call_count == 2 * constants.MAX_HTTP_RETRIES
+
+    def test_connection_error_skips_api_root(self, negative_cache):
+        http = mock.Mock()
+        http.get.side_effect = requests.exceptions.ConnectionError()
+
+        assert api.call_proctor(self.params, http=http, deadline_seconds=None) is None
+        calls = http.get.call_count
+        assert api.call_proctor(self.other_params, http=http) is None
+        assert http.get.call_count == calls
+
+    def test_client_error_skips_params(self, negative_cache):
+        http = mock.Mock()
+        http.get.return_value = _http_response(400)
+
+        assert api.call_proctor(self.params, http=http) is None
+        assert api.call_proctor(self.params, http=http) is None
+        assert http.get.call_count == 1
+        api.call_proctor(self.other_params, http=http)
+        assert http.get.call_count == 2
+
+    def test_server_error_skips_api_root(self, negative_cache):
+        http = mock.Mock()
+        http.get.return_value = _http_response(503)
+
+        api.call_proctor(self.params, http=http)
+        api.call_proctor(self.other_params, http=http)
+        assert http.get.call_count == 1
@@ -0,0 +1,82 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+
+import mock
+import pytest
+from six.moves import BaseHTTPServer
+
+from proctor import api
+from proctor import session
+from proctor.tests.utils import create_proctor_parameters
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'{"data": {"groups": {}, "audit": {"version": "1"}}}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_root():
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:{0}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+class TestSessionManager:
+
+    def test_session_shared(self):
+        manager = session.SessionManager()
+        assert manager.get_session() is manager.get_session()
+
+    def test_session_recreated_after_fork(self):
+        manager = session.SessionManager()
+        parent_session = manager.get_session()
+
+        with mock.patch('os.getpid', return_value=-1):
+            assert manager.get_session() is not parent_session
+
+    def test_connections_reused(self, api_root):
+        manager = session.SessionManager()
+        params = create_proctor_parameters({'USER': 'abc123'})
+        params.api_root = api_root
+
+        for _ in range(3):
+            assert api.call_proctor(params, http=manager.get_session()) is not None
+
+        assert manager.stats() == {'connections': 1, 'requests': 3, 'reused': 2}
+        manager.close()
+
+    def test_idle_connections_reaped(self, api_root):
+        manager = session.SessionManager(idle_timeout_seconds=60)
+        params = create_proctor_parameters({'USER': 'abc123'})
+        params.api_root = api_root
+
+        with mock.patch('time.time', return_value=1000):
+            api.call_proctor(params, http=manager.get_session())
+        with mock.patch('time.time', return_value=1061):
+            api.call_proctor(params, http=manager.get_session())
+
+        assert manager.stats() == {'connections': 2, 'requests': 2, 'reused': 0}
+        manager.close()
+
+    def test_call_proctor_uses_default_session(self):
+        params = create_proctor_parameters({'USER': 'abc123'})
+        with mock.patch.object(session, 'get_session') as mock_get_session:
+            api.call_proctor(params)
+
+        mock_get_session.return_value.get.assert_called()
@@ -0,0 +1,123 @@
+from __future__ import absolute_import, unicode_literals
+
+import os
+
+import mock
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+from proctor import cache
+from proctor import shm
+from proctor.groups import GroupAssignment
+from proctor.tests.utils import create_proctor_parameters
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('proctor.shm'))
+
+
+class TestSharedTable:
+
+    def test_values_shared_between_tables(self, path):
+        shm.SharedTable(path, slot_count=8, slot_size=256).set('0123456789abcdef0123', [1, 'a'])
+
+        assert shm.SharedTable(path, slot_count=8, slot_size=256).get(
+            '0123456789abcdef0123') == [1, 'a']
+
+    def test_colliding_key_replaces_slot(self, path):
+        table = shm.SharedTable(path, slot_count=8, slot_size=256)
+        table.set('00000000aaaaaaaaaaaa', 'first')
+        table.set('00000008bbbbbbbbbbbb', 'second')
+
+        assert table.get('00000000aaaaaaaaaaaa') is None
+        assert table.get('00000008bbbbbbbbbbbb') == 'second'
+
+    def test_large_values_not_stored(self, path):
+        table = shm.SharedTable(path, slot_count=8, slot_size=64)
+
+        assert not table.set('0123456789abcdef0123', 'x' * 64)
+        assert table.get('0123456789abcdef0123') is None
+
+    def test_delete(self, path):
+        table = shm.SharedTable(path, slot_count=8, slot_size=256)
+        table.set('0123456789abcdef0123', 'value')
+        table.delete('0123456789abcdef0123')
+
+        assert table.get('0123456789abcdef0123') is None
+
+    def test_version_expires(self, path):
+        table = shm.SharedTable(path, slot_count=8, slot_size=256)
+        with mock.patch('time.time', return_value=1000):
+            table.set_version('42', 1010)
+            assert table.get_version() == '42'
+        with mock.patch('time.time', return_value=1010):
+            assert table.get_version() is None
+
+    def test_read_during_write_misses(self, path):
+        table = shm.SharedTable(path, slot_count=8, slot_size=256)
+        table.set('0123456789abcdef0123', 'value')
+        offset = table._get_slot_offset('0123456789abcdef0123')
+
+        with table._writing(offset):
+            assert table.get('0123456789abcdef0123') is None
+        assert table.get('0123456789abcdef0123') == 'value'
+
+    def test_different_layout_replaced(self, path):
+        old_table = shm.SharedTable(path, slot_count=16, slot_size=256)
+        old_table.set('0123456789abcdef0123', 'value')
+        old_size = os.path.getsize(path)
+        table = shm.SharedTable(path, slot_count=8, slot_size=256)
+
+        assert os.path.getsize(path) == table.size
+        assert table.get('0123456789abcdef0123') is None
+        # The old file isn't shrunk under processes that still map it.
+        assert os.fstat(old_table._fd).st_size == old_size
+        assert old_table.get('0123456789abcdef0123') == 'value'
+
+    def test_symlink_not_followed(self, path, tmpdir):
+        target = str(tmpdir.join('target'))
+        open(target, 'w').close()
+        os.symlink(target, path)
+
+        with pytest.raises(OSError):
+            shm.SharedTable(path, slot_count=8, slot_size=256)
+        assert os.path.getsize(target) == 0
+
+    def test_other_users_file_refused(self, path):
+        with mock.patch('os.geteuid', return_value=os.geteuid() + 1):
+            with pytest.raises(ImproperlyConfigured):
+                shm.SharedTable(path, slot_count=8, slot_size=256)
+
+    def test_default_path_per_user_and_layout(self):
+        path = shm.get_default_path('http://pipet', 8, 256)
+
+        assert path == shm.get_default_path('http://pipet', 8, 256)
+        assert str(os.geteuid()) in os.path.basename(path)
+        assert path != shm.get_default_path('http://pipet', 16, 256)
+        assert path != shm.get_default_path('http://other-pipet', 8, 256)
+        with mock.patch('os.geteuid', return_value=os.geteuid() + 1):
+            assert path != shm.get_default_path('http://pipet', 8, 256)
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason="needs fork")
+    def test_write_from_forked_worker(self, path):
+        table = shm.SharedTable(path, slot_count=8, slot_size=256)
+
+        pid = os.fork()
+        if pid == 0:
+            table.set('0123456789abcdef0123', 'from child')
+            os._exit(0)
+        os.waitpid(pid, 0)
+
+        assert table.get('0123456789abcdef0123') == 'from child'
+
+
+class TestSharedMemoryCacher:
+
+    def test_hit_from_other_worker(self, path):
+        params = create_proctor_parameters({'account': 1234}, defined_tests=['fake_proctor_test'])
+        group_dict = {'fake_proctor_test': GroupAssignment('active', 1, {'color': '#000'})}
+        api_response = {'data': {'groups': {}, 'audit': {'version': '1'}}}
+        cache.SharedMemoryCacher(path).set(None, params, group_dict, api_response)
+
+        assert cache.SharedMemoryCacher(path).get(None, params) == group_dict
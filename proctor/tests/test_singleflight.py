@@ -0,0 +1,91 @@
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import time
+
+import mock
+import pytest
+
+from proctor import cache
+from proctor import identify
+from proctor import singleflight
+from proctor.tests.test_identify import mock_http_get_data
+from proctor.tests.utils import create_proctor_parameters
+
+
+def wait_for_dups(flight, key, dups):
+    for _ in range(500):
+        call = flight._calls.get(key)
+        if call is not None and call.dups == dups:
+            return
+        time.sleep(0.01)
+    raise AssertionError("Callers never joined the in-flight call.")
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+
+    def run(index):
+        results[index] = target()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+class TestSingleFlight:
+
+    def test_concurrent_calls_share_result(self):
+        flight = singleflight.SingleFlight()
+        release = threading.Event()
+        fn = mock.Mock(side_effect=lambda: release.wait() and 'result')
+
+        threads, results = run_concurrently(4, lambda: flight.do('key', fn))
+        wait_for_dups(flight, 'key', 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        fn.assert_called_once()
+        assert sorted(results) == [('result', False), ('result', True),
+                                   ('result', True), ('result', True)]
+
+    def test_sequential_calls_not_shared(self):
+        flight = singleflight.SingleFlight()
+        fn = mock.Mock(return_value='result')
+
+        flight.do('key', fn)
+        flight.do('key', fn)
+
+        assert fn.call_count == 2
+
+    def test_exception_raised_to_caller(self):
+        flight = singleflight.SingleFlight()
+
+        with pytest.raises(ValueError):
+            flight.do('key', mock.Mock(side_effect=ValueError()))
+        assert not flight._calls
+
+
+class TestLoadGroupDictCoalescing:
+
+    def test_concurrent_misses_make_one_api_call(self):
+        params = create_proctor_parameters({'account': 4321}, defined_tests=['fake_proctor_test'])
+        mock_requests = mock_http_get_data({'fake_proctor_test': {'name': 'active', 'value': 1}})
+        response = mock_requests.get.return_value
+        release = threading.Event()
+        mock_requests.get.side_effect = lambda *args, **kwargs: release.wait() and response
+        cacher = cache.CacheCacher()
+        cacher.set = mock.Mock()
+
+        threads, results = run_concurrently(3, lambda: identify.load_group_dict(
+            params, cacher=cacher, http=mock_requests))
+        wait_for_dups(identify._in_flight, params.fingerprint, 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        mock_requests.get.assert_called_once()
+        cacher.set.assert_called_once()
+        assert all(result['fake_proctor_test'].group == 'active' for result in results)
@@ -0,0 +1,173 @@
+from __future__ import absolute_import, unicode_literals
+
+import time
+
+import mock
+import pytest
+import requests
+from django.test import override_settings
+
+import proctor
+from proctor import apps
+from proctor import cache
+from proctor import local
+from proctor import watcher
+
+API_ROOT = 'http://pipet.example.com'
+
+
+def _matrix_response(version):
+    return {
+        'audit': {'version': version},
+        'tests': {'buttoncolortst': {'version': 1, 'buckets': []}},
+    }
+
+
+def _http_response(status_code, json_data=None, headers=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = json_data
+    return response
+
+
+def _watcher(http):
+    return watcher.MatrixWatcher(API_ROOT, ['buttoncolortst'], http=http)
+
+
+class TestMatrixWatcher:
+
+    def test_poll_publishes_matrix(self):
+        http = mock.Mock()
+        http.get.return_value = _http_response(200, _matrix_response('5'))
+        matrix_watcher = _watcher(http)
+        target = mock.Mock()
+        matrix_watcher.register(target)
+
+        assert matrix_watcher.poll()
+        assert matrix_watcher.version == '5'
+        target.publish_matrix.assert_called_once_with(_matrix_response('5'))
+
+    def test_register_publishes_current_matrix(self):
+        http = mock.Mock()
+        http.get.return_value = _http_response(200, _matrix_response('5'))
+        matrix_watcher = _watcher(http)
+        matrix_watcher.poll()
+
+        target = mock.Mock()
+        matrix_watcher.register(target)
+        target.publish_matrix.assert_called_once_with(_matrix_response('5'))
+
+    def test_not_modified_reuses_matrix(self):
+        http = mock.Mock()
+        http.get.side_effect = [
+            _http_response(200, _matrix_response('5'), headers={'ETag': '"abc"'}),
+            _http_response(304),
+        ]
+        matrix_watcher = _watcher(http)
+        matrix_watcher.poll()
+
+        assert matrix_watcher.poll()
+        assert matrix_watcher.version == '5'
+        assert http.get.call_args[1]['headers'] == {'If-None-Match': '"abc"'}
+
+    def test_failed_poll_publishes_nothing(self):
+        http = mock.Mock()
+        http.get.side_effect = requests.exceptions.ConnectionError()
+        matrix_watcher = _watcher(http)
+        target = mock.Mock()
+        matrix_watcher.register(target)
+
+        assert not matrix_watcher.poll()
+        assert not target.publish_matrix.called
+
+    def test_unexpected_error_reported_to_breaker(self):
+        http = mock.Mock()
+        http.get.side_effect = ValueError()
+        matrix_watcher = _watcher(http)
+
+        with mock.patch('proctor.breaker.CircuitBreaker.record_failure') as mock_record_failure:
+            with pytest.raises(ValueError):
+                matrix_watcher.poll()
+
+        mock_record_failure.assert_called_once_with()
+
+    def test_publish_to_cacher(self):
+        http = mock.Mock()
+        http.get.return_value = _http_response(200, _matrix_response('5'))
+        matrix_watcher = _watcher(http)
+        cacher = cache.SessionCacher()
+        matrix_watcher.register(cacher)
+
+        matrix_watcher.poll()
+        assert cacher._get_latest_version() == '5'
+
+    def test_publish_to_evaluator(self):
+        http = mock.Mock()
+        http.get.return_value = _http_response(200, _matrix_response('5'))
+        matrix_watcher = _watcher(http)
+        evaluator = local.LocalEvaluator(API_ROOT, ['buttoncolortst'])
+        matrix_watcher.register(evaluator)
+
+        matrix_watcher.poll()
+        with mock.patch('proctor.api.call_proctor_matrix') as call_proctor_matrix:
+            assert evaluator.get_matrix()['audit'] == {'version': '5'}
+        assert not call_proctor_matrix.called
+
+    def test_thread_polls_until_stopped(self):
+        http = mock.Mock()
+        http.get.return_value = _http_response(200, _matrix_response('5'))
+        matrix_watcher = _watcher(http)
+        matrix_watcher.interval_seconds = 0.01
+
+        matrix_watcher.ensure_running()
+        try:
+            deadline = time.time() + 5
+            while http.get.call_count < 2 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            matrix_watcher.stop()
+        matrix_watcher._thread.join(5)
+
+        assert http.get.call_count >= 2
+        assert not matrix_watcher._thread.is_alive()
+
+
+class TestGetDefaultWatcher:
+
+    def test_disabled_by_default(self):
+        assert watcher.get_default_watcher() is None
+
+    @override_settings(PROCTOR_WATCH_MATRIX=True, PROCTOR_API_ROOT=API_ROOT,
+                       PROCTOR_TESTS=('buttoncolortst',), PROCTOR_WATCH_MATRIX_INTERVAL=5)
+    def test_enabled(self):
+        with mock.patch('proctor.watcher._default_watcher', None):
+            default_watcher = watcher.get_default_watcher()
+            assert default_watcher.interval_seconds == 5
+            assert watcher.get_default_watcher() is default_watcher
+
+
+class TestProctorConfig:
+
+    @override_settings(PROCTOR_WATCH_MATRIX_ON_STARTUP=True)
+    def test_ready_starts_watcher(self):
+        matrix_watcher = mock.Mock()
+        with mock.patch.object(watcher, 'get_default_watcher', return_value=matrix_watcher), \
+                mock.patch('os.register_at_fork', create=True) as mock_register_at_fork:
+            apps.ProctorConfig('proctor', proctor).ready()
+
+        matrix_watcher.ensure_running.assert_called_once_with()
+        mock_register_at_fork.assert_called_once_with(
+            after_in_child=matrix_watcher.ensure_running)
+
+    def test_ready_doesnt_start_watcher_by_default(self):
+        matrix_watcher = mock.Mock()
+        with mock.patch.object(watcher, 'get_default_watcher', return_value=matrix_watcher):
+            apps.ProctorConfig('proctor', proctor).ready()
+
+        matrix_watcher.ensure_running.assert_not_called()
+
+    @override_settings(PROCTOR_WATCH_MATRIX_ON_STARTUP=True)
+    def test_ready_without_watcher(self):
+        with mock.patch.object(watcher, 'get_default_watcher', return_value=None):
+            apps.ProctorConfig('proctor', proctor).ready()
@@ -8,4 +8,5 @@ urlpatterns = [
    url(r'^showTestMatrix/', private.ShowTestMatrixView.as_view(), name='showtestmatrix'),
    url(r'^proctor/show', private.ShowTestMatrixView.as_view(), name='proctor_showtestmatrix'),
    url(r'^proctor/force/', private.ForceGroupsView.as_view(), name='forcegroups'),
+   url(r'^proctor/metrics', private.MetricsView.as_view(), name='proctor_metrics'),
 ]
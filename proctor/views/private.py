@@ -8,7 +8,7 @@ from django.conf import settings
 from django.views import generic
 from django.shortcuts import render
 
-from .. import api, constants, matrix, settings as local_settings
+from .. import api, constants, lazy, matrix, metrics, settings as local_settings
 
 
 class ShowTestMatrixView(generic.View):
@@ -43,6 +43,23 @@ class ShowTestMatrixView(generic.View):
         return HttpResponse(json_data, content_type='application/json;charset=UTF-8')
 
 
+class MetricsView(generic.View):
+    """
+    Django view that exposes django-proctor's cache and API metrics in the
+    Prometheus text format.
+
+    Requires the PROCTOR_METRICS setting. The metrics are per process, so
+    each worker reports its own.
+    """
+
+    def get(self, request):
+        if not request.is_privileged:
+            raise Http404
+
+        return HttpResponse(metrics.format_prometheus(metrics.get_memory_sink()),
+                            content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class ForceGroupsView(generic.TemplateView):
     template_name = "proctor_groups.html"
 
@@ -60,6 +77,9 @@ class ForceGroupsView(generic.TemplateView):
         )
         test_matrix = matrix.identify_matrix(params, request=request)
 
+        if isinstance(request.proc, lazy.LazyProctorGroups):
+            # Lazy groups have no group_dict until they're loaded.
+            request.proc.load()
         your_groups = {test_name: assignment.value
                        for test_name, assignment in six.iteritems(request.proc._group_dict)}
 
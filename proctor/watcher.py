@@ -0,0 +1,214 @@
+"""
+Watch the Proctor test matrix version in a background thread.
+
+Without a watcher, the matrix version is only learned from /groups/identify
+responses. When a cacher's version expires, the next request is a forced cache
+miss and waits for a synchronous API call, and every process discovers a new
+version on its own.
+
+MatrixWatcher polls the /proctor/matrix endpoint on a schedule and publishes
+the result to every registered cacher (and local evaluator). As long as the
+poll interval is shorter than their version timeout, requests never wait on a
+version refresh, and every process sees a new version within one interval.
+
+Polls use a conditional request (If-None-Match / If-Modified-Since) when Pipet
+provides an ETag or Last-Modified header, so an unchanged matrix isn't
+downloaded again.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import os
+import threading
+import weakref
+
+import requests
+from django.conf import settings
+
+from . import api
+from . import breaker as circuit_breaker
+from . import constants
+from . import session
+
+logger = logging.getLogger('application.proctor.watcher')
+
+DEFAULT_INTERVAL_SECONDS = 30
+
+
+class MatrixWatcher(object):
+    """
+    Poll the test matrix and publish it to registered targets.
+
+    Targets are objects with a publish_matrix(matrix_response) method, like
+    cache.Cacher and local.LocalEvaluator. They are held weakly.
+
+    api_root: The root URL of the Proctor API. No trailing slash.
+    defined_tests: List of test names this application uses.
+    interval_seconds: Time between polls. Default: 30 seconds
+    http: Instance of requests.Session (or equivalent). If None, the
+        process-wide pooled session is used.
+    """
+
+    def __init__(self, api_root, defined_tests, interval_seconds=None, http=None):
+        self.params = api.ProctorParameters(
+            api_root=api_root,
+            defined_tests=defined_tests,
+            context_dict={},
+            identifier_dict={},
+            force_groups=None,
+        )
+        self.interval_seconds = (interval_seconds
+                                 if interval_seconds is not None
+                                 else DEFAULT_INTERVAL_SECONDS)
+        self.http = http
+        self.matrix_response = None
+
+        self._lock = threading.Lock()
+        self._targets = weakref.WeakSet()
+        self._validators = {}
+        self._thread = None
+        self._pid = None
+        self._stopped = threading.Event()
+
+    @property
+    def version(self):
+        if self.matrix_response is None:
+            return None
+        return self.matrix_response['audit']['version']
+
+    def register(self, target):
+        """
+        Publish the matrix to target from now on, starting with the current one.
+        """
+        if target is None:
+            return
+        with self._lock:
+            self._targets.add(target)
+            matrix_response = self.matrix_response
+        if matrix_response is not None:
+            target.publish_matrix(matrix_response)
+
+    def ensure_running(self):
+        """
+        Start the polling thread if it isn't running in this process.
+
+        Threads don't survive a fork, so this is cheap enough to call on every
+        request.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='proctor-matrix-watcher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        with self._lock:
+            self._pid = None
+
+    def poll(self):
+        """
+        Fetch the matrix now and publish it.
+
+        Return True if a (new or unchanged) matrix was published, False if the
+        poll failed.
+        """
+        matrix_response = self._fetch()
+        if matrix_response is None:
+            return False
+
+        with self._lock:
+            if self.version != matrix_response['audit']['version']:
+                logger.info("Proctor test matrix version is now %s.",
+                            matrix_response['audit']['version'])
+            self.matrix_response = matrix_response
+            targets = list(self._targets)
+
+        for target in targets:
+            target.publish_matrix(matrix_response)
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Proctor matrix watcher poll failed.")
+            if self._stopped.wait(self.interval_seconds):
+                return
+
+    def _fetch(self):
+        """
+        Return the matrix response, reusing the last one if it's unchanged.
+        """
+        http = self.http or session.get_session()
+        api_url = api.get_api_url(self.params, constants.API_METHOD_PROCTOR_MATRIX)
+
+        headers = {}
+        if self.matrix_response is not None:
+            headers.update(self._validators)
+
+        breaker = circuit_breaker.get_breaker(self.params.api_root)
+        if not breaker.allow_request():
+            return None
+
+        response = None
+        try:
+            response = http.get(api_url, params=api.get_http_params(self.params),
+                                headers=headers, timeout=constants.MATRIX_WATCHER_TIMEOUT_SECONDS)
+        except requests.exceptions.RequestException:
+            logger.warning("Proctor matrix watcher could not reach %s.", api_url, exc_info=True)
+            return None
+        finally:
+            # Any error, so that a half-open breaker never waits on this call.
+            if response is None:
+                breaker.record_failure()
+
+        api.record_response(breaker, response)
+        if response.status_code == requests.codes.not_modified:
+            return self.matrix_response
+
+        matrix_response = api.parse_response(
+            api_url, constants.API_METHOD_PROCTOR_MATRIX, response)
+        if matrix_response is not None:
+            self._validators = self._get_validators(response)
+        return matrix_response
+
+    def _get_validators(self, response):
+        validators = {}
+        etag = response.headers.get('ETag')
+        if etag:
+            validators['If-None-Match'] = etag
+        last_modified = response.headers.get('Last-Modified')
+        if last_modified:
+            validators['If-Modified-Since'] = last_modified
+        return validators
+
+
+_default_watcher = None
+_default_watcher_lock = threading.Lock()
+
+
+def get_default_watcher():
+    """
+    Return the process-wide MatrixWatcher, or None if the PROCTOR_WATCH_MATRIX
+    Django setting isn't True.
+    """
+    global _default_watcher
+    if not getattr(settings, 'PROCTOR_WATCH_MATRIX', False):
+        return None
+
+    if _default_watcher is None:
+        with _default_watcher_lock:
+            if _default_watcher is None:
+                _default_watcher = MatrixWatcher(
+                    settings.PROCTOR_API_ROOT,
+                    settings.PROCTOR_TESTS,
+                    interval_seconds=getattr(settings, 'PROCTOR_WATCH_MATRIX_INTERVAL', None),
+                )
+    return _default_watcher
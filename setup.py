@@ -39,7 +39,9 @@ setup(
         'ndg-httpsclient',
         'pyOpenSSL',
         'requests',
-        'tenacity>=4.8.0',
     ],
+    extras_require={
+        'async': ['asgiref', 'httpx'],
+    },
     zip_safe=False,
 )